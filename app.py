@@ -1,12 +1,24 @@
 import os
-from datetime import datetime
+from datetime import date, datetime
+from typing import Literal, Optional
 
 import db
+import invalidation
+import metrics
+import profiling
+import request_timing
+import singleflight
+from cache import TTLCache
 from db_setup import get_connection
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, HTTPException, Query, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from psycopg2 import DataError
+from psycopg2.errors import CheckViolation, ForeignKeyViolation
+from response_cache import ResponseCache, ResponseCacheMiddleware
 from schemas import (
+    AutocompleteSuggestion,
     AvailableSlotsOut,
     BookingCreate,
     BookingOut,
@@ -16,6 +28,7 @@ from schemas import (
     BusinessDetail,
     BusinessImageCreate,
     BusinessImageOut,
+    BusinessNearbyOut,
     BusinessOut,
     BusinessUpdate,
     CategoryCreate,
@@ -29,19 +42,50 @@ from schemas import (
     ReviewCreate,
     ReviewOut,
     ReviewUpdate,
+    SearchResponse,
+    ServiceCategoryBatch,
     ServiceCreate,
     ServiceDetail,
+    ServiceFilterResponse,
     ServiceUpdate,
     StaffMemberCreate,
     StaffMemberDetail,
     StaffMemberOut,
     StaffMemberUpdate,
+    StaffServiceBatch,
     UserCreate,
     UserOut,
     UserUpdate,
+    json_fields,
 )
 
-app = FastAPI()
+app = FastAPI(default_response_class=request_timing.TimedJSONResponse)
+
+# Public GET routes served from a whole-response cache (see response_cache.py).
+# ttl: seconds fresh, stale: seconds a stale copy is still served while it refreshes,
+# params: query parameters that may vary, tables: changes that make the entries stale.
+response_cache = ResponseCache({
+    "/businesses/": {
+        "ttl": 30, "stale": 300, "params": (), "tables": ("businesses", "users", "categories"),
+    },
+    "/businesses/top-rated": {
+        "ttl": 60, "stale": 600, "params": ("limit",), "tables": ("businesses", "reviews"),
+    },
+    "/businesses/{business_id}/services": {
+        "ttl": 60, "stale": 300, "params": (),
+        "tables": ("businesses", "services", "categories", "service_categories"),
+    },
+    "/categories/": {
+        "ttl": 300, "stale": 3600, "params": (), "tables": ("categories",),
+    },
+    "/categories/tree": {
+        "ttl": 300, "stale": 3600, "params": (), "tables": ("categories",),
+    },
+})
+invalidation.subscribe(response_cache.mark_stale)
+
+# Added before CORS so it runs inside it and never stores per-origin headers
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache)
 
 app.add_middleware(
     CORSMiddleware,
@@ -51,42 +95,194 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Query count, DB, connect and serialization time per request (Server-Timing, access log)
+app.add_middleware(request_timing.ServerTimingMiddleware)
+
+# Added last so it is outermost and also times cached and failed requests
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+# Hot search-box prefixes, shared by every request in this worker
+autocomplete_cache = TTLCache(maxsize=2048, ttl_seconds=60)
+
+
+def clear_autocomplete_cache(table, entity_id, business_id):
+    # Suggestions come from business, service and category names
+    if table in (None, "businesses", "services", "categories"):
+        autocomplete_cache.clear()
+
+
+invalidation.subscribe(clear_autocomplete_cache)
+
+
+@app.on_event("startup")
+def start_cache_invalidation():
+    invalidation.start_listener()
+
+
+@app.on_event("shutdown")
+def stop_cache_invalidation():
+    invalidation.stop_listener()
+
 
 # --- STATIC FILES: Image Hosting Setup ---
 os.makedirs("static/uploads", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+
+def stream_response(con, chunks, stream: str):
+    """
+    Sends chunks of JSON rows from db.stream_json_rows as a JSON array (stream=json)
+    or as newline-delimited JSON (stream=ndjson), closing the connection when done.
+    """
+    def body():
+        try:
+            if stream == "ndjson":
+                for chunk in chunks:
+                    yield "\n".join(chunk) + "\n"
+            else:
+                yield "["
+                separator = ""
+                for chunk in chunks:
+                    yield separator + ",".join(chunk)
+                    separator = ","
+                yield "]"
+        finally:
+            con.close()
+
+    media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+    return StreamingResponse(body(), media_type=media_type)
+
+
+def csv_response(con, chunks, filename: str):
+    """
+    Sends CSV chunks from db.stream_copy_csv as a downloadable file, closing the connection when done.
+    """
+    def body():
+        try:
+            yield from chunks
+        finally:
+            chunks.close()
+            con.close()
+
+    return StreamingResponse(
+        body(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def catalog_etag(con, keys: list[tuple[str, int]]):
+    """
+    Builds a strong ETag from the versions of the given keys (see db.get_versions).
+    The epoch key is always included, so a database reset never reuses an old ETag.
+    """
+    versions = db.get_versions(con, [("epoch", 0)] + keys)
+    return '"' + "-".join(str(version) for version in versions) + '"'
+
+
+def etag_matches(request: Request, etag: str):
+    """
+    True if the request's If-None-Match header already lists etag (or is *).
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def conditional_get(request: Request, response: Response, con, keys: list[tuple[str, int]]):
+    """
+    Checks the catalog versions before the real query runs.
+    Returns a 304 response if the client's copy is current, otherwise sets the ETag
+    on response and returns None so the route can build the body as usual.
+    """
+    etag = catalog_etag(con, keys)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 #-------------------------#
 #----------GET------------#
 #-------------------------#
 
 @app.get("/businesses/", response_model=list[BusinessDetail], status_code=200)
-def list_businesses():
+@request_timing.query_budget(2)
+def list_businesses(
+    request: Request,
+    response: Response,
+    stream: Optional[Literal["json", "ndjson"]] = None,
+):
     """
     GET /businesses/
     Returns all businesses in the database.
+    The JSON is built by Postgres and sent as-is, skipping per-row validation.
+    With stream=json or stream=ndjson the rows are streamed in chunks instead.
+    Supports If-None-Match.
     """
     con = get_connection()
-    return db.get_all_businesses(con)
+    not_modified = conditional_get(request, response, con, [("businesses", 0), ("categories", 0)])
+    if not_modified:
+        return not_modified
+    if stream:
+        streamed = stream_response(con, db.stream_all_businesses(con, json_fields(BusinessDetail)), stream)
+        streamed.headers.update(response.headers)
+        return streamed
+    body = db.get_all_businesses_json(con, json_fields(BusinessDetail))
+    return Response(content=body, media_type="application/json", headers=dict(response.headers))
 
 
 @app.get("/businesses/top-rated", status_code=200)
+@request_timing.query_budget(1)
+@singleflight.coalesce
 def top_rated_businesses(limit: int = 10):
     """
     GET /businesses/top-rated
     Returns the top-rated businesses, limited by the 'limit' parameter.
+    Concurrent identical requests share one aggregation.
     """
     con = get_connection()
     return db.get_top_rated_businesses(con, limit)
 
 
+@app.get("/businesses/nearby", response_model=list[BusinessNearbyOut], status_code=200)
+@request_timing.query_budget(1)
+def nearby_businesses(
+    lat: float,
+    lon: float,
+    radius_km: float = 5,
+    category_id: Optional[int] = None,
+    include_descendants: bool = False,
+    limit: int = 20,
+):
+    """
+    GET /businesses/nearby?lat=...&lon=...
+    Returns businesses within radius_km of the given point, nearest first.
+    Can be combined with a category filter.
+    """
+    con = get_connection()
+    return db.get_nearby_businesses(
+        con, lat, lon, radius_km, category_id, include_descendants, limit
+    )
+
+
 @app.get("/businesses/{business_id}", response_model=BusinessDetail, status_code=200)
-def get_business(business_id: int):
+@request_timing.query_budget(2)
+def get_business(business_id: int, request: Request, response: Response):
     """
     GET /businesses/id
-    Returns one business, or 404 if not found.
+    Returns one business, or 404 if not found. Supports If-None-Match.
     """
     con = get_connection()
+    not_modified = conditional_get(
+        request, response, con, [("business", business_id), ("categories", 0)]
+    )
+    if not_modified:
+        return not_modified
     business = db.get_business_by_id(con, business_id)
     if not business:
         raise HTTPException(status_code=404, detail="Business not found")
@@ -94,6 +290,7 @@ def get_business(business_id: int):
 
 
 @app.get("/users/", response_model=list[UserOut], status_code=200)
+@request_timing.query_budget(1)
 def list_users():
     """
     GET /users/
@@ -104,6 +301,7 @@ def list_users():
 
 
 @app.get("/users/{user_id}", response_model=UserOut, status_code=200)
+@request_timing.query_budget(1)
 def get_user(user_id: int):
     """
     GET /users/id
@@ -117,23 +315,41 @@ def get_user(user_id: int):
 
 
 @app.get("/categories/", response_model=list[CategoryOut], status_code=200)
-def list_categories():
+@request_timing.query_budget(2)
+def list_categories(request: Request, response: Response):
     """
     GET /categories/
-    Returns all categories in the database.
+    Returns all categories in the database. Supports If-None-Match.
     """
     con = get_connection()
+    not_modified = conditional_get(request, response, con, [("categories", 0)])
+    if not_modified:
+        return not_modified
     return db.get_all_categories(con)
 
 @app.get("/categories/tree")
-def get_category_tree():
+@request_timing.query_budget(2)
+def get_category_tree(request: Request, response: Response):
     """
     GET /categories/tree
-    Returns the full category hierarchy as nested dictionaries.
+    Returns the full category hierarchy as nested dictionaries. Supports If-None-Match.
+    Concurrent requests share one build of the tree.
     """
     con = get_connection()
-    categories = db.get_all_categories(con)
+    not_modified = conditional_get(request, response, con, [("categories", 0)])
+    if not_modified:
+        return not_modified
+    # Keyed by ETag too, so a request never gets a tree older than its ETag says
+    return singleflight.do(
+        ("categories/tree", response.headers["ETag"]),
+        lambda: build_category_tree(db.get_all_categories(con)),
+    )
 
+
+def build_category_tree(categories):
+    """
+    Nests a flat list of categories under their parents and returns the roots.
+    """
     # Build {id: category_dict}
     nodes = {c["id"]: {**c, "children": []} for c in categories}
 
@@ -150,12 +366,16 @@ def get_category_tree():
     return roots
 
 @app.get("/categories/{category_id}", response_model=CategoryOut, status_code=200)
-def get_category(category_id: int):
+@request_timing.query_budget(2)
+def get_category(category_id: int, request: Request, response: Response):
     """
     GET /categories/id
-    Returns one category, or 404 if not found.
+    Returns one category, or 404 if not found. Supports If-None-Match.
     """
     con = get_connection()
+    not_modified = conditional_get(request, response, con, [("categories", 0)])
+    if not_modified:
+        return not_modified
     category = db.get_category_by_id(con, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
@@ -163,6 +383,7 @@ def get_category(category_id: int):
 
 
 @app.get("/staffmembers/", response_model=list[StaffMemberDetail], status_code=200)
+@request_timing.query_budget(1)
 def list_staffmembers():
     """
     GET /staffmembers/
@@ -173,6 +394,7 @@ def list_staffmembers():
 
 
 @app.get("/staffmembers/{staff_id}", response_model=StaffMemberOut, status_code=200)
+@request_timing.query_budget(1)
 def get_staffmember(staff_id: int):
     """
     GET /staffmembers/id
@@ -186,6 +408,7 @@ def get_staffmember(staff_id: int):
 
 
 @app.get("/businesses/{business_id}/staffmembers", response_model=list[StaffMemberOut], status_code=200)
+@request_timing.query_budget(1)
 def list_staff_for_business(business_id: int):
     """
     Returns all staff members belonging to a specific business.
@@ -195,6 +418,7 @@ def list_staff_for_business(business_id: int):
 
 
 @app.get("/business-images", response_model=list[BusinessImageOut], status_code=200)
+@request_timing.query_budget(1)
 def list_all_images():
     """
     GET /business-images
@@ -205,6 +429,7 @@ def list_all_images():
 
 
 @app.get("/businesses/{business_id}/images", response_model=list[BusinessImageOut], status_code=200)
+@request_timing.query_budget(1)
 def list_images_for_business(business_id: int):
     """
     GET /businesses/id/images
@@ -215,6 +440,7 @@ def list_images_for_business(business_id: int):
 
 
 @app.get("/business-images/{image_id}", response_model=BusinessImageOut, status_code=200)
+@request_timing.query_budget(1)
 def get_business_image(image_id: int):
     """
     GET /business-images/id
@@ -228,33 +454,85 @@ def get_business_image(image_id: int):
 
 
 @app.get("/businesses/{business_id}/opening-hours", response_model=list[OpeningHoursOut], status_code=200)
-def get_opening_hours_for_business_route(business_id: int):
+@request_timing.query_budget(2)
+def get_opening_hours_for_business_route(business_id: int, request: Request, response: Response):
     """
     GET /businesses/id/opening-hours
-    Returns opening hours for a specific business.
+    Returns opening hours for a specific business. Supports If-None-Match.
     """
     con = get_connection()
+    not_modified = conditional_get(request, response, con, [("opening_hours", business_id)])
+    if not_modified:
+        return not_modified
     return db.get_opening_hours_for_business(con, business_id)
 
 
 @app.get("/services/search-filter", status_code=200)
-def filter_services_by_categories(categories: str):
+@request_timing.query_budget(1)
+def filter_services_by_categories(categories: str, include_descendants: bool = False):
     """
     GET /services/search-filter
     Returns services filtered by a comma-separated list of category IDs.
+    With include_descendants=true, services in subcategories match as well.
     """
     con = get_connection()
     ids = [int(c) for c in categories.split(",")]
-    return db.get_services_by_categories(con, ids)
+    return db.get_services_by_categories(con, ids, include_descendants)
+
+
+@app.get("/services/filter", response_model=ServiceFilterResponse, status_code=200)
+@request_timing.query_budget(7)
+def filter_services(
+    categories: Optional[str] = None,
+    match: str = "any",
+    include_descendants: bool = False,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_duration: Optional[int] = None,
+    max_duration: Optional[int] = None,
+    city: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    limit: int = 20,
+    offset: int = 0,
+):
+    """
+    GET /services/filter
+    Returns a page of services filtered by categories (comma-separated IDs, match=any|all),
+    price and duration ranges, city and active flag, plus per-facet counts.
+    """
+    if match not in ("any", "all"):
+        raise HTTPException(status_code=400, detail="match must be 'any' or 'all'")
+    category_ids = sorted({int(c) for c in categories.split(",")}) if categories else None
+
+    con = get_connection()
+    page = db.filter_services(
+        con,
+        limit,
+        offset,
+        category_ids=category_ids,
+        match=match,
+        include_descendants=include_descendants,
+        min_price=min_price,
+        max_price=max_price,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        city=city,
+        is_active=is_active,
+    )
+    return {"limit": limit, "offset": offset, **page}
 
 
 @app.get("/services/{service_id}", status_code=200)
-def get_service_endpoint(service_id: int):
+@request_timing.query_budget(2)
+def get_service_endpoint(service_id: int, request: Request, response: Response):
     """
     GET /services/id
-    Returns one service, or 404 if not found.
+    Returns one service, or 404 if not found. Supports If-None-Match.
     """
     con = get_connection()
+    not_modified = conditional_get(request, response, con, [("service", service_id)])
+    if not_modified:
+        return not_modified
     service = db.get_service(con, service_id)
     if not service:
         raise HTTPException(status_code=404, detail="Service not found")
@@ -262,26 +540,45 @@ def get_service_endpoint(service_id: int):
 
 
 @app.get("/businesses/{business_id}/services", response_model=list[ServiceDetail], status_code=200)
-def list_services_for_business(business_id: int):
+@request_timing.query_budget(2)
+def list_services_for_business(business_id: int, request: Request, response: Response):
     """
     GET /businesses/id/services
-    Returns all services belonging to a specific business.
+    Returns all services belonging to a specific business. Supports If-None-Match.
     """
     con = get_connection()
+    not_modified = conditional_get(
+        request, response, con, [("business_services", business_id), ("categories", 0)]
+    )
+    if not_modified:
+        return not_modified
     return db.get_services_by_business(con, business_id)
 
 
 @app.get("/categories/{category_id}/services", status_code=200)
-def list_services_for_category(category_id: int):
+@request_timing.query_budget(1)
+def list_services_for_category(category_id: int, include_descendants: bool = False):
     """
     GET /categories/id/services
-    Returns services for one category.
+    Returns services for one category, optionally including its subcategories.
     """
     con = get_connection()
-    return db.get_services_for_category(con, category_id)
+    return db.get_services_for_category(con, category_id, include_descendants)
+
+
+@app.get("/categories/{category_id}/businesses", status_code=200)
+@request_timing.query_budget(1)
+def list_businesses_for_category(category_id: int, include_descendants: bool = False):
+    """
+    GET /categories/id/businesses
+    Returns businesses offering services in one category, optionally including its subcategories.
+    """
+    con = get_connection()
+    return db.get_businesses_by_category(con, category_id, include_descendants)
 
 
 @app.get("/services/{service_id}/categories", status_code=200)
+@request_timing.query_budget(1)
 def list_categories_for_service(service_id: int):
     """
     GET /services/id/categories
@@ -292,6 +589,7 @@ def list_categories_for_service(service_id: int):
 
 
 @app.get("/businesses/{business_id}/categories/{category_id}/services", status_code=200)
+@request_timing.query_budget(1)
 def list_services_in_category_for_business(business_id: int, category_id: int):
     """
     Returns all services for a business in a category.
@@ -301,6 +599,7 @@ def list_services_in_category_for_business(business_id: int, category_id: int):
 
 
 @app.get("/businesses/{business_id}/categories", status_code=200)
+@request_timing.query_budget(1)
 def list_categories_for_business(business_id: int):
     """
     Returns categories used by a business.
@@ -309,9 +608,43 @@ def list_categories_for_business(business_id: int):
     return db.get_categories_for_business(con, business_id)
 
 
+@app.get("/search", response_model=SearchResponse, status_code=200)
+@request_timing.query_budget(2)
+def search(q: str, limit: int = 20, offset: int = 0):
+    """
+    GET /search?q=...
+    Full-text search over businesses and services, ranked by relevance and paginated.
+    """
+    con = get_connection()
+    page = db.search(con, q, limit, offset)
+    return {"query": q, "limit": limit, "offset": offset, **page}
+
+
+@app.get("/autocomplete", response_model=list[AutocompleteSuggestion], status_code=200)
+@request_timing.query_budget(1)
+def autocomplete(q: str, limit: int = Query(10, ge=1, le=25)):
+    """
+    GET /autocomplete?q=...
+    Returns typo-tolerant suggestions over business, service and category names.
+    Queries shorter than two characters return no suggestions.
+    """
+    term = q.strip().lower()
+    if len(term) < 2:
+        return []
+
+    key = (term, limit)
+    suggestions = autocomplete_cache.get(key)
+    if suggestions is None:
+        con = get_connection()
+        suggestions = db.get_autocomplete_suggestions(con, term, limit)
+        autocomplete_cache.set(key, suggestions)
+    return suggestions
+
+
 # ---------------- BOOKING ENDPOINTS ---------------- #
 
 @app.get("/bookings/{booking_id}", response_model=BookingOut, status_code=200)
+@request_timing.query_budget(1)
 def get_booking_endpoint(booking_id: int):
     """
     Returns one booking.
@@ -324,15 +657,22 @@ def get_booking_endpoint(booking_id: int):
 
 
 @app.get("/bookings", response_model=list[BookingOut], status_code=200)
-def list_bookings():
+@request_timing.query_budget(1)
+def list_bookings(stream: Optional[Literal["json", "ndjson"]] = None):
     """
     Returns all bookings.
+    The JSON is built by Postgres and sent as-is, skipping per-row validation.
+    With stream=json or stream=ndjson the rows are streamed in chunks instead.
     """
     con = get_connection()
-    return db.get_bookings(con)
+    if stream:
+        return stream_response(con, db.stream_bookings(con, json_fields(BookingOut)), stream)
+    body = db.get_bookings_json(con, json_fields(BookingOut))
+    return Response(content=body, media_type="application/json")
 
 
 @app.get("/customers/{customer_id}/bookings", response_model=list[BookingOut], status_code=200)
+@request_timing.query_budget(1)
 def list_bookings_for_customer(customer_id: int):
     """
     Returns bookings for one customer.
@@ -342,6 +682,7 @@ def list_bookings_for_customer(customer_id: int):
 
 
 @app.get("/businesses/{business_id}/bookings", response_model=list[BookingOut], status_code=200)
+@request_timing.query_budget(1)
 def list_bookings_for_business(business_id: int):
     """
     Returns bookings for a business.
@@ -351,6 +692,7 @@ def list_bookings_for_business(business_id: int):
 
 
 @app.get("/staff/{staff_id}/bookings", response_model=list[BookingOut], status_code=200)
+@request_timing.query_budget(1)
 def list_bookings_for_staff(staff_id: int):
     """
     Returns bookings for a staff member.
@@ -360,6 +702,7 @@ def list_bookings_for_staff(staff_id: int):
 
 
 @app.get("/services/{service_id}/bookings", response_model=list[BookingOut], status_code=200)
+@request_timing.query_budget(1)
 def list_bookings_for_service(service_id: int):
     """
     Returns bookings for one service.
@@ -369,6 +712,7 @@ def list_bookings_for_service(service_id: int):
 
 
 @app.get("/bookings/unpaid", response_model=list[dict], status_code=200)
+@request_timing.query_budget(1)
 def list_unpaid_bookings():
     """
     Returns unpaid bookings.
@@ -378,6 +722,7 @@ def list_unpaid_bookings():
 
 
 @app.get("/businesses/{business_id}/bookings/unpaid", response_model=list[dict], status_code=200)
+@request_timing.query_budget(1)
 def list_unpaid_bookings_for_business(business_id: int):
     """
     Returns unpaid bookings for one business.
@@ -389,15 +734,22 @@ def list_unpaid_bookings_for_business(business_id: int):
 # ---------------- PAYMENTS ---------------- #
 
 @app.get("/payments", response_model=list[PaymentOut], status_code=200)
-def list_payments():
+@request_timing.query_budget(1)
+def list_payments(stream: Optional[Literal["json", "ndjson"]] = None):
     """
     Returns all payments.
+    The JSON is built by Postgres and sent as-is, skipping per-row validation.
+    With stream=json or stream=ndjson the rows are streamed in chunks instead.
     """
     con = get_connection()
-    return db.get_all_payments(con)
+    if stream:
+        return stream_response(con, db.stream_all_payments(con, json_fields(PaymentOut)), stream)
+    body = db.get_all_payments_json(con, json_fields(PaymentOut))
+    return Response(content=body, media_type="application/json")
 
 
 @app.get("/payments/{payment_id}", response_model=PaymentOut, status_code=200)
+@request_timing.query_budget(1)
 def get_payment(payment_id: int):
     """
     Returns one payment.
@@ -410,6 +762,7 @@ def get_payment(payment_id: int):
 
 
 @app.get("/bookings/{booking_id}/payments", response_model=list[PaymentOut], status_code=200)
+@request_timing.query_budget(1)
 def list_payments_for_booking(booking_id: int):
     """
     Returns payments for one booking.
@@ -421,6 +774,7 @@ def list_payments_for_booking(booking_id: int):
 # ---------------- REVIEWS ---------------- #
 
 @app.get("/reviews/{review_id}", response_model=ReviewOut, status_code=200)
+@request_timing.query_budget(1)
 def get_review_endpoint(review_id: int):
     """
     Returns one review.
@@ -433,15 +787,22 @@ def get_review_endpoint(review_id: int):
 
 
 @app.get("/reviews", response_model=list[ReviewOut], status_code=200)
-def list_reviews():
+@request_timing.query_budget(1)
+def list_reviews(stream: Optional[Literal["json", "ndjson"]] = None):
     """
     Returns all reviews.
+    The JSON is built by Postgres and sent as-is, skipping per-row validation.
+    With stream=json or stream=ndjson the rows are streamed in chunks instead.
     """
     con = get_connection()
-    return db.get_all_reviews(con)
+    if stream:
+        return stream_response(con, db.stream_all_reviews(con, json_fields(ReviewOut)), stream)
+    body = db.get_all_reviews_json(con, json_fields(ReviewOut))
+    return Response(content=body, media_type="application/json")
 
 
 @app.get("/businesses/{business_id}/reviews", response_model=list[ReviewOut], status_code=200)
+@request_timing.query_budget(1)
 def list_reviews_for_business(business_id: int):
     """
     Returns reviews for one business.
@@ -451,6 +812,7 @@ def list_reviews_for_business(business_id: int):
 
 
 @app.get("/customers/{customer_id}/reviews", response_model=list[ReviewOut], status_code=200)
+@request_timing.query_budget(1)
 def list_reviews_for_customer(customer_id: int):
     """
     Returns reviews by customer.
@@ -460,6 +822,7 @@ def list_reviews_for_customer(customer_id: int):
 
 
 @app.get("/businesses/{business_id}/rating", status_code=200)
+@request_timing.query_budget(1)
 def get_business_rating(business_id: int):
     """
     Returns rating and review count.
@@ -469,6 +832,7 @@ def get_business_rating(business_id: int):
 
 
 @app.get("/businesses/{business_id}/bookings/count", status_code=200)
+@request_timing.query_budget(1)
 def total_bookings_for_business(business_id: int):
     """
     Returns total booking count.
@@ -477,6 +841,7 @@ def total_bookings_for_business(business_id: int):
     return db.get_total_bookings_for_business(con, business_id)
 
 @app.get("/businesses/{business_id}/services/{service_id}/available-slots", response_model=AvailableSlotsOut)
+@request_timing.query_budget(3)
 def get_available_slots(business_id: int, service_id: int, date: str):
     """
     GET /businesses/{id}/services/{id}/available-slots?date=YYYY-MM-DD
@@ -517,6 +882,7 @@ def get_available_slots(business_id: int, service_id: int, date: str):
 
 
 @app.get("/categories/{category_id}/children")
+@request_timing.query_budget(1)
 def get_category_children(category_id: int):
     """
     GET /categories/{category_id}/children
@@ -527,6 +893,7 @@ def get_category_children(category_id: int):
     return [category for category in categories if category["parent_id"] == category_id]
 
 @app.get("/categories/{category_id}/parent")
+@request_timing.query_budget(1)
 def get_category_parent(category_id: int):
     """
     GET /categories/{category_id}/parent
@@ -534,13 +901,24 @@ def get_category_parent(category_id: int):
     Returns null if the category has no parent.
     """
     con = get_connection()
-    category = db.get_category_by_id(con, category_id)
-    if not category or category["parent_id"] is None:
-        return None
+    return db.get_category_parent(con, category_id)
 
-    return db.get_category_by_id(con, category["parent_id"])
+
+@app.get("/categories/{category_id}/ancestors", response_model=list[CategoryOut])
+@request_timing.query_budget(1)
+def get_category_ancestors(category_id: int):
+    """
+    GET /categories/{category_id}/ancestors
+    Returns the breadcrumb path from the root category down to the given category.
+    """
+    con = get_connection()
+    path = db.get_category_ancestors(con, category_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return path
 
 @app.get("/customers/{customer_id}/bookings/upcoming", response_model=list[BookingOut])
+@request_timing.query_budget(1)
 def upcoming_bookings(customer_id: int):
     con = get_connection()
     bookings = db.get_bookings_by_customer(con, customer_id)
@@ -548,11 +926,117 @@ def upcoming_bookings(customer_id: int):
     return [b for b in bookings if b["starttime"] > now]
 
 @app.get("/customers/{customer_id}/bookings/past", response_model=list[BookingOut])
+@request_timing.query_budget(1)
 def past_bookings(customer_id: int):
     con = get_connection()
     bookings = db.get_bookings_by_customer(con, customer_id)
     now = datetime.now()
     return [b for b in bookings if b["endtime"] < now]
+
+
+@app.get("/cache/stats")
+@request_timing.query_budget(0)
+def cache_stats():
+    """
+    GET /cache/stats
+    Returns hit/miss/eviction counters for this worker's in-process caches,
+    and how many reads were shared through request coalescing.
+    """
+    return {
+        "entities": db.entity_cache.stats(),
+        "autocomplete": autocomplete_cache.stats(),
+        "singleflight": dict(singleflight.stats),
+        "responses": response_cache.stats(),
+    }
+
+
+@app.get("/metrics")
+@request_timing.query_budget(0)
+def get_metrics():
+    """
+    GET /metrics
+    Query, route and connection metrics for this worker in the Prometheus text format.
+    """
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/profiles")
+@request_timing.query_budget(0)
+def list_profiles(request: Request):
+    """
+    GET /profiles
+    Stored request profiles (see profiling.py). Needs the X-Profile token header,
+    without it (or with profiling off) the route doesn't exist.
+    """
+    if not profiling.authorized(request.scope):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return profiling.list_profiles()
+
+
+@app.get("/profiles/{profile_id}")
+@request_timing.query_budget(0)
+def get_profile(profile_id: str, request: Request, format: Literal["text", "prof"] = "text"):
+    """
+    GET /profiles/{profile_id}?format=text|prof
+    The slowest functions of a stored profile as text, or the pstats file itself.
+    """
+    if not profiling.authorized(request.scope):
+        raise HTTPException(status_code=404, detail="Not Found")
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "prof":
+        return FileResponse(path, media_type="application/octet-stream", filename=profile_id)
+    return Response(content=profiling.summary(path), media_type="text/plain")
+
+
+# ---------------- EXPORTS ---------------- #
+
+@app.get("/exports/bookings", status_code=200)
+def export_bookings(
+    business_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """
+    GET /exports/bookings?business_id=...&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD
+    Streams bookings as CSV straight from Postgres (COPY), filtered on start date and business.
+    """
+    con = get_connection()
+    chunks = db.export_bookings_csv(con, business_id, date_from, date_to)
+    return csv_response(con, chunks, "bookings.csv")
+
+
+@app.get("/exports/payments", status_code=200)
+def export_payments(
+    business_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """
+    GET /exports/payments?business_id=...&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD
+    Streams payments as CSV straight from Postgres (COPY), filtered on payment date and business.
+    """
+    con = get_connection()
+    chunks = db.export_payments_csv(con, business_id, date_from, date_to)
+    return csv_response(con, chunks, "payments.csv")
+
+
+@app.get("/exports/reviews", status_code=200)
+def export_reviews(
+    business_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """
+    GET /exports/reviews?business_id=...&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD
+    Streams reviews as CSV straight from Postgres (COPY), filtered on review date and business.
+    """
+    con = get_connection()
+    chunks = db.export_reviews_csv(con, business_id, date_from, date_to)
+    return csv_response(con, chunks, "reviews.csv")
+
+
 #-------------------------#
 #---------POST------------#
 #-------------------------#
@@ -662,7 +1146,32 @@ def assign_service_to_staff(staff_id: int, service_id: int):
     db.add_service_to_staff(con, staff_id, service_id)
     return {"status": "assigned"}
 
-from fastapi import File, UploadFile
+@app.post("/staff-services/batch", status_code=200)
+def assign_services_to_staff_batch(data: StaffServiceBatch):
+    """
+    Assigns many services to staff members in one statement.
+    Returns which pairs were added and which already existed.
+    """
+    con = get_connection()
+    pairs = [(pair.staff_id, pair.service_id) for pair in data.pairs]
+    try:
+        return db.add_services_to_staff_batch(con, pairs)
+    except ForeignKeyViolation:
+        raise HTTPException(status_code=400, detail="Unknown staff member or service")
+
+
+@app.post("/service-categories/batch", status_code=200)
+def add_categories_batch(data: ServiceCategoryBatch):
+    """
+    Adds many categories to services in one statement.
+    Returns which pairs were added and which already existed.
+    """
+    con = get_connection()
+    pairs = [(pair.service_id, pair.category_id) for pair in data.pairs]
+    try:
+        return db.add_categories_to_services_batch(con, pairs)
+    except ForeignKeyViolation:
+        raise HTTPException(status_code=400, detail="Unknown service or category")
 
 
 @app.post("/upload-image", status_code=201)
@@ -685,6 +1194,35 @@ async def upload_business_image(file: UploadFile = File(...)):
     return {"image_url": f"/static/uploads/{file.filename}"}
 
 
+@app.post("/imports/{kind}", status_code=200)
+def bulk_import(
+    kind: str,
+    file: UploadFile = File(...),
+    format: Optional[Literal["csv", "ndjson"]] = None,
+    atomic: bool = False,
+):
+    """
+    POST /imports/{kind}   kind: businesses, services, staffmembers, staff-services, service-categories
+    Bulk loads a CSV (with header) or NDJSON file through COPY and inserts every valid row
+    in one transaction. With atomic=true nothing is inserted if any row fails.
+    Returns counts, the id created for each row and a per-row error report.
+    """
+    if kind not in db.IMPORT_SPECS:
+        raise HTTPException(status_code=404, detail="Unknown import type")
+    if format is None:
+        is_ndjson = (file.filename or "").endswith((".ndjson", ".jsonl")) or file.content_type in (
+            "application/x-ndjson",
+            "application/jsonl",
+        )
+        format = "ndjson" if is_ndjson else "csv"
+
+    con = get_connection()
+    try:
+        return db.bulk_import(con, kind, file.file, format, atomic)
+    except (ValueError, DataError) as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
 #-------------------------#
 #----------PUT------------#
 #-------------------------#
@@ -719,7 +1257,10 @@ def update_category(category_id: int, data: CategoryUpdate):
     Updates a category.
     """
     con = get_connection()
-    updated = db.update_category(con, category_id, data)
+    try:
+        updated = db.update_category(con, category_id, data)
+    except CheckViolation:
+        raise HTTPException(status_code=400, detail="Category cannot be moved below one of its own subcategories")
     if not updated:
         raise HTTPException(status_code=404, detail="Category not found")
     return updated
@@ -741,10 +1282,11 @@ def update_staffmember(staff_id: int, data: StaffMemberUpdate):
 def update_opening_hours_for_business(business_id: int, opening_hours: OpeningHoursUpdateRequest):
     """
     Replaces opening hours for a business.
+    changed is false when the new hours were identical and nothing was written.
     """
     con = get_connection()
-    db.replace_opening_hours(con, business_id, opening_hours.hours)
-    return {"message": "Opening hours updated successfully"}
+    changed = db.replace_opening_hours(con, business_id, opening_hours.hours)
+    return {"message": "Opening hours updated successfully", "changed": changed}
 
 
 @app.put("/services/{service_id}", status_code=200)
@@ -917,6 +1459,28 @@ def remove_category(service_id: int, category_id: int):
     return {"status": "removed" if result else "not found"}
 
 
+@app.delete("/staff-services/batch", status_code=200)
+def remove_services_from_staff_batch(data: StaffServiceBatch):
+    """
+    Removes many staff-service assignments in one statement.
+    Returns which pairs were removed and which were not found.
+    """
+    con = get_connection()
+    pairs = [(pair.staff_id, pair.service_id) for pair in data.pairs]
+    return db.remove_services_from_staff_batch(con, pairs)
+
+
+@app.delete("/service-categories/batch", status_code=200)
+def remove_categories_batch(data: ServiceCategoryBatch):
+    """
+    Removes many service-category links in one statement.
+    Returns which pairs were removed and which were not found.
+    """
+    con = get_connection()
+    pairs = [(pair.service_id, pair.category_id) for pair in data.pairs]
+    return db.remove_categories_from_services_batch(con, pairs)
+
+
 @app.delete("/bookings/{booking_id}", status_code=204)
 def delete_booking_endpoint(booking_id: int):
     """
@@ -958,3 +1522,8 @@ def remove_service_from_staff(staff_id: int, service_id: int):
     con = get_connection()
     result = db.remove_service_from_staff(con, staff_id, service_id)
     return {"status": "removed" if result else "not found"}
+
+
+# Opt-in request profiling (PROFILE_TOKEN / PROFILE_SAMPLE_EVERY in .env); wraps the
+# routes above, so it has to come after all of them
+profiling.install(app)
@@ -0,0 +1,447 @@
+"""
+HTTP load benchmark: starts the app with uvicorn against the database from .env,
+replays the request patterns of the frontend's pages and reports throughput and
+p50/p95/p99 latency per route, once per worker count, e.g.
+
+    python benchmark_http.py --generate "--businesses 2000 --months 6" --workers 1,4
+    python benchmark_http.py --compare benchmark_results/http-<old>.json [http-<new>.json]
+
+Every virtual user repeatedly picks a journey (home page, business page, booking a
+slot, checking their bookings) and sends the same requests the page does, with the
+requests a page sends together (its Promise.all) in parallel. The users are spread
+over a few loader processes so the load generator isn't the bottleneck.
+
+Results are written as JSON together with the commit and dataset size, so runs can
+be compared across commits with --compare. Creating bookings writes to the database,
+so run it against a generated dataset, not one you care about.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+import generate_data
+from db_setup import get_connection
+
+RESULTS_DIR = "benchmark_results"
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+# ---------- journeys ----------
+class Session:
+    """
+    One virtual user's client, recording a sample for every request it sends.
+    """
+
+    def __init__(self, client, data, rng, samples, measure_from: float, measure_until: float):
+        self.client = client
+        self.data = data
+        self.rng = rng
+        self.samples = samples
+        self.measure_from = measure_from
+        self.measure_until = measure_until
+
+    async def request(self, method: str, template: str, params=None, body=None, **path):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, template.format(**path), params=params, json=body)
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, 0
+        elapsed = time.perf_counter() - start
+        if self.measure_from <= start < self.measure_until:
+            timing = SERVER_TIMING_DB.search(response.headers.get("server-timing", "")) if response else None
+            self.samples.append((
+                f"{method} {template}",
+                status,
+                elapsed,
+                float(timing.group(1)) if timing else None,
+                response is not None and response.headers.get("x-cache") in ("HIT", "STALE"),
+            ))
+        if response is None or not 200 <= status < 300:
+            return None
+        return response.json() if status != 204 else None
+
+    def get(self, template: str, params=None, **path):
+        return self.request("GET", template, params=params, **path)
+
+    def business_id(self):
+        # A few businesses get most of the traffic, like on any marketplace
+        ids = self.data["business_ids"]
+        return ids[int(len(ids) * self.rng.random() ** 2)]
+
+
+async def home_page(session: Session):
+    await session.get("/businesses/top-rated", params={"limit": 4})
+
+
+async def businesses_page(session: Session):
+    await session.get("/businesses/")
+
+
+async def business_page(session: Session, business_id: int):
+    _, services, *_ = await asyncio.gather(
+        session.get("/businesses/{business_id}", business_id=business_id),
+        session.get("/businesses/{business_id}/services", business_id=business_id),
+        session.get("/businesses/{business_id}/reviews", business_id=business_id),
+        session.get("/businesses/{business_id}/opening-hours", business_id=business_id),
+        session.get("/businesses/{business_id}/rating", business_id=business_id),
+    )
+    return services or []
+
+
+async def bookings_page(session: Session, customer_id: int):
+    await asyncio.gather(
+        session.get("/customers/{customer_id}/bookings/upcoming", customer_id=customer_id),
+        session.get("/customers/{customer_id}/bookings/past", customer_id=customer_id),
+    )
+
+
+async def available_slots(session: Session, business_id: int, service: dict):
+    day = session.rng.choice(session.data["dates"])
+    result = await session.get(
+        "/businesses/{business_id}/services/{service_id}/available-slots",
+        params={"date": day},
+        business_id=business_id,
+        service_id=service["id"],
+    )
+    return day, (result or {}).get("available_slots", [])
+
+
+async def browse(session: Session):
+    await home_page(session)
+    await business_page(session, session.business_id())
+
+
+async def browse_all(session: Session):
+    await businesses_page(session)
+    await business_page(session, session.business_id())
+
+
+async def compare_slots(session: Session):
+    business_id = session.business_id()
+    services = await business_page(session, business_id)
+    for service in session.rng.sample(services, min(2, len(services))):
+        await available_slots(session, business_id, service)
+
+
+async def book(session: Session):
+    await home_page(session)
+    business_id = session.business_id()
+    services = await business_page(session, business_id)
+    if not services:
+        return
+    service = session.rng.choice(services)
+    day, slots = await available_slots(session, business_id, service)
+    if not slots:
+        return
+    start = datetime.fromisoformat(f"{day}T{session.rng.choice(slots)}")
+    customer_id = session.rng.choice(session.data["customer_ids"])
+    await session.request("POST", "/bookings/", body={
+        "customer_id": customer_id,
+        "business_id": business_id,
+        "service_id": service["id"],
+        "starttime": start.isoformat(),
+        "endtime": (start + timedelta(minutes=service["duration_minutes"])).isoformat(),
+    })
+    await bookings_page(session, customer_id)
+
+
+async def my_bookings(session: Session):
+    await bookings_page(session, session.rng.choice(session.data["customer_ids"]))
+
+
+# (weight, journey)
+JOURNEYS = [
+    (40, browse),
+    (10, browse_all),
+    (15, compare_slots),
+    (15, book),
+    (20, my_bookings),
+]
+
+
+# ---------- load ----------
+async def virtual_user(session: Session, stop_at: float, think_seconds: float):
+    weights = [weight for weight, _ in JOURNEYS]
+    journeys = [journey for _, journey in JOURNEYS]
+    while time.perf_counter() < stop_at:
+        journey = session.rng.choices(journeys, weights)[0]
+        await journey(session)
+        if think_seconds:
+            await asyncio.sleep(session.rng.expovariate(1 / think_seconds))
+
+
+async def load(base_url, data, users, warmup, duration, think_seconds, seed):
+    samples = []
+    # a business page sends five requests at once, they shouldn't queue in the client
+    limits = httpx.Limits(max_connections=users * 5, max_keepalive_connections=users * 5)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        measure_from = time.perf_counter() + warmup
+        stop_at = measure_from + duration
+        await asyncio.gather(*[
+            virtual_user(
+                Session(client, data, random.Random(f"{seed}-{user}"), samples, measure_from, stop_at),
+                stop_at,
+                think_seconds,
+            )
+            for user in range(users)
+        ])
+    return samples
+
+
+def run_loader(arguments):
+    return asyncio.run(load(*arguments))
+
+
+# ---------- server ----------
+def start_server(workers: int, port: int, log_path: str):
+    log = open(log_path, "ab")
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=log,
+        stderr=log,
+    )
+    log.close()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with status {server.returncode}, see {log_path}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/categories/", timeout=2).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    stop_server(server)
+    raise RuntimeError(f"The server didn't answer within 60 seconds, see {log_path}")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+# ---------- data ----------
+def load_sample_data(con):
+    """
+    Ids and dates for the journeys, from whatever dataset is in the database.
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT business_id FROM services GROUP BY business_id ORDER BY business_id LIMIT 10000;")
+            business_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT id FROM users WHERE role = 'customer' ORDER BY id LIMIT 10000;")
+            customer_ids = [row[0] for row in cursor.fetchall()]
+            # the last two weeks with bookings, so slot lookups see realistic occupancy
+            cursor.execute("SELECT MAX(starttime)::date FROM bookings;")
+            last_day = cursor.fetchone()[0] or datetime.now().date() + timedelta(days=14)
+            cursor.execute("""
+                SELECT relname, reltuples::bigint FROM pg_class
+                WHERE relname IN ('users', 'businesses', 'services', 'staffmembers', 'bookings',
+                                  'payments', 'reviews') AND relkind = 'r';
+            """)
+            dataset = dict(cursor.fetchall())
+    if not business_ids or not customer_ids:
+        raise SystemExit("The database has no businesses with services or no customers; use --generate.")
+    # shuffled with a fixed seed, so the "popular" businesses are the same every run
+    random.Random(0).shuffle(business_ids)
+    return {
+        "business_ids": business_ids,
+        "customer_ids": customer_ids,
+        "dates": [(last_day - timedelta(days=offset)).isoformat() for offset in range(14)],
+    }, dataset
+
+
+# ---------- results ----------
+def percentile(sorted_values, fraction: float):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, seconds: float):
+    """
+    Per route and in total: requests, errors, requests/s and latency percentiles in ms.
+    Errors are failed connections and 5xx; 4xx (a day the business is closed, a slot
+    taken in the meantime) are expected in the mix and counted separately.
+    """
+    if not samples:
+        return {}
+    by_route = {}
+    for sample in samples:
+        by_route.setdefault(sample[0], []).append(sample)
+    by_route["total"] = samples
+
+    summary = {}
+    for route, route_samples in sorted(by_route.items()):
+        latencies = sorted(sample[2] * 1000 for sample in route_samples)
+        db_times = [sample[3] for sample in route_samples if sample[3] is not None]
+        summary[route] = {
+            "requests": len(route_samples),
+            "errors": sum(1 for sample in route_samples if sample[1] == 0 or sample[1] >= 500),
+            "client_errors": sum(1 for sample in route_samples if 400 <= sample[1] < 500),
+            "rps": round(len(route_samples) / seconds, 1),
+            "p50_ms": round(percentile(latencies, 0.50), 2),
+            "p95_ms": round(percentile(latencies, 0.95), 2),
+            "p99_ms": round(percentile(latencies, 0.99), 2),
+            "max_ms": round(latencies[-1], 2),
+            "db_ms_mean": round(sum(db_times) / len(db_times), 2) if db_times else None,
+            "cache_hit_ratio": round(sum(1 for sample in route_samples if sample[4]) / len(route_samples), 3),
+        }
+    return summary
+
+
+def print_run(run):
+    print(f"\n{run['workers']} worker(s), {run['users']} users, {run['seconds']}s")
+    print(f"{'route':72} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7} {'cached':>7}")
+    for route, stats in run["routes"].items():
+        print(
+            f"{route:72} {stats['rps']:8.1f} {stats['p50_ms']:8.2f} {stats['p95_ms']:8.2f} "
+            f"{stats['p99_ms']:8.2f} {stats['errors']:7} {stats['cache_hit_ratio']:7.0%}"
+        )
+
+
+def compare(old_path: str, new_path: str):
+    """
+    Prints throughput and p95 of every route in both result files, with the change.
+    """
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    print(f"{old['commit']} -> {new['commit']}")
+    old_runs = {run["workers"]: run for run in old["runs"]}
+    for run in new["runs"]:
+        old_run = old_runs.get(run["workers"])
+        if old_run is None:
+            continue
+        print(f"\n{run['workers']} worker(s)")
+        print(f"{'route':72} {'req/s':>19} {'p95 ms':>21}")
+        for route, stats in run["routes"].items():
+            before = old_run["routes"].get(route)
+            if before is None:
+                continue
+            rps_change = (stats["rps"] / before["rps"] - 1) if before["rps"] else 0
+            p95_change = (stats["p95_ms"] / before["p95_ms"] - 1) if before["p95_ms"] else 0
+            print(
+                f"{route:72} {before['rps']:8.1f} {stats['rps']:8.1f} {rps_change:+4.0%}"
+                f" {before['p95_ms']:8.2f} {stats['p95_ms']:8.2f} {p95_change:+4.0%}"
+            )
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Load-test the API with the frontend's request patterns.")
+    parser.add_argument("--generate", metavar="ARGS",
+                        help='reset the database and run generate_data.py with these options first, '
+                             'e.g. "--businesses 2000 --months 6"')
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}",
+                        help="comma-separated uvicorn worker counts, one run each")
+    parser.add_argument("--users", type=int, default=64, help="concurrent virtual users")
+    parser.add_argument("--loaders", type=int, default=2, help="processes sending the requests")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before each run")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between journeys")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help=f"result file (default: {RESULTS_DIR}/http-<commit>-<time>.json)")
+    parser.add_argument("--compare", nargs="+", metavar="JSON",
+                        help="compare this run with an earlier result file, or two files without running")
+    return parser.parse_args(argv)
+
+
+def main(options):
+    if options.compare and len(options.compare) == 2:
+        compare(*options.compare)
+        return 0
+
+    if options.generate:
+        status = generate_data.generate(generate_data.parse_args(shlex.split(options.generate) + ["--reset"]))
+        if status:
+            return status
+    con = get_connection()
+    data, dataset = load_sample_data(con)
+    con.close()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = git_commit()
+    output = options.output or os.path.join(
+        RESULTS_DIR, f"http-{commit}-{datetime.now().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    result = {
+        "commit": commit,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "options": {key: value for key, value in vars(options).items() if key not in ("output", "compare")},
+        "dataset": dataset,
+        "runs": [],
+    }
+
+    base_url = f"http://127.0.0.1:{options.port}"
+    loaders = max(1, min(options.loaders, options.users))
+    for workers in [int(value) for value in options.workers.split(",")]:
+        server = start_server(workers, options.port, output.removesuffix(".json") + ".server.log")
+        try:
+            users = [options.users // loaders + (index < options.users % loaders) for index in range(loaders)]
+            with multiprocessing.Pool(loaders) as pool:
+                parts = pool.map(run_loader, [
+                    (base_url, data, count, options.warmup, options.duration, options.think_ms / 1000,
+                     f"{options.seed}-{index}")
+                    for index, count in enumerate(users)
+                ])
+        finally:
+            stop_server(server)
+        samples = [sample for part in parts for sample in part]
+        run = {
+            "workers": workers,
+            "users": options.users,
+            "seconds": options.duration,
+            "routes": summarize(samples, options.duration),
+        }
+        result["runs"].append(run)
+        print_run(run)
+
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"\nSaved {output}")
+    if options.compare:
+        print()
+        compare(options.compare[0], output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args(sys.argv[1:])))
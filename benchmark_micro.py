@@ -0,0 +1,242 @@
+"""
+Microbenchmarks for the pure-Python code on hot request paths, no database needed:
+
+    python benchmark_micro.py                 all benchmarks
+    python benchmark_micro.py slots --quick   only names containing "slots", fewer repeats
+    python benchmark_micro.py --json micro.json
+
+Every benchmark runs at a few input sizes and reports calls per second (best of
+several repeats, so background noise only makes numbers lower) and the peak memory
+one call allocates, measured separately with tracemalloc since tracing slows calls down.
+Inputs are generated with a fixed seed and shaped like the rows the routes get
+from db.py, so numbers are comparable between runs and commits.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from pydantic import TypeAdapter
+
+import db
+from app import build_category_tree
+from schemas import BookingOut, BusinessDetail
+
+BOOKING_DAY = datetime(2025, 3, 3)
+
+
+# ---------- inputs ----------
+def day_bookings(count: int, rng):
+    """
+    Rows like get_bookings_for_business_and_date: starttime and endtime on one day.
+    """
+    bookings = []
+    for _ in range(count):
+        start = BOOKING_DAY + timedelta(minutes=rng.randrange(8 * 60, 19 * 60, 15))
+        bookings.append({"starttime": start, "endtime": start + timedelta(minutes=rng.choice((30, 45, 60, 90)))})
+    return bookings
+
+
+def category_rows(count: int, rng):
+    """
+    Rows like get_all_categories: a forest about three levels deep, in id order.
+    """
+    rows = []
+    for category_id in range(1, count + 1):
+        parent_id = rng.randrange(1, category_id) if category_id > 10 else None
+        rows.append({
+            "id": category_id,
+            "name": f"Kategori {category_id}",
+            "description": "Beskrivning av kategorin",
+            "parent_id": parent_id,
+        })
+    return rows
+
+
+def booking_rows(count: int, rng):
+    """
+    Rows like get_bookings_by_customer, with the joined names.
+    """
+    rows = []
+    for booking_id in range(1, count + 1):
+        start = BOOKING_DAY + timedelta(days=rng.randrange(90), minutes=rng.randrange(8 * 60, 19 * 60, 15))
+        rows.append({
+            "id": booking_id,
+            "customer_id": rng.randrange(1, 10000),
+            "business_id": rng.randrange(1, 500),
+            "service_id": rng.randrange(1, 4000),
+            "staff_id": rng.randrange(1, 2000),
+            "starttime": start,
+            "endtime": start + timedelta(minutes=60),
+            "status": rng.choice(("pending", "confirmed", "completed", "cancelled")),
+            "notes": None,
+            "created_at": start - timedelta(days=7),
+            "customer_name": "Anna Andersson",
+            "business_name": "Massage Studio 12",
+            "service_name": "Klassisk massage 60 min",
+            "staff_name": "Erik Johansson",
+        })
+    return rows
+
+
+def business_rows(count: int, rng):
+    """
+    Rows like get_all_businesses, with the joined owner and category names.
+    """
+    rows = []
+    for business_id in range(1, count + 1):
+        rows.append({
+            "id": business_id,
+            "owner_id": business_id,
+            "main_category_id": rng.randrange(1, 20),
+            "name": f"Frisör Salong {business_id}",
+            "description": "En trevlig salong mitt i stan",
+            "street_name": "Storgatan",
+            "street_number": str(rng.randrange(1, 120)),
+            "city": "Stockholm",
+            "postal_code": "111 34",
+            "latitude": 59.3293 + rng.random() / 100,
+            "longitude": 18.0686 + rng.random() / 100,
+            "created_at": BOOKING_DAY,
+            "owner_name": "Lars Karlsson",
+            "main_category_name": "Frisör",
+        })
+    return rows
+
+
+def serialize(adapter: TypeAdapter, rows):
+    """
+    What FastAPI does with a response_model: validate the rows, dump them as JSON
+    compatible values and render them with json.dumps like JSONResponse.
+    """
+    content = adapter.dump_python(adapter.validate_python(rows), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+BOOKING_LIST = TypeAdapter(list[BookingOut])
+BUSINESS_LIST = TypeAdapter(list[BusinessDetail])
+
+
+# ---------- benchmarks ----------
+# Each takes a seeded Random and an input size and returns the call to measure;
+# inputs are built here, outside the timed call.
+def time_slots_benchmark(rng, slots: int):
+    return lambda: db.generate_time_slots("08:00", "20:00", 720 // slots)
+
+
+def overlapping_slots_benchmark(rng, size: str):
+    slot_count, booking_count = (int(part) for part in size.split("x"))
+    duration = 720 // slot_count
+    slots = db.generate_time_slots("08:00", "20:00", duration)
+    bookings = day_bookings(booking_count, rng)
+    return lambda: db.filter_overlapping_slots(slots, duration, bookings)
+
+
+def category_tree_benchmark(rng, count: int):
+    categories = category_rows(count, rng)
+    return lambda: build_category_tree(categories)
+
+
+def booking_list_benchmark(rng, count: int):
+    rows = booking_rows(count, rng)
+    return lambda: serialize(BOOKING_LIST, rows)
+
+
+def business_list_benchmark(rng, count: int):
+    rows = business_rows(count, rng)
+    return lambda: serialize(BUSINESS_LIST, rows)
+
+
+# (name, setup, sizes)
+BENCHMARKS = [
+    ("generate_time_slots", time_slots_benchmark, (12, 48, 144)),
+    ("filter_overlapping_slots", overlapping_slots_benchmark, ("24x10", "48x50", "144x200")),
+    ("build_category_tree", category_tree_benchmark, (50, 500, 5000)),
+    ("serialize BookingOut", booking_list_benchmark, (10, 100, 1000)),
+    ("serialize BusinessDetail", business_list_benchmark, (10, 100, 1000)),
+]
+
+
+# ---------- measuring ----------
+def calls_per_second(call, repeats: int, min_seconds: float):
+    """
+    Best of the repeats, each running as many calls as fit in about min_seconds.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds / 4:
+            break
+        number *= 2
+    number = max(1, int(number * min_seconds / max(elapsed, 1e-9)))
+
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        best = min(best, (time.perf_counter() - start) / number)
+    return 1 / best
+
+
+def peak_allocation(call):
+    """
+    Bytes allocated at the high point of one call, not counting what existed before.
+    """
+    call()  # warm up caches and lazily built state outside the measurement
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        call()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def run(name_filter: str, repeats: int, min_seconds: float):
+    results = []
+    print(f"{'benchmark':28} {'size':>14} {'ops/s':>12} {'us/op':>10} {'peak KiB':>10}")
+    for name, setup, sizes in BENCHMARKS:
+        if name_filter not in name:
+            continue
+        for size in sizes:
+            call = setup(random.Random(f"{name}-{size}"), size)
+            ops = calls_per_second(call, repeats, min_seconds)
+            peak = peak_allocation(call)
+            results.append({
+                "benchmark": name,
+                "size": size,
+                "ops_per_second": round(ops, 1),
+                "microseconds_per_op": round(1e6 / ops, 2),
+                "peak_bytes": peak,
+            })
+            print(f"{name:28} {size:>14} {ops:12,.0f} {1e6 / ops:10.2f} {peak / 1024:10.1f}")
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for hot pure-Python helpers.")
+    parser.add_argument("only", nargs="?", default="", help="only benchmarks whose name contains this")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=0.2, help="minimum duration of one repeat")
+    parser.add_argument("--quick", action="store_true", help="2 repeats of 0.05 s, for a fast look")
+    parser.add_argument("--json", help="also save the results to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    options = parse_args(sys.argv[1:])
+    if options.quick:
+        options.repeats, options.seconds = 2, 0.05
+    results = run(options.only, options.repeats, options.seconds)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,124 @@
+"""
+Small in-process caches used in front of hot database reads.
+Each uvicorn worker has its own copy, so anything cached here
+can be up to ttl_seconds stale compared to the database.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    A bounded LRU cache where every entry also expires after ttl_seconds.
+    get() returns None on a miss, so don't store None as a value with set();
+    get_or_load() stores None results as negative entries for negative_ttl_seconds.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl_seconds: float = 60, negative_ttl_seconds: float = None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = ttl_seconds if negative_ttl_seconds is None else negative_ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a load that raced with a write isn't stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _lookup(self, key):
+        # caller holds the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _store(self, key, value, ttl_seconds):
+        # caller holds the lock
+        self._entries[key] = (time.monotonic() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            value = self._lookup(key)
+        return None if value is _MISSING else value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value, self.ttl_seconds)
+
+    def get_or_load(self, key, load):
+        """
+        Returns the cached value for key, or calls load() and caches its result.
+        A None result is cached too, so repeated lookups of missing rows stay cheap.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            generation = self._generation
+        if value is not _MISSING:
+            return value
+
+        value = load()
+        ttl_seconds = self.ttl_seconds if value is not None else self.negative_ttl_seconds
+        with self._lock:
+            if generation == self._generation:
+                self._store(key, value, ttl_seconds)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def delete_where(self, predicate):
+        """
+        Drops every entry where predicate(key, value) is true.
+        """
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
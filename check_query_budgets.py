@@ -0,0 +1,231 @@
+"""
+Runs every GET route of app.py against the seeded database and checks two things:
+
+- no request runs more SQL statements than the route's @query_budget allows
+- the number of statements doesn't grow with the number of rows returned (an N+1),
+  by calling each route with ids that have few and many related rows
+  (and with a small and a large limit for list routes that take one)
+
+Statements are counted by request_timing and read back from the Server-Timing header.
+Caches are cleared before every request, so the counts are the cold-cache worst case.
+
+Usage: python check_query_budgets.py [path substring]
+Exits with status 1 if any route fails. tests/test_query_budgets.py runs the same
+check for every route as part of the test suite.
+"""
+
+import re
+import sys
+from datetime import date, timedelta
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+
+import app as application
+import db
+from db_setup import get_connection
+
+# Ids to call routes with, per combination of path parameters, ordered from
+# few to many related rows so the growth check sees both ends.
+SAMPLE_IDS = {
+    ("business_id",): "SELECT business_id FROM services GROUP BY business_id ORDER BY COUNT(*), business_id",
+    ("service_id",): "SELECT service_id FROM service_categories GROUP BY service_id ORDER BY COUNT(*), service_id",
+    ("category_id",): """
+        SELECT categories.id FROM categories
+        LEFT JOIN service_categories ON service_categories.category_id = categories.id
+        GROUP BY categories.id ORDER BY COUNT(service_categories.service_id), categories.id
+    """,
+    ("user_id",): "SELECT id FROM users ORDER BY id",
+    ("staff_id",): """
+        SELECT staffmembers.id FROM staffmembers
+        LEFT JOIN bookings ON bookings.staff_id = staffmembers.id
+        GROUP BY staffmembers.id ORDER BY COUNT(bookings.id), staffmembers.id
+    """,
+    ("customer_id",): "SELECT customer_id FROM bookings GROUP BY customer_id ORDER BY COUNT(*), customer_id",
+    ("booking_id",): "SELECT booking_id FROM payments GROUP BY booking_id ORDER BY COUNT(*), booking_id",
+    ("payment_id",): "SELECT id FROM payments ORDER BY id",
+    ("review_id",): "SELECT id FROM reviews ORDER BY id",
+    ("image_id",): "SELECT id FROM business_images ORDER BY id",
+    ("business_id", "service_id"): "SELECT business_id, id FROM services ORDER BY business_id, id",
+    ("business_id", "category_id"): """
+        SELECT services.business_id, service_categories.category_id
+        FROM services
+        JOIN service_categories ON service_categories.service_id = services.id
+        GROUP BY services.business_id, service_categories.category_id
+        ORDER BY COUNT(*), services.business_id, service_categories.category_id
+    """,
+}
+
+# Values for required query parameters
+SAMPLE_QUERY = {
+    "lat": "59.3293",
+    "lon": "18.0686",
+    "q": "klipp",
+    # next Monday, the day most businesses are open
+    "date": (date.today() + timedelta(days=7 - date.today().weekday())).isoformat(),
+}
+
+SMALL_LIMIT = 1
+LARGE_LIMIT = 50
+
+
+def sample_ids(con, params: tuple):
+    """
+    Returns up to three id tuples for the path parameters: fewest, middle and most rows.
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(SAMPLE_IDS[params])
+            rows = cursor.fetchall()
+    if not rows:
+        return []
+    picks = {0, len(rows) // 2, len(rows) - 1}
+    return [rows[index] for index in sorted(picks)]
+
+
+def first_category_ids(con):
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT category_id FROM service_categories GROUP BY category_id LIMIT 2;")
+            return ",".join(str(row[0]) for row in cursor.fetchall())
+
+
+def clear_caches():
+    db.entity_cache.clear()
+    application.autocomplete_cache.clear()
+    application.response_cache.clear()
+
+
+def count_rows(body):
+    if isinstance(body, list):
+        return len(body)
+    if isinstance(body, dict):
+        for key in ("results", "available_slots"):
+            if isinstance(body.get(key), list):
+                return len(body[key])
+        return 1
+    return 0
+
+
+def run(client, path: str, query: dict):
+    clear_caches()
+    response = client.get(path, params=query)
+    timing = response.headers.get("server-timing", "")
+    match = re.search(r'(\d+) queries', timing)
+    queries = int(match.group(1)) if match else None
+    try:
+        rows = count_rows(response.json())
+    except ValueError:
+        rows = 0
+    return response.status_code, queries, rows
+
+
+def find_growth(results):
+    """
+    Returns two results where more rows came with more queries, or None.
+    """
+    for smaller in results:
+        for larger in results:
+            if larger[4] > smaller[4] and larger[3] > smaller[3]:
+                return smaller, larger
+    return None
+
+
+def check_route(client, con, route: APIRoute):
+    """
+    Returns a list of problems for one route (empty if it passes) and a summary line.
+    """
+    params = tuple(re.findall(r"\{(\w+)\}", route.path))
+    budget = getattr(route.endpoint, "query_budget", None)
+
+    query = {}
+    for param in route.dependant.query_params:
+        if param.name in SAMPLE_QUERY:
+            query[param.name] = SAMPLE_QUERY[param.name]
+        elif param.name == "categories":
+            query["categories"] = first_category_ids(con)
+        elif param.required:
+            return [f"no sample value for required query parameter {param.name!r}"], ""
+
+    # (path, query) for every call
+    calls = []
+    if params:
+        if params not in SAMPLE_IDS:
+            return [f"no sample ids for path parameters {params}"], ""
+        for ids in sample_ids(con, params):
+            path = route.path
+            for name, value in zip(params, ids):
+                path = path.replace("{" + name + "}", str(value))
+            calls.append((path, query))
+    else:
+        calls.append((route.path, query))
+    if any(param.name == "limit" for param in route.dependant.query_params):
+        calls = [
+            (path, {**call_query, "limit": limit})
+            for path, call_query in calls
+            for limit in (SMALL_LIMIT, LARGE_LIMIT)
+        ]
+    if not calls:
+        return ["no sample data in the database"], ""
+
+    results = [(path, call_query, *run(client, path, call_query)) for path, call_query in calls]
+    problems = []
+    for path, call_query, status, queries, rows in results:
+        if queries is None:
+            problems.append(f"{path} {call_query}: no Server-Timing header (status {status})")
+        elif budget is not None and queries > budget:
+            problems.append(f"{path} {call_query}: {queries} queries, budget is {budget} (status {status})")
+
+    growth = find_growth([result for result in results if result[3] is not None and result[2] == 200])
+    if growth:
+        smaller, larger = growth
+        problems.append(
+            f"queries grow with rows: {smaller[3]} queries for {smaller[4]} rows "
+            f"({smaller[0]}), {larger[3]} for {larger[4]} rows ({larger[0]})"
+        )
+
+    if budget is None:
+        problems.append("no @query_budget declared")
+    max_queries = max((result[3] or 0) for result in results)
+    rows = [result[4] for result in results]
+    summary = f"{max_queries} queries (budget {budget}), rows {min(rows)}..{max(rows)}, {len(results)} calls"
+    return problems, summary
+
+
+def checked_routes(path_filter: str = ""):
+    """
+    The GET routes whose query counts are checked, optionally only those whose path
+    contains path_filter.
+    """
+    routes = []
+    for route in application.app.routes:
+        if not isinstance(route, APIRoute) or "GET" not in route.methods:
+            continue
+        if path_filter not in route.path or route.path.startswith("/exports/"):
+            # exports stream from a COPY thread, outside the request's accounting
+            continue
+        if route.path.startswith("/profiles"):
+            # only reachable with the profiling token and never touch the database
+            continue
+        routes.append(route)
+    return routes
+
+
+def main(path_filter: str = ""):
+    client = TestClient(application.app)  # no startup events, so no cache listener
+    con = get_connection()
+    failed = 0
+    for route in checked_routes(path_filter):
+        problems, summary = check_route(client, con, route)
+        status = "FAIL" if problems else "ok"
+        print(f"{status:4} {route.path:65} {summary}")
+        for problem in problems:
+            print(f"       {problem}")
+        failed += bool(problems)
+    con.close()
+    print(f"\n{failed} route(s) failed.")
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main(sys.argv[1] if len(sys.argv) > 1 else "") else 0)
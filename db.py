@@ -1,8 +1,17 @@
+import csv
+import functools
+import io
+import json
+import queue
+import threading
 from typing import Optional
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+
+import metrics
+from cache import TTLCache
 
 
 """
@@ -22,38 +31,244 @@ start with a connection parameter.
 """
 
 
+# -------------------------#
+# --------VERSIONS---------#
+# -------------------------#
+# Cheap per-entity versions for ETags. Keys are (entity, entity_id), with entity_id 0
+# for whole collections:
+#   ("epoch", 0)                     changes when the tables are recreated
+#   ("businesses", 0)                the business list
+#   ("business", id)                 one business
+#   ("categories", 0)                every category read (list, tree, single)
+#   ("service", id)                  one service
+#   ("business_services", id)        the service list of one business
+#   ("opening_hours", business_id)   one business' opening hours
+# Write functions below bump the keys they affect inside their own transaction.
+NEW_VERSION_SQL = "(EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::bigint"
+
+
+def get_versions(con, keys: list[tuple[str, int]]):
+    """
+    Returns the current version of every key, in the same order, 0 for keys never bumped.
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT COALESCE(entity_versions.version, 0)
+                FROM unnest(%s::text[], %s::bigint[]) WITH ORDINALITY AS keys(entity, entity_id, position)
+                LEFT JOIN entity_versions
+                    ON entity_versions.entity = keys.entity
+                    AND entity_versions.entity_id = keys.entity_id
+                ORDER BY keys.position;
+                """,
+                ([key[0] for key in keys], [key[1] for key in keys]),
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+def _bump_versions(cursor, keys):
+    """
+    Gives every key a new, strictly higher version.
+    Expects a RealDictCursor, like every write function in this file.
+    """
+    keys = sorted(set(keys))  # fixed order, so concurrent writers can't deadlock
+    if not keys:
+        return
+    cursor.execute(
+        f"""
+        INSERT INTO entity_versions (entity, entity_id, version)
+        SELECT entity, entity_id, {NEW_VERSION_SQL}
+        FROM unnest(%s::text[], %s::bigint[]) AS keys(entity, entity_id)
+        ON CONFLICT (entity, entity_id)
+        DO UPDATE SET version = GREATEST(entity_versions.version + 1, EXCLUDED.version);
+        """,
+        ([key[0] for key in keys], [key[1] for key in keys]),
+    )
+
+
+def _bump_service_versions(cursor, service_ids):
+    """
+    Bumps the given services and the service lists of the businesses they belong to.
+    Works with any cursor: the link-table writers use plain tuple cursors.
+    """
+    with cursor.connection.cursor(cursor_factory=RealDictCursor) as dict_cursor:
+        dict_cursor.execute(
+            "SELECT id, business_id FROM services WHERE id = ANY(%s);", (list(service_ids),)
+        )
+        keys = []
+        for row in dict_cursor.fetchall():
+            keys += [("service", row["id"]), ("business_services", row["business_id"])]
+        _bump_versions(dict_cursor, keys)
+
+
+def _bump_owner_versions(cursor, user_id: int):
+    """
+    Bumps the businesses owned by a user, since they show the owner's name.
+    """
+    cursor.execute("SELECT id FROM businesses WHERE owner_id = %s;", (user_id,))
+    keys = [("business", row["id"]) for row in cursor.fetchall()]
+    _bump_versions(cursor, keys + [("businesses", 0)])
+
+
+# -------------------------#
+# ---------CACHE-----------#
+# -------------------------#
+# Single rows looked up by id, keyed by (entity, id). Missing rows are cached as None
+# for a shorter time, so repeated lookups of unknown ids don't reach Postgres.
+entity_cache = TTLCache(maxsize=10000, ttl_seconds=300, negative_ttl_seconds=30)
+
+# Cached rows that embed columns of another entity: entity -> [(dependent entity, column)]
+_CACHE_DEPENDENTS = {
+    "business": [("staffmember", "business_id"), ("service", "business_id")],  # business_name, cascades
+    "user": [("business", "owner_id")],  # owner_name
+    "category": [
+        ("business", "main_category_id"),  # main_category_name
+        ("category", "parent_id"),  # set to NULL when the parent is deleted
+    ],
+}
+
+
+# Other workers learn about writes through NOTIFY on this channel (see invalidation.py).
+# Payload: {"table": ..., "id": ..., "business_id": ...}, where id is null when any row
+# of the table may have changed.
+CHANGES_CHANNEL = "entity_changes"
+ENTITY_TABLES = {
+    "business": "businesses",
+    "service": "services",
+    "category": "categories",
+    "user": "users",
+    "staffmember": "staffmembers",
+}
+
+
+def notify_change(cursor, table: str, entity_id: Optional[int] = None, business_id: Optional[int] = None):
+    """
+    Tells every listening worker that a row changed. Call it in the write's transaction,
+    once the write has changed a row: Postgres delivers the message when the transaction
+    commits, and drops it if the transaction rolls back.
+    """
+    payload = json.dumps({"table": table, "id": entity_id, "business_id": business_id})
+    cursor.execute("SELECT pg_notify(%s, %s);", (CHANGES_CHANNEL, payload))
+
+
+def invalidate_entity(entity: str, entity_id: Optional[int]):
+    """
+    Drops one cached row and every cached row that embeds it.
+    With entity_id None, drops every cached row of that entity instead.
+    """
+    if entity_id is None:
+        entity_cache.delete_where(lambda key, row: key[0] == entity)
+        return
+    entity_cache.delete((entity, entity_id))
+    dependents = _CACHE_DEPENDENTS.get(entity)
+    if dependents:
+        entity_cache.delete_where(
+            lambda key, row: row is not None
+            and any(key[0] == dependent and row[column] == entity_id for dependent, column in dependents)
+        )
+
+
+def cached_entity(entity: str):
+    """
+    Decorator for get_<entity>_by_id style functions taking (con, id).
+    Callers get their own copy of the row, so changing it can't change the cache.
+    """
+    def decorator(load):
+        @functools.wraps(load)
+        def wrapper(con, entity_id: int):
+            row = entity_cache.get_or_load((entity, entity_id), lambda: load(con, entity_id))
+            return dict(row) if row is not None else None
+        return wrapper
+    return decorator
+
+
+class _JoinedTransaction:
+    """
+    Stands in for the connection inside a write wrapped by invalidates: its "with con:"
+    blocks join the wrapper's transaction instead of committing on their own.
+    """
+
+    def __init__(self, con):
+        self._con = con
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def __enter__(self):
+        return self._con
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def invalidates(entity: str, id_from: str = "argument"):
+    """
+    Decorator for write functions: notifies the other workers in the write's transaction
+    if the write returned a row, and once it has committed, drops the cached row.
+    The id is the first argument after con, or with id_from="result" the returned id
+    (or the "id" of a returned row), which clears a cached "not found" for new rows.
+    """
+    def decorator(write):
+        @functools.wraps(write)
+        def wrapper(con, *args, **kwargs):
+            with con:
+                result = write(_JoinedTransaction(con), *args, **kwargs)
+                if not result:
+                    return result
+                if id_from == "result":
+                    entity_id = result["id"] if isinstance(result, dict) else result
+                else:
+                    entity_id = args[0] if args else next(iter(kwargs.values()))
+                business_id = result.get("business_id") if isinstance(result, dict) else None
+                with con.cursor() as cursor:
+                    notify_change(cursor, ENTITY_TABLES[entity], entity_id, business_id)
+            invalidate_entity(entity, entity_id)
+            return result
+        return wrapper
+    return decorator
+
+
 # -------------------------#
 # ----------GET------------#
 # -------------------------#
+# The big list queries are kept as constants so the JSON, streaming and
+# CSV export variants further down run exactly the same SELECT.
+ALL_BUSINESSES_QUERY = """
+    SELECT 
+        businesses.id,
+        businesses.owner_id,
+        businesses.main_category_id,
+        businesses.name,
+        businesses.description,
+        businesses.street_name,
+        businesses.street_number,
+        businesses.city,
+        businesses.postal_code,
+        businesses.latitude,
+        businesses.longitude,
+        businesses.created_at,
+        users.firstname || ' ' || users.lastname AS owner_name,
+        categories.name AS main_category_name
+    FROM businesses
+    JOIN users ON users.id = businesses.owner_id
+    LEFT JOIN categories ON categories.id = businesses.main_category_id
+    ORDER BY businesses.name
+"""
+
+
 def get_all_businesses(con):
     """
     Return a list of all businesses with both IDs and readable names.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT 
-                    businesses.id,
-                    businesses.owner_id,
-                    businesses.main_category_id,
-                    businesses.name,
-                    businesses.description,
-                    businesses.street_name,
-                    businesses.street_number,
-                    businesses.city,
-                    businesses.postal_code,
-                    businesses.created_at,
-                    users.firstname || ' ' || users.lastname AS owner_name,
-                    categories.name AS main_category_name
-                FROM businesses
-                JOIN users ON users.id = businesses.owner_id
-                LEFT JOIN categories ON categories.id = businesses.main_category_id
-                ORDER BY businesses.name;
-            """)
+            cursor.execute(ALL_BUSINESSES_QUERY)
             businesses = cursor.fetchall()
     return businesses
 
 
+@cached_entity("business")
 def get_business_by_id(con, business_id: int):
     """
     Return ONE business by id with owner_name and main_category_name. NONE if it dosent exist
@@ -71,6 +286,8 @@ def get_business_by_id(con, business_id: int):
                     businesses.street_number,
                     businesses.city,
                     businesses.postal_code,
+                    businesses.latitude,
+                    businesses.longitude,
                     businesses.created_at,
                     users.firstname || ' ' || users.lastname AS owner_name,
                     categories.name AS main_category_name
@@ -93,6 +310,7 @@ def get_all_users(con):
             return cursor.fetchall()
 
 
+@cached_entity("user")
 def get_user_by_id(con, user_id: int):
     """
     Return ONE user by id, or None if it doesn't exist.
@@ -113,6 +331,7 @@ def get_all_categories(con):
             return cursor.fetchall()
 
 
+@cached_entity("category")
 def get_category_by_id(con, category_id: int):
     """
     Returns one category by id, or None if it doesn't exist.
@@ -123,6 +342,38 @@ def get_category_by_id(con, category_id: int):
             return cursor.fetchone()
 
 
+def get_category_parent(con, category_id: int):
+    """
+    Returns the parent of a category, or None if it has no parent or doesn't exist.
+    """
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT parent.*
+                FROM categories AS child
+                JOIN categories AS parent ON parent.id = child.parent_id
+                WHERE child.id = %s;
+            """, (category_id,))
+            return cursor.fetchone()
+
+
+def get_category_ancestors(con, category_id: int):
+    """
+    Returns the breadcrumb path for a category, from its root down to the category itself.
+    Empty list if the category doesn't exist.
+    """
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT categories.*, category_closure.depth
+                FROM category_closure
+                JOIN categories ON categories.id = category_closure.ancestor_id
+                WHERE category_closure.descendant_id = %s
+                ORDER BY category_closure.depth DESC;
+            """, (category_id,))
+            return cursor.fetchall()
+
+
 def get_all_staffmembers(con):
     """
     Returns all staff members in the database, including their business names.
@@ -146,6 +397,7 @@ def get_all_staffmembers(con):
             return cursor.fetchall()
 
 
+@cached_entity("staffmember")
 def get_staffmember_by_id(con, staff_id: int):
     """
     Returns one staff member by id, or None if it doesn't exist.
@@ -233,26 +485,30 @@ def get_opening_hours_for_business(con, business_id: int):
 
 def get_services_by_business(con, business_id: int):
     """
-    Get ALL services for ONE business
+    Get ALL services for ONE business, each with its list of categories.
+    The categories are aggregated in the same query instead of one query per service.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute(
                 """
                 SELECT services.*,
-                    businesses.name AS business_name
+                    businesses.name AS business_name,
+                    COALESCE(service_category_list.categories, '[]'::json) AS categories
                 FROM services
                 JOIN businesses ON businesses.id = services.business_id
+                LEFT JOIN LATERAL (
+                    SELECT json_agg(categories.* ORDER BY categories.id) AS categories
+                    FROM service_categories
+                    JOIN categories ON categories.id = service_categories.category_id
+                    WHERE service_categories.service_id = services.id
+                ) AS service_category_list ON TRUE
                 WHERE services.business_id = %s;
                 """, (business_id,),)
-            services = cursor.fetchall()
-
-    # Attach category names (list) to each service
-    for service in services:
-        service["categories"] = get_categories_for_service(con, service["id"])
-    return services
+            return cursor.fetchall()
 
 
+@cached_entity("service")
 def get_service(con, service_id: int):
     """
     Returns one service by id, or None if it doesn't exist.
@@ -286,9 +542,10 @@ def get_categories_for_service(con, service_id: int):
             return cursor.fetchall()
 
 
-def get_services_for_category(con, category_id: int):
+def get_services_for_category(con, category_id: int, include_descendants: bool = False):
     """
     Returns all services linked to a specific category.
+    With include_descendants, services linked to any subcategory are included too.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
@@ -297,11 +554,18 @@ def get_services_for_category(con, category_id: int):
                 SELECT services.*,
                     businesses.name AS business_name
                 FROM services
-                JOIN service_categories ON services.id = service_categories.service_id
                 JOIN businesses ON businesses.id = services.business_id
-                WHERE service_categories.category_id = %s;
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM service_categories
+                    JOIN category_closure
+                        ON category_closure.descendant_id = service_categories.category_id
+                    WHERE service_categories.service_id = services.id
+                        AND category_closure.ancestor_id = %s
+                        AND (%s OR category_closure.depth = 0)
+                );
                 """,
-                (category_id,),
+                (category_id, include_descendants),
             )
             return cursor.fetchall()
 
@@ -346,28 +610,202 @@ def get_categories_for_business(con, business_id: int):
             return cursor.fetchall()
 
 
-def get_services_by_categories(con, category_ids: list[int]):
+def get_services_by_categories(con, category_ids: list[int], include_descendants: bool = False):
     """
     Returns all services that belong to any of the given category IDs.
+    With include_descendants, subcategories of the given categories match as well.
     """
-    placeholders = ",".join(["%s"] * len(category_ids))  # e.g. %s,%s,%s
-
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute(
-                f"""
-                SELECT DISTINCT services.*,
-                            businesses.name AS business_name
+                """
+                SELECT services.*,
+                    businesses.name AS business_name
                 FROM services
-                JOIN service_categories ON services.id = service_categories.service_id
                 JOIN businesses ON businesses.id = services.business_id
-                WHERE service_categories.category_id IN ({placeholders});
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM service_categories
+                    JOIN category_closure
+                        ON category_closure.descendant_id = service_categories.category_id
+                    WHERE service_categories.service_id = services.id
+                        AND category_closure.ancestor_id = ANY(%s)
+                        AND (%s OR category_closure.depth = 0)
+                );
                 """,
-                category_ids,
+                (category_ids, include_descendants),
             )
             return cursor.fetchall()
 
 
+def _service_filters(
+    category_ids: Optional[list[int]] = None,
+    match: str = "any",
+    include_descendants: bool = False,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_duration: Optional[int] = None,
+    max_duration: Optional[int] = None,
+    city: Optional[str] = None,
+    is_active: Optional[bool] = None,
+):
+    """
+    Builds the WHERE conditions for filter_services as {facet: [(sql, params), ...]}.
+    Conditions expect services and businesses to be joined in the query.
+    """
+    filters = {}
+    if category_ids:
+        linked = """
+            SELECT 1
+            FROM service_categories
+            JOIN category_closure
+                ON category_closure.descendant_id = service_categories.category_id
+            WHERE service_categories.service_id = services.id
+                AND (%s OR category_closure.depth = 0)
+        """
+        if match == "all":
+            # no requested category may be missing from the service
+            sql = f"""NOT EXISTS (
+                SELECT 1 FROM unnest(%s::bigint[]) AS wanted(id)
+                WHERE NOT EXISTS ({linked} AND category_closure.ancestor_id = wanted.id)
+            )"""
+            params = [category_ids, include_descendants]
+        else:
+            sql = f"EXISTS ({linked} AND category_closure.ancestor_id = ANY(%s))"
+            params = [include_descendants, category_ids]
+        filters["categories"] = [(sql, params)]
+    if min_price is not None:
+        filters.setdefault("price", []).append(("services.price >= %s", [min_price]))
+    if max_price is not None:
+        filters.setdefault("price", []).append(("services.price <= %s", [max_price]))
+    if min_duration is not None:
+        filters.setdefault("duration", []).append(("services.duration_minutes >= %s", [min_duration]))
+    if max_duration is not None:
+        filters.setdefault("duration", []).append(("services.duration_minutes <= %s", [max_duration]))
+    if city is not None:
+        filters["city"] = [("businesses.city = %s", [city])]
+    if is_active is not None:
+        filters["is_active"] = [("services.is_active = %s", [is_active])]
+    return filters
+
+
+def _where(filters: dict, exclude: Optional[str] = None):
+    """
+    Joins the filters (except the excluded facet) into a WHERE clause and its params.
+    """
+    conditions = []
+    params = []
+    for facet, parts in filters.items():
+        if facet == exclude:
+            continue
+        for sql, part_params in parts:
+            conditions.append(sql)
+            params.extend(part_params)
+    if not conditions:
+        return "", params
+    return "WHERE " + " AND ".join(conditions), params
+
+
+def filter_services(con, limit: int = 20, offset: int = 0, **criteria):
+    """
+    Returns a page of services matching the given criteria, plus facet counts.
+    Each facet is counted with every filter applied except its own, so the
+    counts tell the client what it would get by changing that one filter.
+    criteria are the keyword arguments of _service_filters.
+    """
+    filters = _service_filters(**criteria)
+    base = """
+        FROM services
+        JOIN businesses ON businesses.id = services.business_id
+    """
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            where, params = _where(filters)
+            cursor.execute(f"""
+                SELECT services.*,
+                    businesses.name AS business_name,
+                    businesses.city,
+                    COUNT(*) OVER () AS total
+                {base}
+                {where}
+                ORDER BY services.name, services.id
+                LIMIT %s OFFSET %s;
+            """, params + [limit, offset])
+            results = cursor.fetchall()
+
+            if results:
+                total = results[0]["total"]
+            elif offset > 0:
+                # past the last match the page has no row to carry the total
+                where, params = _where(filters)
+                cursor.execute(f"SELECT COUNT(*) AS total {base} {where};", params)
+                total = cursor.fetchone()["total"]
+            else:
+                total = 0
+            for row in results:
+                row.pop("total")
+
+            where, params = _where(filters, exclude="categories")
+            cursor.execute(f"""
+                SELECT categories.id, categories.name, COUNT(*) AS count
+                {base}
+                JOIN service_categories ON service_categories.service_id = services.id
+                JOIN categories ON categories.id = service_categories.category_id
+                {where}
+                GROUP BY categories.id, categories.name
+                ORDER BY count DESC, categories.name;
+            """, params)
+            category_counts = cursor.fetchall()
+
+            where, params = _where(filters, exclude="city")
+            cursor.execute(f"""
+                SELECT businesses.city, COUNT(*) AS count
+                {base}
+                {where}
+                GROUP BY businesses.city
+                ORDER BY count DESC, businesses.city;
+            """, params)
+            city_counts = cursor.fetchall()
+
+            where, params = _where(filters, exclude="is_active")
+            cursor.execute(f"""
+                SELECT services.is_active, COUNT(*) AS count
+                {base}
+                {where}
+                GROUP BY services.is_active
+                ORDER BY services.is_active DESC;
+            """, params)
+            active_counts = cursor.fetchall()
+
+            where, params = _where(filters, exclude="price")
+            cursor.execute(f"""
+                SELECT MIN(services.price) AS min, MAX(services.price) AS max
+                {base}
+                {where};
+            """, params)
+            price_range = cursor.fetchone()
+
+            where, params = _where(filters, exclude="duration")
+            cursor.execute(f"""
+                SELECT MIN(services.duration_minutes) AS min, MAX(services.duration_minutes) AS max
+                {base}
+                {where};
+            """, params)
+            duration_range = cursor.fetchone()
+
+    return {
+        "total": total,
+        "results": results,
+        "facets": {
+            "categories": category_counts,
+            "cities": city_counts,
+            "is_active": active_counts,
+            "price": price_range,
+            "duration": duration_range,
+        },
+    }
+
+
 def get_booking(con, booking_id: int):
     """
     Returns one booking by id, or None if it doesn't exist.
@@ -391,26 +829,29 @@ def get_booking(con, booking_id: int):
             return cursor.fetchone()
 
 
+ALL_BOOKINGS_QUERY = """
+    SELECT 
+        bookings.*,
+        users.firstname || ' ' || users.lastname AS customer_name,
+        businesses.name AS business_name,
+        services.name AS service_name,
+        staffmembers.name AS staff_name
+    FROM bookings
+    JOIN users ON users.id = bookings.customer_id
+    JOIN businesses ON businesses.id = bookings.business_id
+    JOIN services ON services.id = bookings.service_id
+    LEFT JOIN staffmembers ON staffmembers.id = bookings.staff_id
+    ORDER BY bookings.starttime
+"""
+
+
 def get_bookings(con):
     """
     Returns all bookings in the database.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT 
-                    bookings.*,
-                    users.firstname || ' ' || users.lastname AS customer_name,
-                    businesses.name AS business_name,
-                    services.name AS service_name,
-                    staffmembers.name AS staff_name
-                FROM bookings
-                JOIN users ON users.id = bookings.customer_id
-                JOIN businesses ON businesses.id = bookings.business_id
-                JOIN services ON services.id = bookings.service_id
-                LEFT JOIN staffmembers ON staffmembers.id = bookings.staff_id
-                ORDER BY bookings.starttime;
-            """)
+            cursor.execute(ALL_BOOKINGS_QUERY)
             return cursor.fetchall()
 
 
@@ -522,25 +963,29 @@ def get_bookings_by_service(con, service_id: int):
             return cursor.fetchall()
 
 
+ALL_PAYMENTS_QUERY = """
+    SELECT 
+        payments.*,
+        bookings.starttime AS booking_starttime,
+        users.firstname || ' ' || users.lastname AS customer_name,
+        businesses.name AS business_name,
+        services.name AS service_name,
+        bookings.business_id
+    FROM payments
+    JOIN bookings ON bookings.id = payments.booking_id
+    JOIN users ON users.id = bookings.customer_id
+    JOIN businesses ON businesses.id = bookings.business_id
+    JOIN services ON services.id = bookings.service_id
+"""
+
+
 def get_all_payments(con):
     """
     Returns all payments in the database.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT 
-                    payments.*,
-                    bookings.starttime AS booking_starttime,
-                    users.firstname || ' ' || users.lastname AS customer_name,
-                    businesses.name AS business_name,
-                    services.name AS service_name
-                FROM payments
-                JOIN bookings ON bookings.id = payments.booking_id
-                JOIN users ON users.id = bookings.customer_id
-                JOIN businesses ON businesses.id = bookings.business_id
-                JOIN services ON services.id = bookings.service_id;
-            """)
+            cursor.execute(ALL_PAYMENTS_QUERY)
             return cursor.fetchall()
 
 
@@ -672,24 +1117,27 @@ def get_review(con, review_id: int):
             return cursor.fetchone()
 
 
+ALL_REVIEWS_QUERY = """
+    SELECT reviews.*,
+        services.name AS service_name,
+        businesses.name AS business_name,
+        users.firstname || ' ' || users.lastname AS customer_name
+    FROM reviews
+    JOIN users ON users.id = reviews.customer_id
+    JOIN businesses ON businesses.id = reviews.business_id
+    JOIN bookings ON bookings.id = reviews.booking_id
+    JOIN services ON services.id = bookings.service_id
+    ORDER BY reviews.created_at DESC
+"""
+
+
 def get_all_reviews(con):
     """
     Returns all reviews in the database.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT reviews.*,
-                    services.name AS service_name,
-                    businesses.name AS business_name,
-                    users.firstname || ' ' || users.lastname AS customer_name
-                FROM reviews
-                JOIN users ON users.id = reviews.customer_id
-                JOIN businesses ON businesses.id = reviews.business_id
-                JOIN bookings ON bookings.id = reviews.booking_id
-                JOIN services ON services.id = bookings.service_id
-                ORDER BY reviews.created_at DESC;
-                """)
+            cursor.execute(ALL_REVIEWS_QUERY)
             return cursor.fetchall()
 
 
@@ -848,20 +1296,28 @@ def get_business_categories(con, business_id: int):
             """, (business_id,))
             return [row["name"] for row in cursor.fetchall()]
 
-def get_businesses_by_category(con, category_id: int):
+def get_businesses_by_category(con, category_id: int, include_descendants: bool = False):
     """
     Returns all businesses associated with a specific category.
+    With include_descendants, businesses offering services in any subcategory are included too.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute("""
-                SELECT DISTINCT businesses.*
+                SELECT businesses.*
                 FROM businesses
-                JOIN services ON services.business_id = businesses.id
-                JOIN service_categories ON service_categories.service_id = services.id
-                WHERE service_categories.category_id = %s
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM services
+                    JOIN service_categories ON service_categories.service_id = services.id
+                    JOIN category_closure
+                        ON category_closure.descendant_id = service_categories.category_id
+                    WHERE services.business_id = businesses.id
+                        AND category_closure.ancestor_id = %s
+                        AND (%s OR category_closure.depth = 0)
+                )
                 ORDER BY businesses.name;
-            """, (category_id,))
+            """, (category_id, include_descendants))
             return cursor.fetchall()
 
 def get_business_hours_for_date(con, business_id: int, weekday: int):
@@ -891,9 +1347,811 @@ def get_bookings_for_business_and_date(con, business_id: int, date: str):
             return cursor.fetchall()
 
 
+def search(con, query: str, limit: int = 20, offset: int = 0):
+    """
+    Full-text search over businesses (name, city, description) and
+    services (name, description) using Swedish stemming.
+    Returns a ranked page of hits together with the total number of hits.
+    The total comes with the page; only a page past the last hit needs a count of its own.
+    """
+    hits = """
+        FROM search_documents
+        CROSS JOIN websearch_to_tsquery('swedish', %s) AS query
+        JOIN businesses ON businesses.id = search_documents.business_id
+        LEFT JOIN services
+            ON search_documents.entity_type = 'service'
+            AND services.id = search_documents.entity_id
+        WHERE search_documents.document @@ query
+            AND (services.id IS NULL OR services.is_active)
+    """
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(f"""
+                SELECT
+                    search_documents.entity_type AS type,
+                    search_documents.entity_id AS id,
+                    search_documents.business_id,
+                    COALESCE(services.name, businesses.name) AS name,
+                    CASE search_documents.entity_type
+                        WHEN 'service' THEN services.description
+                        ELSE businesses.description
+                    END AS description,
+                    businesses.name AS business_name,
+                    businesses.city,
+                    ts_rank_cd(search_documents.document, query) AS rank,
+                    COUNT(*) OVER () AS total
+                {hits}
+                ORDER BY rank DESC, search_documents.entity_type, search_documents.entity_id
+                LIMIT %s OFFSET %s;
+            """, (query, limit, offset))
+            rows = cursor.fetchall()
+
+            if rows:
+                total = rows[0]["total"]
+            elif offset > 0:
+                cursor.execute(f"SELECT COUNT(*) AS total {hits};", (query,))
+                total = cursor.fetchone()["total"]
+            else:
+                total = 0
+
+    for row in rows:
+        row.pop("total")
+    return {"total": total, "results": rows}
+
+
+def get_nearby_businesses(
+    con,
+    latitude: float,
+    longitude: float,
+    radius_km: float = 5,
+    category_id: Optional[int] = None,
+    include_descendants: bool = False,
+    limit: int = 20,
+):
+    """
+    Returns businesses within radius_km of a point, nearest first, with distance_km.
+    The earth_box condition is answered by the GiST location index, so only
+    businesses inside the bounding box are measured and sorted.
+    Optionally restricted to businesses offering services in a category.
+    """
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT 
+                    businesses.id,
+                    businesses.owner_id,
+                    businesses.main_category_id,
+                    businesses.name,
+                    businesses.description,
+                    businesses.street_name,
+                    businesses.street_number,
+                    businesses.city,
+                    businesses.postal_code,
+                    businesses.latitude,
+                    businesses.longitude,
+                    businesses.created_at,
+                    users.firstname || ' ' || users.lastname AS owner_name,
+                    categories.name AS main_category_name,
+                    earth_distance(
+                        ll_to_earth(%(latitude)s, %(longitude)s),
+                        ll_to_earth(businesses.latitude, businesses.longitude)
+                    ) / 1000 AS distance_km
+                FROM businesses
+                JOIN users ON users.id = businesses.owner_id
+                LEFT JOIN categories ON categories.id = businesses.main_category_id
+                WHERE earth_box(ll_to_earth(%(latitude)s, %(longitude)s), %(radius_m)s)
+                        @> ll_to_earth(businesses.latitude, businesses.longitude)
+                    AND earth_distance(
+                        ll_to_earth(%(latitude)s, %(longitude)s),
+                        ll_to_earth(businesses.latitude, businesses.longitude)
+                    ) <= %(radius_m)s
+                    AND (
+                        %(category_id)s::bigint IS NULL
+                        OR EXISTS (
+                            SELECT 1
+                            FROM services
+                            JOIN service_categories ON service_categories.service_id = services.id
+                            JOIN category_closure
+                                ON category_closure.descendant_id = service_categories.category_id
+                            WHERE services.business_id = businesses.id
+                                AND category_closure.ancestor_id = %(category_id)s
+                                AND (%(include_descendants)s OR category_closure.depth = 0)
+                        )
+                    )
+                ORDER BY distance_km
+                LIMIT %(limit)s;
+            """, {
+                "latitude": latitude,
+                "longitude": longitude,
+                "radius_m": radius_km * 1000,
+                "category_id": category_id,
+                "include_descendants": include_descendants,
+                "limit": limit,
+            })
+            return cursor.fetchall()
+
+
+def get_autocomplete_suggestions(con, term: str, limit: int = 10):
+    """
+    Returns typo-tolerant name suggestions for businesses, services and categories.
+    Each type contributes its limit nearest names, read in distance order (<<->, word
+    similarity, so prefixes match) straight from its GiST trigram index. Those candidates
+    are then ordered by similarity and popularity (reviews, bookings or linked services).
+    """
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                WITH candidates AS (
+                    (
+                        SELECT 'business' AS type, id, name,
+                            word_similarity(%(term)s, name) AS similarity
+                        FROM businesses
+                        WHERE %(term)s <%% name
+                        ORDER BY %(term)s <<-> name
+                        LIMIT %(limit)s
+                    )
+                    UNION ALL
+                    (
+                        SELECT 'service' AS type, id, name,
+                            word_similarity(%(term)s, name) AS similarity
+                        FROM services
+                        WHERE %(term)s <%% name AND is_active
+                        ORDER BY %(term)s <<-> name
+                        LIMIT %(limit)s
+                    )
+                    UNION ALL
+                    (
+                        SELECT 'category' AS type, id, name,
+                            word_similarity(%(term)s, name) AS similarity
+                        FROM categories
+                        WHERE %(term)s <%% name
+                        ORDER BY %(term)s <<-> name
+                        LIMIT %(limit)s
+                    )
+                )
+                SELECT
+                    candidates.type,
+                    candidates.id,
+                    candidates.name,
+                    candidates.similarity,
+                    CASE candidates.type
+                        WHEN 'business' THEN (
+                            SELECT COUNT(*) FROM reviews WHERE reviews.business_id = candidates.id
+                        )
+                        WHEN 'service' THEN (
+                            SELECT COUNT(*) FROM bookings WHERE bookings.service_id = candidates.id
+                        )
+                        ELSE (
+                            SELECT COUNT(*) FROM service_categories
+                            WHERE service_categories.category_id = candidates.id
+                        )
+                    END AS popularity
+                FROM candidates
+                ORDER BY ROUND(candidates.similarity::numeric, 1) DESC,
+                    popularity DESC,
+                    candidates.similarity DESC
+                LIMIT %(limit)s;
+            """, {"term": term, "limit": limit})
+            return cursor.fetchall()
+
+
+# -------------------------#
+# -------JSON LISTS--------#
+# -------------------------#
+def json_object_sql(fields: dict):
+    """
+    Builds a json_build_object(...) expression over the columns of a subquery aliased rows.
+    fields maps each output key to a SQL template for its column (or None),
+    e.g. {"amount": "{}::text"}, so only those columns are included,
+    in the format the response model would produce.
+    """
+    columns = ", ".join(
+        f"'{name}', " + (sql.format(f"rows.{name}") if sql else f"rows.{name}")
+        for name, sql in fields.items()
+    )
+    return f"json_build_object({columns})"
+
+
+def fetch_json_array(con, query: str, fields: dict, params=()):
+    """
+    Runs query and lets Postgres render the rows as one JSON array.
+    Returns the JSON text, ready to be sent as the response body.
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT COALESCE(json_agg({json_object_sql(fields)}), '[]')::text
+                FROM ({query}) AS rows;
+                """,
+                params,
+            )
+            return cursor.fetchone()[0]
+
+
+def stream_json_rows(con, query: str, fields: dict, params=(), chunk_size: int = 1000):
+    """
+    Generator that runs query through a server-side (named) cursor and yields
+    lists of at most chunk_size rows, each row already rendered as JSON text by Postgres.
+    Only one chunk is held in memory at a time, whatever the size of the result.
+    """
+    with con:
+        with con.cursor(name="json_stream") as cursor:
+            cursor.execute(
+                f"SELECT {json_object_sql(fields)}::text FROM ({query}) AS rows;",
+                params,
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+
+
+def get_all_businesses_json(con, fields: dict):
+    """
+    Same rows as get_all_businesses, rendered as a JSON array by Postgres.
+    """
+    return fetch_json_array(con, ALL_BUSINESSES_QUERY, fields)
+
+
+def get_bookings_json(con, fields: dict):
+    """
+    Same rows as get_bookings, rendered as a JSON array by Postgres.
+    """
+    return fetch_json_array(con, ALL_BOOKINGS_QUERY, fields)
+
+
+def get_all_payments_json(con, fields: dict):
+    """
+    Same rows as get_all_payments, rendered as a JSON array by Postgres.
+    """
+    return fetch_json_array(con, ALL_PAYMENTS_QUERY, fields)
+
+
+def get_all_reviews_json(con, fields: dict):
+    """
+    Same rows as get_all_reviews, rendered as a JSON array by Postgres.
+    """
+    return fetch_json_array(con, ALL_REVIEWS_QUERY, fields)
+
+
+def stream_all_businesses(con, fields: dict):
+    """
+    Same rows as get_all_businesses, streamed in chunks of JSON rows.
+    """
+    return stream_json_rows(con, ALL_BUSINESSES_QUERY, fields)
+
+
+def stream_bookings(con, fields: dict):
+    """
+    Same rows as get_bookings, streamed in chunks of JSON rows.
+    """
+    return stream_json_rows(con, ALL_BOOKINGS_QUERY, fields)
+
+
+def stream_all_payments(con, fields: dict):
+    """
+    Same rows as get_all_payments, streamed in chunks of JSON rows.
+    """
+    return stream_json_rows(con, ALL_PAYMENTS_QUERY, fields)
+
+
+def stream_all_reviews(con, fields: dict):
+    """
+    Same rows as get_all_reviews, streamed in chunks of JSON rows.
+    """
+    return stream_json_rows(con, ALL_REVIEWS_QUERY, fields)
+
+
+# -------------------------#
+# -------CSV EXPORT--------#
+# -------------------------#
+class _CopyCancelled(Exception):
+    """Raised inside COPY when the client has stopped reading the export."""
+
+
+class _QueueWriter:
+    """
+    File-like object for cursor.copy_expert that groups the COPY output (bytes) into
+    chunks of about buffer_size bytes and hands them to a bounded queue.
+    The bounded queue makes COPY wait for the client instead of buffering everything.
+    """
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event, buffer_size: int = 65536):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise _CopyCancelled()
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(b"".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+
+def _copy_to_queue(con, query: str, params, chunks: queue.Queue, cancelled: threading.Event):
+    """
+    Runs COPY (query) TO STDOUT as CSV and feeds the output into chunks.
+    Ends with None on success or with the raised exception on failure.
+    """
+    writer = _QueueWriter(chunks, cancelled)
+    try:
+        with con:
+            with con.cursor() as cursor:
+                # COPY takes no bind parameters, so they are inlined safely with mogrify
+                inlined = cursor.mogrify(query, params).decode()
+                cursor.copy_expert(
+                    f"COPY ({inlined}) TO STDOUT WITH (FORMAT csv, HEADER true)", writer
+                )
+        writer.flush()
+        writer.put(None)
+    except _CopyCancelled:
+        pass
+    except Exception as error:
+        if not cancelled.is_set():
+            chunks.put(error)
+
+
+def stream_copy_csv(con, query: str, params=()):
+    """
+    Generator that yields the CSV output of query (header included) in chunks,
+    straight from Postgres' COPY without building any rows in Python.
+    COPY runs in a background thread; closing the generator cancels it.
+    """
+    chunks = queue.Queue(maxsize=8)
+    cancelled = threading.Event()
+    worker = threading.Thread(
+        target=_copy_to_queue, args=(con, query, params, chunks, cancelled), daemon=True
+    )
+    worker.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
+        worker.join()
+
+
+def _export_query(query: str, date_column: str):
+    """
+    Wraps one of the list queries with the optional business and date-range filters of the exports.
+    date_to is inclusive.
+    """
+    return f"""
+        SELECT *
+        FROM ({query}) AS rows
+        WHERE (%(business_id)s::bigint IS NULL OR rows.business_id = %(business_id)s)
+            AND (%(date_from)s::date IS NULL OR rows.{date_column} >= %(date_from)s::date)
+            AND (%(date_to)s::date IS NULL OR rows.{date_column} < %(date_to)s::date + 1)
+    """
+
+
+def export_bookings_csv(
+    con,
+    business_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """
+    Streams bookings (same columns as get_bookings) as CSV, filtered on starttime and business.
+    """
+    params = {"business_id": business_id, "date_from": date_from, "date_to": date_to}
+    return stream_copy_csv(con, _export_query(ALL_BOOKINGS_QUERY, "starttime"), params)
+
+
+def export_payments_csv(
+    con,
+    business_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """
+    Streams payments (same columns as get_all_payments) as CSV, filtered on created_at and business.
+    """
+    params = {"business_id": business_id, "date_from": date_from, "date_to": date_to}
+    return stream_copy_csv(con, _export_query(ALL_PAYMENTS_QUERY, "created_at"), params)
+
+
+def export_reviews_csv(
+    con,
+    business_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """
+    Streams reviews (same columns as get_all_reviews) as CSV, filtered on created_at and business.
+    """
+    params = {"business_id": business_id, "date_from": date_from, "date_to": date_to}
+    return stream_copy_csv(con, _export_query(ALL_REVIEWS_QUERY, "created_at"), params)
+
+
+# -------------------------#
+# -------BULK IMPORT-------#
+# -------------------------#
+# Column rules for every importable table. "type" is int, numeric, bool or text;
+# "references" names the table the id must exist in; "unique" columns may not
+# repeat within the file or collide with existing rows.
+IMPORT_SPECS = {
+    "businesses": {
+        "table": "businesses",
+        "has_id": True,
+        "cached_as": "business",
+        "columns": {
+            "owner_id": {"type": "int", "required": True, "references": "users"},
+            "main_category_id": {"type": "int", "references": "categories"},
+            "name": {"type": "text", "required": True, "max_length": 30},
+            "description": {"type": "text"},
+            "street_name": {"type": "text", "max_length": 50},
+            "street_number": {"type": "text", "max_length": 10},
+            "city": {"type": "text", "max_length": 30},
+            "postal_code": {"type": "text", "max_length": 10},
+        },
+    },
+    "services": {
+        "table": "services",
+        "has_id": True,
+        "cached_as": "service",
+        "columns": {
+            "business_id": {"type": "int", "required": True, "references": "businesses"},
+            "name": {"type": "text", "required": True, "max_length": 30},
+            "description": {"type": "text"},
+            "duration_minutes": {"type": "int", "required": True, "min": 1},
+            "price": {"type": "numeric", "required": True, "min": 0},
+            "is_active": {"type": "bool", "default": "TRUE"},
+        },
+    },
+    "staffmembers": {
+        "table": "staffmembers",
+        "has_id": True,
+        "cached_as": "staffmember",
+        "columns": {
+            "business_id": {"type": "int", "required": True, "references": "businesses"},
+            "name": {"type": "text", "required": True, "max_length": 50},
+            "email": {"type": "text", "required": True, "max_length": 255, "unique": True},
+            "phone_number": {"type": "text", "max_length": 25},
+            "role": {"type": "text", "max_length": 20},
+            "is_active": {"type": "bool", "default": "TRUE"},
+        },
+    },
+    "staff-services": {
+        "table": "staff_service",
+        "has_id": False,
+        "columns": {
+            "staff_id": {"type": "int", "required": True, "references": "staffmembers"},
+            "service_id": {"type": "int", "required": True, "references": "services"},
+        },
+    },
+    "service-categories": {
+        "table": "service_categories",
+        "has_id": False,
+        "columns": {
+            "service_id": {"type": "int", "required": True, "references": "services"},
+            "category_id": {"type": "int", "required": True, "references": "categories"},
+        },
+    },
+}
+
+_TYPE_PATTERNS = {
+    "int": "^-?[0-9]{1,18}$",
+    "numeric": "^-?[0-9]{1,8}([.][0-9]{1,2})?$",
+    "bool": "^(true|false|t|f|yes|no|1|0)$",
+}
+
+_SQL_TYPES = {"int": "bigint", "numeric": "numeric", "bool": "boolean", "text": "text"}
+
+# How many failed rows are listed in the report; the counts always cover every row
+MAX_REPORTED_ERRORS = 1000
+
+
+class _NdjsonAsCsv:
+    """
+    Read-only file-like object that turns NDJSON lines into CSV rows for COPY,
+    one line at a time. Every CSV row starts with its line number.
+    Lines that are not JSON objects with known keys are recorded in errors instead.
+    """
+
+    def __init__(self, file, columns: list[str]):
+        self.lines = iter(file)
+        self.columns = columns
+        self.known = set(columns)
+        self.errors = []
+        self.line_number = 0
+        self.pending = b""
+
+    def _next_row(self):
+        for line in self.lines:
+            self.line_number += 1
+            if not line.strip():
+                continue
+            try:
+                doc = json.loads(line)
+            except ValueError:
+                self.errors.append((self.line_number, "invalid JSON"))
+                continue
+            if not isinstance(doc, dict):
+                self.errors.append((self.line_number, "expected a JSON object"))
+                continue
+            unknown = sorted(set(doc) - self.known)
+            if unknown:
+                self.errors.append((self.line_number, f"unknown field(s): {', '.join(unknown)}"))
+                continue
+            values = [self.line_number]
+            for column in self.columns:
+                value = doc.get(column)
+                if isinstance(value, bool):
+                    value = "true" if value else "false"
+                elif isinstance(value, (dict, list)):
+                    value = json.dumps(value)
+                values.append(value)
+            out = io.StringIO()
+            csv.writer(out, lineterminator="\n").writerow(values)
+            return out.getvalue().encode()
+        return b""
+
+    def read(self, size: int = -1):
+        while size < 0 or len(self.pending) < size:
+            row = self._next_row()
+            if not row:
+                break
+            self.pending += row
+        if size < 0:
+            size = len(self.pending)
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+
+def _import_rules(spec: dict):
+    """
+    Yields (condition, message) pairs; every staging row matching a condition fails with that message.
+    """
+    for column, rules in spec["columns"].items():
+        present = f"NULLIF(staging.{column}, '') IS NOT NULL"
+        pattern = _TYPE_PATTERNS.get(rules["type"])
+        valid = f"lower(staging.{column}) ~ '{pattern}'" if pattern else present
+
+        if rules.get("required"):
+            yield f"NOT ({present})", f"{column} is required"
+        if pattern:
+            yield f"{present} AND NOT {valid}", f"{column} must be a valid {rules['type']}"
+        if "max_length" in rules:
+            yield (
+                f"length(staging.{column}) > {rules['max_length']}",
+                f"{column} is longer than {rules['max_length']} characters",
+            )
+        # CASE makes sure the cast only runs on values that passed the type check
+        if "min" in rules:
+            yield (
+                f"""CASE WHEN {valid}
+                    THEN staging.{column}::{_SQL_TYPES[rules['type']]} < {rules['min']}
+                    ELSE FALSE END""",
+                f"{column} must be at least {rules['min']}",
+            )
+        if "references" in rules:
+            yield (
+                f"""CASE WHEN {valid}
+                    THEN NOT EXISTS (
+                        SELECT 1 FROM {rules['references']} WHERE id = staging.{column}::bigint
+                    )
+                    ELSE FALSE END""",
+                f"{column} does not exist in {rules['references']}",
+            )
+        if rules.get("unique"):
+            yield (
+                f"""EXISTS (
+                    SELECT 1 FROM {spec['table']} WHERE {column} = staging.{column}
+                )""",
+                f"{column} already exists",
+            )
+            yield (
+                f"""EXISTS (
+                    SELECT 1 FROM import_staging AS earlier
+                    WHERE earlier.{column} = staging.{column}
+                        AND earlier.row_number < staging.row_number
+                )""",
+                f"{column} is repeated in the file",
+            )
+
+
+def _import_value_sql(column: str, rules: dict):
+    """
+    SQL expression that casts a validated staging column to its target type.
+    """
+    value = f"NULLIF(staging.{column}, '')::{_SQL_TYPES[rules['type']]}"
+    if "default" in rules:
+        value = f"COALESCE({value}, {rules['default']})"
+    return value
+
+
+def bulk_import(con, kind: str, file, file_format: str = "csv", atomic: bool = False):
+    """
+    Bulk loads rows of one IMPORT_SPECS kind from a CSV (with header) or NDJSON file object.
+    Rows are COPY'd into a staging table, validated with set-based queries,
+    and the valid rows are inserted with one INSERT ... SELECT, all in one transaction.
+    With atomic, nothing is inserted if any row fails.
+    Rows are numbered from 1 after the CSV header, or by line number for NDJSON.
+    Returns a report with counts, the ids created per row and the per-row errors.
+    Raises ValueError if the file's columns don't match the spec.
+    """
+    spec = IMPORT_SPECS[kind]
+    columns = spec["columns"]
+
+    if file_format == "csv":
+        header_line = file.readline().decode("utf-8-sig")
+        file_columns = next(csv.reader([header_line]), [])
+        unknown = sorted(set(file_columns) - set(columns))
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+        if len(file_columns) != len(set(file_columns)):
+            duplicates = sorted({column for column in file_columns if file_columns.count(column) > 1})
+            raise ValueError(f"Duplicate column(s): {', '.join(duplicates)}")
+        source = file
+        copy_columns = file_columns
+        parse_errors = []
+    else:
+        source = _NdjsonAsCsv(file, list(columns))
+        copy_columns = ["row_number"] + list(columns)
+        parse_errors = source.errors
+        file_columns = list(columns)
+
+    missing = sorted(
+        column for column, rules in columns.items()
+        if rules.get("required") and column not in file_columns
+    )
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            staging_columns = ", ".join(f"{column} TEXT" for column in columns)
+            cursor.execute(f"""
+                CREATE TEMP TABLE import_staging (
+                    row_number BIGINT GENERATED BY DEFAULT AS IDENTITY,
+                    new_id BIGINT,
+                    {staging_columns}
+                ) ON COMMIT DROP;
+                CREATE TEMP TABLE import_errors (
+                    row_number BIGINT NOT NULL,
+                    error TEXT NOT NULL
+                ) ON COMMIT DROP;
+            """)
+            cursor.copy_expert(
+                f"COPY import_staging ({', '.join(copy_columns)}) FROM STDIN WITH (FORMAT csv)",
+                source,
+            )
+            cursor.execute("CREATE INDEX ON import_staging (row_number); ANALYZE import_staging;")
+
+            for row_number, error in parse_errors:
+                cursor.execute(
+                    "INSERT INTO import_errors (row_number, error) VALUES (%s, %s);",
+                    (row_number, error),
+                )
+            for condition, message in _import_rules(spec):
+                cursor.execute(
+                    f"""
+                    INSERT INTO import_errors (row_number, error)
+                    SELECT staging.row_number, %s
+                    FROM import_staging AS staging
+                    WHERE {condition};
+                    """,
+                    (message,),
+                )
+
+            cursor.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM import_staging) AS staged,
+                    (SELECT COUNT(DISTINCT row_number) FROM import_errors) AS failed;
+            """)
+            counts = cursor.fetchone()
+            received = counts["staged"] + len(parse_errors)
+
+            cursor.execute("""
+                SELECT row_number AS row, array_agg(error ORDER BY error) AS errors
+                FROM import_errors
+                GROUP BY row_number
+                ORDER BY row_number
+                LIMIT %s;
+            """, (MAX_REPORTED_ERRORS,))
+            errors = cursor.fetchall()
+
+            applied = not (atomic and counts["failed"])
+            inserted = 0
+            created = []
+            if applied:
+                target_columns = list(columns)
+                values = [_import_value_sql(column, columns[column]) for column in target_columns]
+                valid_rows = """
+                    FROM import_staging AS staging
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM import_errors
+                        WHERE import_errors.row_number = staging.row_number
+                    )
+                """
+                if spec["has_id"]:
+                    # Reserve ids up front so every created id can be reported next to its row
+                    cursor.execute(f"""
+                        UPDATE import_staging AS target
+                        SET new_id = nextval(pg_get_serial_sequence('{spec['table']}', 'id'))
+                        FROM (
+                            SELECT staging.row_number {valid_rows} ORDER BY staging.row_number
+                        ) AS valid
+                        WHERE target.row_number = valid.row_number;
+                    """)
+                    target_columns = ["id"] + target_columns
+                    values = ["staging.new_id"] + values
+                    conflict = ""
+                else:
+                    conflict = "ON CONFLICT DO NOTHING"
+                cursor.execute(f"""
+                    INSERT INTO {spec['table']} ({', '.join(target_columns)})
+                    SELECT {', '.join(values)}
+                    {valid_rows}
+                    ORDER BY staging.row_number
+                    {conflict};
+                """)
+                inserted = cursor.rowcount
+                if spec["has_id"]:
+                    cursor.execute("""
+                        SELECT row_number AS row, new_id AS id
+                        FROM import_staging
+                        WHERE new_id IS NOT NULL
+                        ORDER BY row_number;
+                    """)
+                    created = cursor.fetchall()
+                if inserted and kind == "businesses":
+                    _bump_versions(cursor, [("businesses", 0)])
+                elif inserted and kind == "services":
+                    _bump_service_versions(cursor, [row["id"] for row in created])
+                elif inserted and kind == "service-categories":
+                    cursor.execute(f"SELECT DISTINCT staging.service_id::bigint AS id {valid_rows};")
+                    _bump_service_versions(cursor, [row["id"] for row in cursor.fetchall()])
+                if inserted:
+                    # one message for the whole batch instead of one per row
+                    notify_change(cursor, spec["table"])
+
+    for row in created:
+        invalidate_entity(spec["cached_as"], row["id"])
+
+    return {
+        "kind": kind,
+        "applied": applied,
+        "received": received,
+        "inserted": inserted,
+        # valid rows that were already there (links only)
+        "skipped": received - counts["failed"] - inserted if applied else 0,
+        "failed": counts["failed"],
+        "created": created,
+        "errors": errors,
+    }
+
+
 # -------------------------#
 # ---------POST------------#
 # -------------------------#
+@invalidates("business", id_from="result")
 def create_business(con, business):
     """
     Insert a new business into the database and return its id.
@@ -927,9 +2185,11 @@ def create_business(con, business):
                 ),
             )
             business_id = cursor.fetchone()["id"]
+            _bump_versions(cursor, [("businesses", 0), ("business", business_id)])
     return business_id
 
 
+@invalidates("user", id_from="result")
 def create_user(con, user):
     """
     Insert a new user into the database and return its id.
@@ -956,6 +2216,7 @@ def create_user(con, user):
             return cursor.fetchone()["id"]
 
 
+@invalidates("category", id_from="result")
 def create_category(con, category):
     """
     Creates a new category and returns its id.
@@ -970,9 +2231,12 @@ def create_category(con, category):
                 """,
                 (category.name, category.description, category.parent_id),
             )
-            return cursor.fetchone()["id"]
+            category_id = cursor.fetchone()["id"]
+            _bump_versions(cursor, [("categories", 0)])
+            return category_id
 
 
+@invalidates("staffmember", id_from="result")
 def create_staffmember(con, staff_member):
     """
     Creates a new staff member and returns its id.
@@ -1029,27 +2293,67 @@ def create_business_image(con, business_image):
 def replace_opening_hours(con, business_id: int, hours_list):
     """
     Replaces all opening hours for a business with the provided list.
+    Only the difference against the current hours is written: at most one
+    multi-row upsert and one delete, and nothing at all if the hours are unchanged.
+    Returns True if anything changed.
     """
+    wanted = {entry.weekday: (entry.open_time, entry.closing_time) for entry in hours_list}
+
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            # delete old hours
             cursor.execute(
-                "DELETE FROM business_opening_hours WHERE business_id = %s;",
+                """
+                SELECT weekday, open_time, closing_time
+                FROM business_opening_hours
+                WHERE business_id = %s
+                FOR UPDATE;
+                """,
                 (business_id,),
             )
-            # insert new hours
-            for entry in hours_list:
+            current = {
+                row["weekday"]: (row["open_time"], row["closing_time"])
+                for row in cursor.fetchall()
+            }
+
+            upserts = [
+                (weekday, times)
+                for weekday, times in sorted(wanted.items())
+                if current.get(weekday) != times
+            ]
+            removed = [weekday for weekday in current if weekday not in wanted]
+
+            if upserts:
                 cursor.execute(
                     """
                     INSERT INTO business_opening_hours (business_id, weekday, open_time, closing_time)
-                    VALUES (%s, %s, %s, %s);
+                    SELECT %s, * FROM unnest(%s::smallint[], %s::time[], %s::time[])
+                    ON CONFLICT (business_id, weekday)
+                    DO UPDATE SET open_time = EXCLUDED.open_time,
+                        closing_time = EXCLUDED.closing_time;
                     """,
-                    (business_id, entry.weekday, entry.open_time, entry.closing_time),
+                    (
+                        business_id,
+                        [weekday for weekday, _ in upserts],
+                        [times[0] for _, times in upserts],
+                        [times[1] for _, times in upserts],
+                    ),
                 )
+            if removed:
+                cursor.execute(
+                    """
+                    DELETE FROM business_opening_hours
+                    WHERE business_id = %s AND weekday = ANY(%s);
+                    """,
+                    (business_id, removed),
+                )
+            if upserts or removed:
+                _bump_versions(cursor, [("opening_hours", business_id)])
+                notify_change(cursor, "business_opening_hours", business_id=business_id)
 
-            return True
+    return bool(upserts or removed)
 
 
+@invalidates("service", id_from="result")
 def create_service(con, service: dict):
     """
     Creates a new service and returns the created service record.
@@ -1072,7 +2376,9 @@ def create_service(con, service: dict):
                     service.get("is_active", True),
                 ),
             )
-            return cursor.fetchone()
+            created = cursor.fetchone()
+            _bump_service_versions(cursor, [created["id"]])
+            return created
 
 
 def add_category_to_service(con, service_id: int, category_id: int):
@@ -1090,7 +2396,11 @@ def add_category_to_service(con, service_id: int, category_id: int):
             """,
                 (service_id, category_id),
             )
-            return cursor.fetchone()
+            added = cursor.fetchone()
+            if added:
+                _bump_service_versions(cursor, [service_id])
+                notify_change(cursor, "service_categories", service_id)
+    return added
 
 
 def create_booking(con, booking: dict):
@@ -1160,7 +2470,9 @@ def create_review(con, review):
                     review.comment,
                 ),
             )
-            return cursor.fetchone()
+            created = cursor.fetchone()
+            notify_change(cursor, "reviews", created["id"], created["business_id"])
+            return created
 
 def add_service_to_staff(con, staff_id: int, service_id: int):
     """
@@ -1177,9 +2489,102 @@ def add_service_to_staff(con, staff_id: int, service_id: int):
             return cur.fetchone()
 
 
+def _add_links(
+    con,
+    table: str,
+    columns: tuple[str, str],
+    pairs: list[tuple[int, int]],
+    bump_services: bool = False,
+):
+    """
+    Inserts all pairs into a link table with one multi-row statement.
+    With bump_services, the first column holds service ids whose versions are bumped.
+    Returns the pairs (as dicts keyed by column) that were added and the ones
+    that already existed, in input order.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    first, second = columns
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} ({first}, {second})
+                SELECT * FROM unnest(%s::bigint[], %s::bigint[])
+                ON CONFLICT DO NOTHING
+                RETURNING {first}, {second};
+                """,
+                ([pair[0] for pair in pairs], [pair[1] for pair in pairs]),
+            )
+            added = set(cursor.fetchall())
+            if bump_services and added:
+                _bump_service_versions(cursor, {pair[0] for pair in added})
+            if added:
+                notify_change(cursor, table)
+    return {
+        "added": [dict(zip(columns, pair)) for pair in pairs if pair in added],
+        "already_existed": [dict(zip(columns, pair)) for pair in pairs if pair not in added],
+    }
+
+
+def _remove_links(
+    con,
+    table: str,
+    columns: tuple[str, str],
+    pairs: list[tuple[int, int]],
+    bump_services: bool = False,
+):
+    """
+    Deletes all pairs from a link table with one statement.
+    With bump_services, the first column holds service ids whose versions are bumped.
+    Returns the pairs (as dicts keyed by column) that were removed and the ones
+    that didn't exist, in input order.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    first, second = columns
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(
+                f"""
+                DELETE FROM {table}
+                USING unnest(%s::bigint[], %s::bigint[]) AS pairs(first_id, second_id)
+                WHERE {table}.{first} = pairs.first_id
+                    AND {table}.{second} = pairs.second_id
+                RETURNING {table}.{first}, {table}.{second};
+                """,
+                ([pair[0] for pair in pairs], [pair[1] for pair in pairs]),
+            )
+            removed = set(cursor.fetchall())
+            if bump_services and removed:
+                _bump_service_versions(cursor, {pair[0] for pair in removed})
+            if removed:
+                notify_change(cursor, table)
+    return {
+        "removed": [dict(zip(columns, pair)) for pair in pairs if pair in removed],
+        "not_found": [dict(zip(columns, pair)) for pair in pairs if pair not in removed],
+    }
+
+
+def add_services_to_staff_batch(con, pairs: list[tuple[int, int]]):
+    """
+    Assigns many (staff_id, service_id) pairs at once. Returns added and already existing pairs.
+    """
+    return _add_links(con, "staff_service", ("staff_id", "service_id"), pairs)
+
+
+def add_categories_to_services_batch(con, pairs: list[tuple[int, int]]):
+    """
+    Links many (service_id, category_id) pairs at once. Returns added and already existing pairs.
+    """
+    return _add_links(
+        con, "service_categories", ("service_id", "category_id"), pairs, bump_services=True
+    )
+
+
+
 # -------------------------#
 # ----------PUT------------#
 # -------------------------#
+@invalidates("business")
 def update_business(con, business_id: int, business):
     """
     Update an existing business based on business_id.
@@ -1214,9 +2619,16 @@ def update_business(con, business_id: int, business):
                 ),
             )
             updated = cursor.fetchone()
+            if updated:
+                _bump_versions(cursor, [
+                    ("businesses", 0),
+                    ("business", business_id),
+                    ("business_services", business_id),
+                ])
             return updated
 
 
+@invalidates("user")
 def update_user(con, user_id: int, user):
     """
     Update an existing user based on user_id.
@@ -1246,9 +2658,13 @@ def update_user(con, user_id: int, user):
                     user_id,
                 ),
             )
-            return cursor.fetchone()
+            updated = cursor.fetchone()
+            if updated:
+                _bump_owner_versions(cursor, user_id)
+            return updated
 
 
+@invalidates("category")
 def update_category(con, category_id: int, category):
     """
     Updates a category and returns the updated record, or None if it doesn't exist.
@@ -1266,9 +2682,13 @@ def update_category(con, category_id: int, category):
                 """,
                 (category.name, category.description, category.parent_id, category_id),
             )
-            return cursor.fetchone()
+            updated = cursor.fetchone()
+            if updated:
+                _bump_versions(cursor, [("categories", 0)])
+            return updated
 
 
+@invalidates("staffmember")
 def update_staffmember(con, staff_id: int, staff_member):
     """
     Updates a staff member and returns the updated record, or None if it doesn't exist.
@@ -1300,12 +2720,15 @@ def update_staffmember(con, staff_id: int, staff_member):
             return cursor.fetchone()
 
 
+@invalidates("service")
 def update_service(con, service_id: int, service: dict):
     """
     Updates a service and returns the updated record, or None if it doesn't exist.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            # bump before and after, in case the service moves to another business
+            _bump_service_versions(cursor, [service_id])
             cursor.execute(
                 """
                 UPDATE services
@@ -1324,7 +2747,10 @@ def update_service(con, service_id: int, service: dict):
                     service_id,
                 ),
             )
-            return cursor.fetchone()
+            updated = cursor.fetchone()
+            if updated:
+                _bump_service_versions(cursor, [service_id])
+            return updated
 
 
 def update_booking(con, booking_id: int, booking: dict):
@@ -1381,7 +2807,10 @@ def update_review(con, review_id: int, review):
                     review_id,
                 ),
             )
-            return cursor.fetchone()
+            updated = cursor.fetchone()
+            if updated:
+                notify_change(cursor, "reviews", review_id, updated["business_id"])
+            return updated
 
 
 # -------------------------#
@@ -1428,6 +2857,7 @@ def update_payment_status(con, payment_id: int, status: str):
 # -------------------------#
 # ---------DELETE----------#
 # -------------------------#
+@invalidates("business")
 def delete_business(con, business_id: int):
     """
     Deletes an existing business based on business_id.
@@ -1435,13 +2865,25 @@ def delete_business(con, business_id: int):
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            # the services go with the business (ON DELETE CASCADE), so their ETags change too
+            cursor.execute("SELECT id FROM services WHERE business_id = %s;", (business_id,))
+            service_ids = [row["id"] for row in cursor.fetchall()]
             cursor.execute(
                 "DELETE FROM businesses WHERE id = %s RETURNING id;", (business_id,)
             )
             deleted = cursor.fetchone()
+            if deleted:
+                _bump_versions(cursor, [
+                    ("businesses", 0),
+                    ("business", business_id),
+                    ("business_services", business_id),
+                    ("opening_hours", business_id),
+                    *(("service", service_id) for service_id in service_ids),
+                ])
             return deleted
 
 
+@invalidates("user")
 def delete_user(con, user_id: int):
     """
     Deletes an existing user based on user_id.
@@ -1449,10 +2891,12 @@ def delete_user(con, user_id: int):
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            _bump_owner_versions(cursor, user_id)
             cursor.execute("DELETE FROM users WHERE id = %s RETURNING id;", (user_id,))
             return cursor.fetchone()
 
 
+@invalidates("category")
 def delete_category(con, category_id: int):
     """
     Deletes a category and returns the deleted id, or None if it doesn't exist.
@@ -1462,9 +2906,13 @@ def delete_category(con, category_id: int):
             cursor.execute(
                 "DELETE FROM categories WHERE id = %s RETURNING id;", (category_id,)
             )
-            return cursor.fetchone()
+            deleted = cursor.fetchone()
+            if deleted:
+                _bump_versions(cursor, [("categories", 0)])
+            return deleted
 
 
+@invalidates("staffmember")
 def delete_staffmember(con, staff_id: int):
     """
     Deletes a staff member and returns the deleted id, or None if it doesn't exist.
@@ -1489,12 +2937,14 @@ def delete_business_image(con, image_id: int):
             return cursor.fetchone()
 
 
+@invalidates("service")
 def delete_service(con, service_id: int):
     """
     Deletes a service and returns the deleted id, or None if it doesn't exist.
     """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            _bump_service_versions(cursor, [service_id])
             cursor.execute(
                 """
                 DELETE FROM services WHERE id = %s RETURNING id;
@@ -1518,7 +2968,11 @@ def remove_category_from_service(con, service_id: int, category_id: int):
             """,
                 (service_id, category_id),
             )
-            return cursor.fetchone()
+            removed = cursor.fetchone()
+            if removed:
+                _bump_service_versions(cursor, [service_id])
+                notify_change(cursor, "service_categories", service_id)
+    return removed
 
 
 def delete_booking(con, booking_id: int):
@@ -1554,7 +3008,10 @@ def delete_review(con, review_id: int):
             cursor.execute(
                 "DELETE FROM reviews WHERE id = %s RETURNING id;", (review_id,)
             )
-            return cursor.fetchone()
+            deleted = cursor.fetchone()
+            if deleted:
+                notify_change(cursor, "reviews", review_id)
+            return deleted
         
 def remove_service_from_staff(con, staff_id: int, service_id: int):
     """
@@ -1571,6 +3028,23 @@ def remove_service_from_staff(con, staff_id: int, service_id: int):
 
 
 
+def remove_services_from_staff_batch(con, pairs: list[tuple[int, int]]):
+    """
+    Removes many (staff_id, service_id) assignments at once. Returns removed and missing pairs.
+    """
+    return _remove_links(con, "staff_service", ("staff_id", "service_id"), pairs)
+
+
+def remove_categories_from_services_batch(con, pairs: list[tuple[int, int]]):
+    """
+    Unlinks many (service_id, category_id) pairs at once. Returns removed and missing pairs.
+    """
+    return _remove_links(
+        con, "service_categories", ("service_id", "category_id"), pairs, bump_services=True
+    )
+
+
+
 #HELPER FUNCTIONS: 
 
 def generate_time_slots(open_time: str, closing_time: str, duration_minutes: int):
@@ -1613,3 +3087,7 @@ def filter_overlapping_slots(slots, duration_minutes, bookings):
             available.append(slot)
 
     return available
+
+
+# Latency, row and error metrics for every function above that takes con
+metrics.instrument_module(globals())
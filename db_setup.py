@@ -1,7 +1,12 @@
 import os
+import time
+
 import psycopg2
 from dotenv import load_dotenv
 
+import metrics
+import request_timing
+
 load_dotenv(override=True)
 
 DATABASE_NAME = os.getenv("DATABASE_NAME")
@@ -14,13 +19,20 @@ def get_connection():
     this way we'll start a new connection each time
     someone hits one of our endpoints, which isn't great for performance
     """
-    return psycopg2.connect(
+    start = time.perf_counter()
+    connection = psycopg2.connect(
         dbname=DATABASE_NAME,
         user="postgres",  # change if needed
         password=PASSWORD,
         host="localhost",  # change if needed
         port="5432",  # change if needed
+        connection_factory=request_timing.TimedConnection,
     )
+    elapsed = time.perf_counter() - start
+    metrics.observe("db_connect_duration_seconds", elapsed)
+    request_timing.record_connect(elapsed)
+    metrics.inc("db_connections_opened_total")
+    return connection
 
 def reset_database():
     """Drops all marketplace tables and recreates them."""
@@ -29,6 +41,8 @@ def reset_database():
     cursor = connection.cursor()
     
     drop_sql = """
+    DROP TABLE IF EXISTS entity_versions CASCADE;
+    DROP TABLE IF EXISTS search_documents CASCADE;
     DROP TABLE IF EXISTS reviews CASCADE;
     DROP TABLE IF EXISTS payments CASCADE;
     DROP TABLE IF EXISTS bookings CASCADE;
@@ -38,6 +52,7 @@ def reset_database():
     DROP TABLE IF EXISTS business_images CASCADE;
     DROP TABLE IF EXISTS staffmembers CASCADE;
     DROP TABLE IF EXISTS businesses CASCADE;
+    DROP TABLE IF EXISTS category_closure CASCADE;
     DROP TABLE IF EXISTS categories CASCADE;
     DROP TABLE IF EXISTS users CASCADE;
     """
@@ -52,6 +67,13 @@ def create_tables():
     """
     connection = get_connection()
     cursor = connection.cursor()
+
+    # EXTENSIONS
+    cursor.execute("""
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE EXTENSION IF NOT EXISTS cube;
+    CREATE EXTENSION IF NOT EXISTS earthdistance;
+    """)
     
     # USERS
     cursor.execute("""
@@ -76,6 +98,91 @@ def create_tables():
         parent_id BIGINT REFERENCES categories(id) ON DELETE SET NULL
     );
     """)
+
+    # CATEGORY CLOSURE (every ancestor/descendant pair, including each category with itself at depth 0)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS category_closure (
+        ancestor_id BIGINT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+        descendant_id BIGINT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+        depth INT NOT NULL CHECK (depth >= 0),
+        PRIMARY KEY (ancestor_id, descendant_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_category_closure_descendant
+        ON category_closure (descendant_id, depth);
+    """)
+
+    # Keep the closure table in sync on every write to categories, including the
+    # parent_id = NULL updates done by the ON DELETE SET NULL foreign key.
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION category_closure_on_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, NEW.id, depth + 1
+        FROM category_closure
+        WHERE descendant_id = NEW.parent_id
+        UNION ALL
+        SELECT NEW.id, NEW.id, 0;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION category_closure_on_move() RETURNS trigger AS $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM category_closure
+            WHERE ancestor_id = NEW.id AND descendant_id = NEW.parent_id
+        ) THEN
+            RAISE EXCEPTION 'category % cannot be moved below its own descendant %', NEW.id, NEW.parent_id
+                USING ERRCODE = 'check_violation';
+        END IF;
+
+        -- detach the subtree from its old ancestors
+        DELETE FROM category_closure
+        WHERE descendant_id IN (
+                SELECT descendant_id FROM category_closure WHERE ancestor_id = NEW.id
+            )
+            AND ancestor_id NOT IN (
+                SELECT descendant_id FROM category_closure WHERE ancestor_id = NEW.id
+            );
+
+        -- attach it below the new parent
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+        SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1
+        FROM category_closure AS above
+        CROSS JOIN category_closure AS below
+        WHERE above.descendant_id = NEW.parent_id
+            AND below.ancestor_id = NEW.id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_category_closure_insert ON categories;
+    CREATE TRIGGER trg_category_closure_insert
+        AFTER INSERT ON categories
+        FOR EACH ROW EXECUTE FUNCTION category_closure_on_insert();
+
+    DROP TRIGGER IF EXISTS trg_category_closure_move ON categories;
+    CREATE TRIGGER trg_category_closure_move
+        AFTER UPDATE OF parent_id ON categories
+        FOR EACH ROW
+        WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+        EXECUTE FUNCTION category_closure_on_move();
+    """)
+
+    # Backfill the closure for categories that existed before the triggers
+    cursor.execute("""
+    INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE tree AS (
+        SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth
+        FROM categories
+        UNION ALL
+        SELECT tree.ancestor_id, categories.id, tree.depth + 1
+        FROM tree
+        JOIN categories ON categories.parent_id = tree.descendant_id
+    )
+    SELECT ancestor_id, descendant_id, depth FROM tree
+    ON CONFLICT DO NOTHING;
+    """)
     
     # BUSINESSES
     cursor.execute("""
@@ -89,8 +196,41 @@ def create_tables():
         street_number VARCHAR(10),
         city VARCHAR(30),
         postal_code VARCHAR(10),
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION,
         created_at TIMESTAMP DEFAULT NOW()
     );
+    CREATE INDEX IF NOT EXISTS idx_businesses_location
+        ON businesses USING GIST (ll_to_earth(latitude, longitude));
+    CREATE INDEX IF NOT EXISTS idx_businesses_city ON businesses (city);
+    CREATE INDEX IF NOT EXISTS idx_businesses_name ON businesses (name);
+    """)
+
+    # POSTAL CODE CENTROIDS (loaded from file with load_postal_codes.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS postal_code_centroids (
+        postal_code VARCHAR(10) PRIMARY KEY,
+        latitude DOUBLE PRECISION NOT NULL,
+        longitude DOUBLE PRECISION NOT NULL
+    );
+    """)
+
+    # Fill in a business' coordinates from its postal code whenever the postal code is written
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION businesses_locate() RETURNS trigger AS $$
+    BEGIN
+        SELECT latitude, longitude
+        INTO NEW.latitude, NEW.longitude
+        FROM postal_code_centroids
+        WHERE postal_code = REPLACE(NEW.postal_code, ' ', '');
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_businesses_locate ON businesses;
+    CREATE TRIGGER trg_businesses_locate
+        BEFORE INSERT OR UPDATE OF postal_code ON businesses
+        FOR EACH ROW EXECUTE FUNCTION businesses_locate();
     """)
     
     # STAFF MEMBERS
@@ -124,7 +264,8 @@ def create_tables():
         business_id BIGINT NOT NULL REFERENCES businesses(id) ON DELETE CASCADE,
         weekday SMALLINT NOT NULL CHECK (weekday BETWEEN 1 AND 7),
         open_time TIME NOT NULL,
-        closing_time TIME NOT NULL
+        closing_time TIME NOT NULL,
+        UNIQUE (business_id, weekday)
     );
     """)
     
@@ -141,6 +282,9 @@ def create_tables():
         CHECK (price >= 0),
         is_active BOOLEAN DEFAULT TRUE
     );
+    CREATE INDEX IF NOT EXISTS idx_services_business ON services (business_id);
+    CREATE INDEX IF NOT EXISTS idx_services_price ON services (price);
+    CREATE INDEX IF NOT EXISTS idx_services_duration ON services (duration_minutes);
     """)
     
     # SERVICE_CATEGORIES (Many-to-Many)
@@ -150,6 +294,8 @@ def create_tables():
         category_id BIGINT NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
         PRIMARY KEY (service_id, category_id)
     );
+    CREATE INDEX IF NOT EXISTS idx_service_categories_category
+        ON service_categories (category_id, service_id);
     """)
     
     # SERVICE - STAFFMEMBERS (Many-to-Many)
@@ -162,6 +308,95 @@ def create_tables():
     """)
     
     
+    # TRIGRAM INDEXES (typo-tolerant autocomplete on names)
+    # GiST rather than GIN: only GiST can return rows ordered by distance (<<->), so each
+    # autocomplete lookup reads the nearest names instead of every match.
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_businesses_name_trgm
+        ON businesses USING GIST (name gist_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_services_name_trgm
+        ON services USING GIST (name gist_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_categories_name_trgm
+        ON categories USING GIST (name gist_trgm_ops);
+    """)
+
+    # SEARCH DOCUMENTS (one tsvector per business and per service, kept up to date by triggers)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS search_documents (
+        entity_type VARCHAR(20) NOT NULL CHECK (entity_type IN ('business', 'service')),
+        entity_id BIGINT NOT NULL,
+        business_id BIGINT NOT NULL REFERENCES businesses(id) ON DELETE CASCADE,
+        document TSVECTOR NOT NULL,
+        PRIMARY KEY (entity_type, entity_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_search_documents_document
+        ON search_documents USING GIN (document);
+    """)
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION business_search_document(name TEXT, description TEXT, city TEXT)
+    RETURNS TSVECTOR AS $$
+        SELECT setweight(to_tsvector('swedish', COALESCE(name, '')), 'A')
+            || setweight(to_tsvector('swedish', COALESCE(city, '')), 'B')
+            || setweight(to_tsvector('swedish', COALESCE(description, '')), 'C');
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION service_search_document(name TEXT, description TEXT)
+    RETURNS TSVECTOR AS $$
+        SELECT setweight(to_tsvector('swedish', COALESCE(name, '')), 'A')
+            || setweight(to_tsvector('swedish', COALESCE(description, '')), 'C');
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION search_documents_on_business_write() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO search_documents (entity_type, entity_id, business_id, document)
+        VALUES ('business', NEW.id, NEW.id,
+                business_search_document(NEW.name, NEW.description, NEW.city))
+        ON CONFLICT (entity_type, entity_id)
+        DO UPDATE SET document = EXCLUDED.document;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION search_documents_on_service_write() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM search_documents
+            WHERE entity_type = 'service' AND entity_id = OLD.id;
+            RETURN NULL;
+        END IF;
+
+        INSERT INTO search_documents (entity_type, entity_id, business_id, document)
+        VALUES ('service', NEW.id, NEW.business_id,
+                service_search_document(NEW.name, NEW.description))
+        ON CONFLICT (entity_type, entity_id)
+        DO UPDATE SET business_id = EXCLUDED.business_id, document = EXCLUDED.document;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_search_documents_business ON businesses;
+    CREATE TRIGGER trg_search_documents_business
+        AFTER INSERT OR UPDATE OF name, description, city ON businesses
+        FOR EACH ROW EXECUTE FUNCTION search_documents_on_business_write();
+
+    DROP TRIGGER IF EXISTS trg_search_documents_service ON services;
+    CREATE TRIGGER trg_search_documents_service
+        AFTER INSERT OR UPDATE OF name, description, business_id OR DELETE ON services
+        FOR EACH ROW EXECUTE FUNCTION search_documents_on_service_write();
+    """)
+
+    # Backfill search documents for rows that existed before the triggers
+    cursor.execute("""
+    INSERT INTO search_documents (entity_type, entity_id, business_id, document)
+    SELECT 'business', id, id, business_search_document(name, description, city)
+    FROM businesses
+    UNION ALL
+    SELECT 'service', id, business_id, service_search_document(name, description)
+    FROM services
+    ON CONFLICT DO NOTHING;
+    """)
+
     # BOOKINGS
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS bookings (
@@ -178,6 +413,9 @@ def create_tables():
         created_at TIMESTAMP DEFAULT NOW(),
         CHECK (endtime > starttime)
     );
+    CREATE INDEX IF NOT EXISTS idx_bookings_service ON bookings (service_id);
+    CREATE INDEX IF NOT EXISTS idx_bookings_starttime ON bookings (starttime);
+    CREATE INDEX IF NOT EXISTS idx_bookings_business_starttime ON bookings (business_id, starttime);
     """)
     
     # PAYMENTS
@@ -197,6 +435,7 @@ def create_tables():
             ),
         created_at TIMESTAMP DEFAULT NOW()
         );
+    CREATE INDEX IF NOT EXISTS idx_payments_created_at ON payments (created_at);
     """)
     
     # REVIEWS
@@ -211,9 +450,28 @@ def create_tables():
         comment TEXT,
         created_at TIMESTAMP DEFAULT NOW()
     );
+    CREATE INDEX IF NOT EXISTS idx_reviews_business ON reviews (business_id);
+    CREATE INDEX IF NOT EXISTS idx_reviews_created_at ON reviews (created_at);
     """)
     
     
+    # ENTITY VERSIONS (bumped by the write functions in db.py, used for ETags)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS entity_versions (
+        entity VARCHAR(30) NOT NULL,
+        entity_id BIGINT NOT NULL,
+        version BIGINT NOT NULL,
+        PRIMARY KEY (entity, entity_id)
+    );
+    """)
+
+    # A new epoch on every (re)creation makes sure ETags from an older database never match
+    cursor.execute("""
+    INSERT INTO entity_versions (entity, entity_id, version)
+    VALUES ('epoch', 0, (EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::bigint)
+    ON CONFLICT (entity, entity_id) DO UPDATE SET version = EXCLUDED.version;
+    """)
+    
     connection.commit()
     cursor.close()
     connection.close()
@@ -0,0 +1,423 @@
+"""
+Runs every db.py function against the database from .env (generate a large one
+with generate_data.py first) and records EXPLAIN (ANALYZE, BUFFERS) for each
+statement it sends, e.g.
+
+    python explain_queries.py --output plans.json
+    python explain_queries.py --diff plans-before.json plans.json
+
+Each function is called with ids of the busiest rows (the business, customer, staff
+member... with the most bookings), so the plans are the ones heavy tenants get.
+Every statement is explained inside a savepoint that is rolled back, then run for
+real so the function gets its results, and the whole call is rolled back at the
+end: write functions are explained too, and nothing is changed.
+
+Flagged are sequential scans on big tables, sorts and hashes that spill to disk and
+row estimates off by more than --estimate-factor. The saved plans leave out timings
+and buffer counts, so two runs against the same dataset only differ where a plan
+changed, and --diff shows exactly those nodes. Exits with status 1 if anything was flagged.
+"""
+
+import argparse
+import difflib
+import inspect
+import json
+import re
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import psycopg2
+
+import db
+from db_setup import get_connection
+
+# Functions that aren't one query with parameters: streaming exports, COPY and
+# internals that take a SQL string
+SKIPPED = {
+    "notify_change", "fetch_json_array", "stream_json_rows", "_copy_to_queue", "stream_copy_csv",
+    "bulk_import", "get_all_businesses_json", "get_bookings_json", "get_all_payments_json",
+    "get_all_reviews_json", "stream_all_businesses", "stream_bookings", "stream_all_payments",
+    "stream_all_reviews",
+}
+
+# Values for parameters named like an id; the row with the most related rows
+SAMPLE_SQL = {
+    "business_id": "SELECT business_id FROM bookings GROUP BY business_id ORDER BY COUNT(*) DESC, business_id LIMIT 1",
+    "customer_id": "SELECT customer_id FROM bookings GROUP BY customer_id ORDER BY COUNT(*) DESC, customer_id LIMIT 1",
+    "staff_id": """
+        SELECT staff_id FROM bookings WHERE staff_id IS NOT NULL
+        GROUP BY staff_id ORDER BY COUNT(*) DESC, staff_id LIMIT 1
+    """,
+    "service_id": "SELECT service_id FROM bookings GROUP BY service_id ORDER BY COUNT(*) DESC, service_id LIMIT 1",
+    "category_id": """
+        SELECT category_id FROM service_categories GROUP BY category_id ORDER BY COUNT(*) DESC, category_id LIMIT 1
+    """,
+    "booking_id": "SELECT MAX(booking_id) FROM payments",
+    "payment_id": "SELECT MAX(id) FROM payments",
+    "review_id": "SELECT MAX(id) FROM reviews",
+    "image_id": "SELECT MAX(id) FROM business_images",
+    "date": "SELECT MAX(starttime)::date::text FROM bookings",
+}
+SAMPLE_SQL["user_id"] = SAMPLE_SQL["customer_id"]
+
+# Table of the sample row for object parameters, with fields changed to keep unique columns unique
+SAMPLE_ROWS = {
+    "business": ("businesses", "business_id", {}),
+    "user": ("users", "user_id", {"username": "explain_queries", "email": "explain_queries@example.se"}),
+    "category": ("categories", "category_id", {}),
+    "staff_member": ("staffmembers", "staff_id", {"email": "explain_queries@example.se"}),
+    "business_image": ("business_images", "image_id", {}),
+    "service": ("services", "service_id", {}),
+    "booking": ("bookings", "booking_id", {}),
+    "data": ("payments", "payment_id", {}),
+    "review": ("reviews", "review_id", {}),
+}
+# db.py takes these as dicts, the others as models (attribute access)
+DICT_PARAMETERS = {"service", "booking"}
+
+PARAMETER_VALUES = {
+    "query": "klippning",
+    "term": "kli",
+    "weekday": 1,
+    "status": "confirmed",
+}
+
+# Extra calls for functions whose plans depend on more than the ids:
+# function -> list of functions of the samples returning keyword arguments
+VARIANTS = {
+    "get_versions": [lambda s: {"keys": [("epoch", 0), ("businesses", 0), ("business", s["business_id"])]}],
+    "get_services_for_category": [lambda s: {"include_descendants": False}, lambda s: {"include_descendants": True}],
+    "get_businesses_by_category": [lambda s: {"include_descendants": False}, lambda s: {"include_descendants": True}],
+    "get_services_by_categories": [
+        lambda s: {"category_ids": [s["category_id"]], "include_descendants": False},
+        lambda s: {"category_ids": [s["category_id"]], "include_descendants": True},
+    ],
+    "filter_services": [
+        lambda s: {},
+        lambda s: {"category_ids": [s["category_id"]], "include_descendants": True, "min_price": 300},
+        lambda s: {"city": "Stockholm", "is_active": True, "offset": 200},
+    ],
+    "replace_opening_hours": [lambda s: {"hours_list": [
+        SimpleNamespace(weekday=weekday, open_time="08:00", closing_time="17:00") for weekday in range(1, 6)
+    ]}],
+    "update_payment_status": [lambda s: {"status": "paid"}],
+    "add_services_to_staff_batch": [lambda s: {"pairs": [(s["staff_id"], s["service_id"])]}],
+    "remove_services_from_staff_batch": [lambda s: {"pairs": [(s["staff_id"], s["service_id"])]}],
+    "add_categories_to_services_batch": [lambda s: {"pairs": [(s["service_id"], s["category_id"])]}],
+    "remove_categories_from_services_batch": [lambda s: {"pairs": [(s["service_id"], s["category_id"])]}],
+}
+
+EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|VALUES)\b", re.IGNORECASE)
+SAVEPOINT = "explain_queries"
+
+
+# ---------- recording ----------
+class ExplainingCursor:
+    """
+    Wraps a cursor: every statement is explained first, then executed as usual.
+    """
+
+    def __init__(self, cursor, statements: list):
+        self._cursor = cursor
+        self._statements = statements
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query, vars=None):
+        self._explain(query, vars)
+        return self._cursor.execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        if vars_list:
+            self._explain(query, vars_list[0])
+        return self._cursor.executemany(query, vars_list)
+
+    def _explain(self, query, vars):
+        sql = self._cursor.mogrify(query, vars).decode()
+        statement = {"sql": " ".join(sql.split())}
+        self._statements.append(statement)
+        if not EXPLAINABLE.match(sql) or ";" in sql.strip().rstrip(";"):
+            statement["skipped"] = "not a single SELECT/INSERT/UPDATE/DELETE"
+            return
+        self._cursor.execute(f"SAVEPOINT {SAVEPOINT};")
+        try:
+            self._cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)
+            row = self._cursor.fetchone()
+            statement["plan"] = (row["QUERY PLAN"] if isinstance(row, dict) else row[0])[0]
+        except psycopg2.Error as error:
+            statement["error"] = f"{type(error).__name__}: {str(error).strip()}"
+        self._cursor.execute(f"ROLLBACK TO SAVEPOINT {SAVEPOINT};")
+
+
+class ExplainingConnection:
+    """
+    Passed to db.py functions instead of the connection: cursors explain their
+    statements and commits (including the one at the end of "with con:") roll back.
+    """
+
+    def __init__(self, con):
+        self._con = con
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._con.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def commit(self):
+        self._con.rollback()
+
+    def cursor(self, *args, **kwargs):
+        return ExplainingCursor(self._con.cursor(*args, **kwargs), self.statements)
+
+
+def load_samples(con):
+    samples = dict(PARAMETER_VALUES)
+    with con.cursor() as cursor:
+        for name, sql in SAMPLE_SQL.items():
+            cursor.execute(sql)
+            row = cursor.fetchone()
+            samples[name] = row[0] if row else None
+        for name, (table, id_name, changes) in SAMPLE_ROWS.items():
+            samples[name] = None
+            if samples[id_name] is not None:
+                cursor.execute(f"SELECT * FROM {table} WHERE id = %s;", (samples[id_name],))
+                names = [column.name for column in cursor.description]
+                row = cursor.fetchone()
+                if row:
+                    samples[name] = {**dict(zip(names, row)), **changes}
+    con.rollback()
+    return samples
+
+
+def calls_for(name: str, function, samples):
+    """
+    Yields (label, keyword arguments or None, missing parameter) for every call of the function.
+    """
+    base = {}
+    missing = None
+    for parameter in list(inspect.signature(function).parameters.values())[1:]:
+        if parameter.kind in (parameter.VAR_KEYWORD, parameter.VAR_POSITIONAL):
+            continue
+        value = samples.get(parameter.name)
+        if value is not None and parameter.name in SAMPLE_ROWS:
+            value = dict(value) if parameter.name in DICT_PARAMETERS else SimpleNamespace(**value)
+        if value is not None:
+            base[parameter.name] = value
+        elif parameter.default is parameter.empty:
+            missing = missing or parameter.name
+
+    variants = VARIANTS.get(name, [lambda s: {}])
+    for index, variant in enumerate(variants):
+        kwargs = {**base, **variant(samples)}
+        label = name if len(variants) == 1 else f"{name}[{index}]"
+        if missing and missing not in kwargs:
+            yield label, None, missing
+        else:
+            yield label, kwargs, None
+
+
+def explain_function(con, function, kwargs):
+    recorder = ExplainingConnection(con)
+    db.entity_cache.clear()  # cached getters would skip the query
+    error = None
+    try:
+        result = function(recorder, **kwargs)
+        if inspect.isgenerator(result):
+            for _ in result:
+                pass
+    except Exception as exception:  # the plans up to the failing statement are still useful
+        error = f"{type(exception).__name__}: {str(exception).strip()}"
+    con.rollback()
+    return recorder.statements, error
+
+
+# ---------- analysis ----------
+def table_sizes(con):
+    with con.cursor() as cursor:
+        cursor.execute("""
+            SELECT relname, reltuples::bigint FROM pg_class
+            WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace;
+        """)
+        sizes = dict(cursor.fetchall())
+    con.rollback()
+    return sizes
+
+
+def walk(node, depth=0):
+    yield node, depth
+    for child in node.get("Plans", []):
+        yield from walk(child, depth + 1)
+
+
+def describe(node):
+    text = node["Node Type"]
+    if node.get("Join Type"):
+        text = f"{node['Join Type']} {text}"
+    if node.get("Relation Name"):
+        text += f" on {node['Relation Name']}"
+    if node.get("Index Name"):
+        text += f" using {node['Index Name']}"
+    if node.get("Sort Key"):
+        text += f" by {', '.join(node['Sort Key'])}"
+    return text
+
+
+def plan_lines(plan):
+    """
+    The plan as indented lines without timings or buffers, for diffing.
+    """
+    lines = []
+    for node, depth in walk(plan["Plan"]):
+        loops = node.get("Actual Loops", 0)
+        actual = f"{node['Actual Rows']}" if loops else "never executed"
+        lines.append(f"{'  ' * depth}{describe(node)} (estimated {node['Plan Rows']}, actual {actual}, loops {loops})")
+    return lines
+
+
+def find_problems(plan, sizes, big_table_rows: int, estimate_factor: float):
+    problems = []
+    for node, _ in walk(plan["Plan"]):
+        relation = node.get("Relation Name")
+        if node["Node Type"] == "Seq Scan" and sizes.get(relation, 0) >= big_table_rows:
+            problems.append(f"sequential scan on {relation} ({sizes[relation]:,} rows)")
+        if node.get("Sort Space Type") == "Disk":
+            problems.append(f"sort spilled to disk ({node.get('Sort Space Used')} kB): {describe(node)}")
+        if node.get("Hash Batches", 1) > 1:
+            problems.append(f"hash spilled to disk ({node['Hash Batches']} batches)")
+        if node.get("Actual Loops"):
+            estimated, actual = node["Plan Rows"], node["Actual Rows"]
+            low, high = sorted((estimated, actual))
+            if high >= 100 and high > estimate_factor * max(low, 1):
+                problems.append(f"rows misestimated by {high / max(low, 1):.0f}x ({estimated} estimated, "
+                                f"{actual} actual): {describe(node)}")
+    return problems
+
+
+# ---------- main ----------
+def run(options):
+    con = get_connection()
+    samples = load_samples(con)
+    sizes = table_sizes(con)
+    functions = {
+        name: function for name, function in vars(db).items()
+        if inspect.isfunction(function)
+        and function.__module__ == "db"
+        and list(inspect.signature(function).parameters)[:1] == ["con"]
+        and name not in SKIPPED
+        and (not options.only or options.only in name)
+    }
+
+    results = {}
+    flagged = 0
+    for name, function in sorted(functions.items()):
+        for label, kwargs, missing in calls_for(name, function, samples):
+            if kwargs is None:
+                results[label] = {"skipped": f"no sample for parameter {missing!r}"}
+                print(f"skip {label}: no sample for parameter {missing!r}")
+                continue
+            statements, error = explain_function(con, function, kwargs)
+            call = {"statements": []}
+            if error:
+                call["error"] = error
+            for statement in statements:
+                entry = {"sql": statement["sql"]}
+                if "plan" in statement:
+                    plan = statement["plan"]
+                    entry["plan"] = plan_lines(plan)
+                    entry["problems"] = find_problems(plan, sizes, options.big_table_rows, options.estimate_factor)
+                    if options.timings:
+                        entry["execution_ms"] = plan.get("Execution Time")
+                        entry["shared_blocks_read"] = plan["Plan"].get("Shared Read Blocks")
+                else:
+                    entry["not_explained"] = statement.get("skipped") or statement.get("error")
+                call["statements"].append(entry)
+            results[label] = call
+
+            problems = [problem for entry in call["statements"] for problem in entry.get("problems", [])]
+            status = "FLAG" if problems else "err" if error else "ok"
+            print(f"{status:4} {label:55} {len(call['statements'])} statement(s)" + (f"  {error}" if error else ""))
+            for problem in problems:
+                print(f"       {problem}")
+            flagged += bool(problems)
+    con.close()
+
+    output = {"commit": git_commit(), "table_rows": sizes, "calls": results}
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(output, file, indent=2, sort_keys=True)
+        print(f"\nSaved {options.output}")
+    print(f"{flagged} call(s) flagged.")
+    return flagged
+
+
+def diff(old_path: str, new_path: str):
+    """
+    Prints the calls whose plans changed between two saved runs, as unified diffs.
+    """
+    with open(old_path) as file:
+        old = json.load(file)["calls"]
+    with open(new_path) as file:
+        new = json.load(file)["calls"]
+
+    def text(call):
+        lines = []
+        for statement in (call or {}).get("statements", []):
+            lines.append(statement["sql"])
+            lines += statement.get("plan", [statement.get("not_explained", "")])
+            lines += [f"! {problem}" for problem in statement.get("problems", [])]
+        return lines
+
+    changed = 0
+    for label in sorted(set(old) | set(new)):
+        before, after = text(old.get(label)), text(new.get(label))
+        if before != after:
+            changed += 1
+            print(f"=== {label}")
+            for line in difflib.unified_diff(before, after, old_path, new_path, lineterm="", n=1):
+                print(line)
+    print(f"{changed} call(s) changed.")
+    return changed
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() or "unknown"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE every db.py query and flag bad plans.")
+    parser.add_argument("only", nargs="?", default="", help="only functions whose name contains this")
+    parser.add_argument("--output", help="save the plans as JSON")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), help="compare two saved runs and exit")
+    parser.add_argument("--big-table-rows", type=int, default=10000,
+                        help="sequential scans on tables with at least this many rows are flagged")
+    parser.add_argument("--estimate-factor", type=float, default=10,
+                        help="flag nodes whose row estimate is off by more than this factor")
+    parser.add_argument("--timings", action="store_true",
+                        help="also save execution times and blocks read (makes runs less diffable)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args(sys.argv[1:])
+    if arguments.diff:
+        diff(*arguments.diff)
+        sys.exit(0)
+    sys.exit(1 if run(arguments) else 0)
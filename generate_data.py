@@ -0,0 +1,553 @@
+"""
+Generates a deterministic dataset of any size for load testing, e.g.
+
+    python generate_data.py --businesses 5000 --months 12 --reset
+
+Unlike insert_data.seed_data (a small hand-written dataset for development),
+every row here is derived from --seed and the scale options, so the same command
+always produces the same database. Rows are streamed into COPY in batches and never
+collected in lists, so memory use doesn't depend on the scale.
+
+Ids are assigned here instead of by the sequences: every business is planned
+(services, staff, opening hours) from its own seeded random generator, so the
+tables can be written one after another without remembering earlier rows.
+Since the ids start from 1, the database must be empty (or emptied with --reset).
+Bookings are laid out per staff member and day inside the opening hours, one after
+another, so they never overlap. Payments and reviews are derived from the bookings
+in SQL.
+"""
+
+import argparse
+import itertools
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from psycopg2 import errors
+
+import db_setup
+from db import NEW_VERSION_SQL
+from db_setup import get_connection
+
+# main category -> subcategories -> services (name, minutes, price in SEK)
+CATEGORY_TREE = [
+    ("Massage", "Alla typer av massagebehandlingar", [
+        ("Klassisk massage", "Avslappnande klassisk massage",
+         [("Klassisk massage 30 min", 30, 450), ("Klassisk massage 60 min", 60, 750)]),
+        ("Djupgående massage", "Behandlande massage",
+         [("Djupvävnadsmassage", 60, 850), ("Idrottsmassage", 45, 700)]),
+        ("Gravidmassage", "Massage för gravida", [("Gravidmassage", 60, 800)]),
+    ]),
+    ("Frisör", "Klippning och hårvård", [
+        ("Klippning dam", "Klippning och styling för dam",
+         [("Damklippning", 60, 650), ("Lugg", 15, 150)]),
+        ("Klippning herr", "Herrklippning", [("Herrklippning", 30, 450), ("Skäggtrim", 15, 200)]),
+        ("Färg & klipp", "Färgning och klippning", [("Färg och klipp", 120, 1600), ("Slingor", 90, 1200)]),
+    ]),
+    ("Hudvård", "Ansiktsbehandlingar och hudvård", [
+        ("Ansiktsbehandling", "Rengöring och hudvård för ansiktet",
+         [("Ansiktsbehandling", 60, 795), ("Portömning", 45, 595)]),
+        ("Ansiktsbehandling lyx", "Lyxigare ansiktskur", [("Lyxbehandling", 90, 1295)]),
+    ]),
+    ("Naglar", "Manikyr, pedikyr och nagelbehandlingar", [
+        ("Spa-manikyr", "Lyxig manikyr", [("Manikyr", 45, 450), ("Gellack", 60, 550)]),
+        ("Spa-pedikyr", "Lyxig pedikyr", [("Pedikyr", 60, 595)]),
+    ]),
+    ("Träning", "Personlig träning och gruppträning", [
+        ("Personlig träning", "En-till-en träning", [("PT-pass", 60, 700), ("PT-pass 30 min", 30, 400)]),
+        ("Yoga", "Yogapass för alla nivåer", [("Privat yoga", 60, 650)]),
+    ]),
+]
+
+# city, postal code prefix, latitude, longitude
+CITIES = [
+    ("Stockholm", "111", 59.3293, 18.0686),
+    ("Göteborg", "411", 57.7089, 11.9746),
+    ("Malmö", "211", 55.6050, 13.0038),
+    ("Uppsala", "753", 59.8586, 17.6389),
+    ("Västerås", "722", 59.6099, 16.5448),
+    ("Örebro", "702", 59.2753, 15.2134),
+    ("Linköping", "582", 58.4108, 15.6214),
+    ("Helsingborg", "252", 56.0465, 12.6945),
+    ("Jönköping", "553", 57.7826, 14.1618),
+    ("Norrköping", "602", 58.5877, 16.1924),
+]
+
+FIRST_NAMES = [
+    "Anna", "Erik", "Maria", "Lars", "Karin", "Johan", "Sara", "Anders", "Emma", "Per",
+    "Elin", "Oskar", "Ida", "Nils", "Linnea", "Gustav", "Maja", "Axel", "Frida", "Viktor",
+]
+LAST_NAMES = [
+    "Andersson", "Johansson", "Karlsson", "Nilsson", "Eriksson", "Larsson", "Olsson",
+    "Persson", "Svensson", "Gustafsson", "Pettersson", "Jonsson", "Lindberg", "Berg",
+]
+BUSINESS_WORDS = ["Studio", "Salong", "Klinik", "Spa", "Center", "Ateljé", "Rum", "Hus"]
+STREETS = ["Storgatan", "Drottninggatan", "Kungsgatan", "Vasagatan", "Sveavägen", "Järntorget"]
+STAFF_ROLES = ["stylist", "terapeut", "tränare", "ägare"]
+
+# weekday (1 = Monday) -> (opening minute, closing minute); days not listed are closed
+SCHEDULES = [
+    {1: (540, 1080), 2: (540, 1080), 3: (540, 1080), 4: (540, 1080), 5: (540, 1080), 6: (600, 900)},
+    {1: (600, 1140), 2: (600, 1140), 3: (600, 1140), 4: (600, 1140), 5: (600, 1080), 6: (600, 960),
+     7: (660, 900)},
+    {1: (480, 1020), 2: (480, 1020), 3: (480, 1020), 4: (480, 1020), 5: (480, 900)},
+]
+
+# Pseudo-random numbers in [0, 1) derived from a booking id, so SQL can make the same
+# "random" choices on every run (multiplicative hashing with different odd multipliers)
+HASH_MULTIPLIERS = (2654435761, 2246822519, 3266489917, 668265263, 374761393)
+
+
+def uniform(column: str, index: int):
+    return f"(mod({column} * {HASH_MULTIPLIERS[index]}, 4294967296)::float8 / 4294967296)"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Generate a deterministic load-testing dataset.",
+        epilog="The database must be empty (no users): ids are assigned from 1, so the generator "
+               "can't add to an existing dataset. Use --reset to drop all data first.",
+    )
+    parser.add_argument("--businesses", type=int, default=500)
+    parser.add_argument("--staff-per-business", type=int, default=4)
+    parser.add_argument("--services-per-business", type=int, default=8)
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--months", type=int, default=3, help="months of bookings")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2025, 1, 6),
+                        help="first day with bookings (YYYY-MM-DD)")
+    parser.add_argument("--today", type=date.fromisoformat, default=None,
+                        help="bookings before this day are in the past (default: a month before the end)")
+    parser.add_argument("--occupancy", type=float, default=0.7,
+                        help="share of back-to-back bookings, the rest leave a gap")
+    parser.add_argument("--payment-ratio", type=float, default=0.9)
+    parser.add_argument("--review-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=500000, help="rows per COPY and commit")
+    parser.add_argument("--reset", action="store_true",
+                        help="drop and recreate all tables first, required unless the database is empty")
+    options = parser.parse_args(argv)
+    for name in ("businesses", "staff_per_business", "services_per_business", "customers"):
+        if getattr(options, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    options.end = options.start + timedelta(days=round(options.months * 30.44))
+    if options.today is None:
+        options.today = max(options.start, options.end - timedelta(days=30))
+    return options
+
+
+# ---------- planning ----------
+def category_rows():
+    """
+    Yields (id, name, description, parent_id) for the whole category tree.
+    """
+    category_id = itertools.count(1)
+    for name, description, subcategories in CATEGORY_TREE:
+        main_id = next(category_id)
+        yield main_id, name, description, None
+        for sub_name, sub_description, _ in subcategories:
+            yield next(category_id), sub_name, sub_description, main_id
+
+
+def category_ids():
+    """
+    Returns {main index: id} and {(main index, sub index): id}, matching category_rows().
+    """
+    main_ids = {}
+    sub_ids = {}
+    category_id = itertools.count(1)
+    for main_index, (_, _, subcategories) in enumerate(CATEGORY_TREE):
+        main_ids[main_index] = next(category_id)
+        for sub_index in range(len(subcategories)):
+            sub_ids[main_index, sub_index] = next(category_id)
+    return main_ids, sub_ids
+
+
+MAIN_CATEGORY_IDS, SUBCATEGORY_IDS = category_ids()
+
+
+def business_plan(options, index: int):
+    """
+    Everything about one business that other tables refer to, the same on every call.
+    """
+    rng = random.Random(f"{options.seed}-business-{index}")
+    main_index = rng.randrange(len(CATEGORY_TREE))
+    main_name, _, subcategories = CATEGORY_TREE[main_index]
+    city, postal_prefix, _, _ = rng.choice(CITIES)
+
+    services = []
+    for k in range(options.services_per_business):
+        sub_index = rng.randrange(len(subcategories))
+        name, minutes, price = rng.choice(subcategories[sub_index][2])
+        services.append({
+            "id": index * options.services_per_business + k + 1,
+            "category_id": SUBCATEGORY_IDS[main_index, sub_index],
+            "name": name,
+            "minutes": minutes,
+            "price": round(price * rng.uniform(0.8, 1.3), -1),
+        })
+
+    staff = []
+    for j in range(options.staff_per_business):
+        count = rng.randint(1, len(services))
+        staff.append({
+            "id": index * options.staff_per_business + j + 1,
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "role": rng.choice(STAFF_ROLES),
+            "services": rng.sample(services, count),
+        })
+
+    return {
+        "id": index + 1,
+        "owner_id": index + 1,  # owners are the first users
+        "main_category_id": MAIN_CATEGORY_IDS[main_index],
+        "name": f"{main_name} {rng.choice(BUSINESS_WORDS)} {index + 1}"[:30],
+        "city": city,
+        "street_name": rng.choice(STREETS),
+        "street_number": str(rng.randint(1, 120)),
+        "postal_code": f"{postal_prefix} {rng.randint(10, 59)}",
+        "services": services,
+        "staff": staff,
+        "schedule": rng.choice(SCHEDULES),
+    }
+
+
+def business_plans(options):
+    for index in range(options.businesses):
+        yield business_plan(options, index)
+
+
+# ---------- COPY ----------
+def text_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def line(*values):
+    return "\t".join(text_value(value) for value in values) + "\n"
+
+
+class LineStream:
+    """
+    A read()-able file over an iterator of COPY text lines, for cursor.copy_expert.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def read(self, size=-1):
+        chunk = []
+        length = 0
+        for text in self.lines:
+            chunk.append(text)
+            length += len(text)
+            if length >= size > 0:
+                break
+        return "".join(chunk)
+
+
+def copy_lines(con, table: str, columns: str, lines, batch_size: int):
+    """
+    COPYs the lines into the table, committing every batch_size rows. Returns the row count.
+    """
+    lines = iter(lines)
+    total = 0
+    started = time.perf_counter()
+    while True:
+        counted = itertools.count()
+        batch = (text for text, _ in zip(itertools.islice(lines, batch_size), counted))
+        with con.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", LineStream(batch), size=1 << 16)
+        con.commit()
+        copied = next(counted)
+        total += copied
+        if copied < batch_size:
+            break
+        rate = total / (time.perf_counter() - started)
+        print(f"  {table}: {total:,} rows ({rate:,.0f}/s)", flush=True)
+    return total
+
+
+# ---------- rows ----------
+def category_lines():
+    for row in category_rows():
+        yield line(*row)
+
+
+def postal_code_lines():
+    seen = set()
+    for city, prefix, latitude, longitude in CITIES:
+        for suffix in range(10, 60):
+            code = f"{prefix}{suffix}"
+            if code not in seen:
+                seen.add(code)
+                offset = (suffix - 35) / 1000
+                yield line(code, round(latitude + offset, 5), round(longitude - offset, 5))
+
+
+def user_lines(options):
+    rng = random.Random(f"{options.seed}-users")
+    for user_id in range(1, options.businesses + options.customers + 1):
+        role = "provider" if user_id <= options.businesses else "customer"
+        yield line(
+            user_id, role, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+            f"{role}{user_id}", f"{role}{user_id}@example.se", f"07{rng.randint(0, 99999999):08d}",
+        )
+
+
+def business_lines(options):
+    for plan in business_plans(options):
+        yield line(
+            plan["id"], plan["owner_id"], plan["main_category_id"], plan["name"],
+            f"{plan['name']} i {plan['city']}", plan["street_name"], plan["street_number"],
+            plan["city"], plan["postal_code"],
+        )
+
+
+def opening_hour_lines(options):
+    for plan in business_plans(options):
+        for weekday, (opens, closes) in sorted(plan["schedule"].items()):
+            yield line(plan["id"], weekday, f"{opens // 60:02d}:{opens % 60:02d}", f"{closes // 60:02d}:{closes % 60:02d}")
+
+
+def service_lines(options):
+    for plan in business_plans(options):
+        for service in plan["services"]:
+            yield line(service["id"], plan["id"], service["name"], None, service["minutes"], service["price"], True)
+
+
+def service_category_lines(options):
+    for plan in business_plans(options):
+        for service in plan["services"]:
+            yield line(service["id"], service["category_id"])
+
+
+def staff_lines(options):
+    for plan in business_plans(options):
+        for member in plan["staff"]:
+            yield line(
+                member["id"], plan["id"], member["name"], f"staff{member['id']}@example.se",
+                None, member["role"], True,
+            )
+
+
+def staff_service_lines(options):
+    for plan in business_plans(options):
+        for member in plan["staff"]:
+            for service in member["services"]:
+                yield line(member["id"], service["id"])
+
+
+def booking_lines(options):
+    """
+    Bookings per business, day and staff member, laid out back to back (or with a gap)
+    from opening time until the next one would end after closing time.
+    """
+    first_customer = options.businesses + 1
+    days = []
+    day = options.start
+    while day < options.end:
+        days.append((day.isoweekday(), day.isoformat(), day < options.today))
+        day += timedelta(days=1)
+    # booking created up to four weeks before its start
+    created_days = {
+        index: (options.start + timedelta(days=index)).isoformat() for index in range(-28, len(days))
+    }
+    gaps = (15, 30, 45, 60, 90)
+
+    booking_id = 0
+    for plan in business_plans(options):
+        rng = random.Random(f"{options.seed}-bookings-{plan['id']}")
+        business_id = plan["id"]
+        for day_index, (weekday, day_text, in_past) in enumerate(days):
+            hours = plan["schedule"].get(weekday)
+            if hours is None:
+                continue
+            opens, closes = hours
+            for member in plan["staff"]:
+                services = member["services"]
+                minute = opens
+                while True:
+                    if rng.random() > options.occupancy:
+                        minute += rng.choice(gaps)
+                    service = rng.choice(services)
+                    end = minute + service["minutes"]
+                    if end > closes:
+                        break
+                    roll = rng.random()
+                    if in_past:
+                        status = "completed" if roll < 0.92 else "cancelled"
+                    else:
+                        status = "confirmed" if roll < 0.8 else "pending" if roll < 0.95 else "cancelled"
+                    booking_id += 1
+                    yield (
+                        f"{booking_id}\t{first_customer + rng.randrange(options.customers)}\t{business_id}\t"
+                        f"{service['id']}\t{member['id']}\t"
+                        f"{day_text} {minute // 60:02d}:{minute % 60:02d}:00\t"
+                        f"{day_text} {end // 60:02d}:{end % 60:02d}:00\t{status}\t\\N\t"
+                        f"{created_days[day_index - rng.randrange(29)]} 12:00:00\n"
+                    )
+                    minute = end
+
+
+# ---------- loading ----------
+def set_sequence(cursor, table: str):
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table};"
+    )
+
+
+def drop_secondary_indexes(cursor, tables):
+    """
+    Drops the non-constraint indexes of the tables and returns their definitions.
+    Building them once after the load is much faster than updating them per row.
+    """
+    cursor.execute("""
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE tablename = ANY(%s)
+            AND indexname NOT IN (SELECT conname FROM pg_constraint);
+    """, (list(tables),))
+    definitions = cursor.fetchall()
+    for name, _ in definitions:
+        cursor.execute(f"DROP INDEX {name};")
+    return [definition for _, definition in definitions]
+
+
+def payments_sql(options):
+    methods = "ARRAY[" + ",".join(
+        ["'card'"] * 11 + ["'swish'"] * 5 + ["'klarna'"] * 2 + ["'gift_card'", "'cash'"]
+    ) + "]"
+    return f"""
+        INSERT INTO payments (booking_id, amount, payment_method, status, created_at)
+        SELECT
+            bookings.id,
+            services.price,
+            ({methods})[1 + floor({uniform('bookings.id', 1)} * 20)::int],
+            CASE
+                WHEN bookings.status = 'cancelled' THEN 'refunded'
+                WHEN bookings.status = 'completed' THEN
+                    CASE WHEN {uniform('bookings.id', 2)} < 0.95 THEN 'paid' ELSE 'refunded' END
+                ELSE CASE WHEN {uniform('bookings.id', 2)} < 0.5 THEN 'pending' ELSE 'paid' END
+            END,
+            CASE WHEN bookings.status = 'completed' THEN bookings.endtime ELSE bookings.created_at END
+        FROM bookings
+        JOIN services ON services.id = bookings.service_id
+        WHERE bookings.status <> 'pending'
+            AND {uniform('bookings.id', 0)} < {options.payment_ratio}
+                * CASE WHEN bookings.status = 'cancelled' THEN 0.5 ELSE 1 END
+        ORDER BY bookings.id;
+    """
+
+
+def reviews_sql(options):
+    return f"""
+        INSERT INTO reviews (booking_id, business_id, customer_id, rating, title, comment, created_at)
+        SELECT
+            id, business_id, customer_id, rating,
+            (ARRAY['Inte nöjd', 'Så där', 'Helt okej', 'Bra upplevelse', 'Fantastiskt!'])[rating],
+            (ARRAY[
+                'Tyvärr inte vad jag hade hoppats på.',
+                'Okej behandling men lång väntetid.',
+                'Bra behandling, trevlig personal.',
+                'Proffsig personal och trevlig lokal.',
+                'Mycket nöjd, kommer tillbaka.'
+            ])[rating],
+            endtime + make_interval(hours => floor({uniform('id', 4)} * 72)::int)
+        FROM (
+            SELECT bookings.*,
+                CASE
+                    WHEN {uniform('bookings.id', 3)} < 0.04 THEN 1
+                    WHEN {uniform('bookings.id', 3)} < 0.10 THEN 2
+                    WHEN {uniform('bookings.id', 3)} < 0.25 THEN 3
+                    WHEN {uniform('bookings.id', 3)} < 0.60 THEN 4
+                    ELSE 5
+                END AS rating
+            FROM bookings
+            WHERE status = 'completed' AND {uniform('bookings.id', 0)} >= 1 - {options.review_ratio}
+        ) AS reviewed
+        ORDER BY id;
+    """
+
+
+def generate(options):
+    if options.reset:
+        db_setup.reset_database()
+        db_setup.create_tables()
+
+    con = get_connection()
+    cursor = con.cursor()
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM users);")
+    if cursor.fetchone()[0]:
+        print("The database already has users. Run with --reset to replace all data.")
+        con.close()
+        return 1
+
+    started = time.perf_counter()
+    batch = options.batch_size
+    steps = [
+        ("postal_code_centroids", "postal_code, latitude, longitude", postal_code_lines()),
+        ("categories", "id, name, description, parent_id", category_lines()),
+        ("users", "id, role, firstname, lastname, username, email, phone_number", user_lines(options)),
+        ("businesses", "id, owner_id, main_category_id, name, description, street_name, street_number, "
+                       "city, postal_code", business_lines(options)),
+        ("business_opening_hours", "business_id, weekday, open_time, closing_time", opening_hour_lines(options)),
+        ("services", "id, business_id, name, description, duration_minutes, price, is_active",
+         service_lines(options)),
+        ("service_categories", "service_id, category_id", service_category_lines(options)),
+        ("staffmembers", "id, business_id, name, email, phone_number, role, is_active", staff_lines(options)),
+        ("staff_service", "staff_id, service_id", staff_service_lines(options)),
+    ]
+    for table, columns, lines in steps:
+        if table == "postal_code_centroids":
+            # reference data: keep real centroids if they were loaded already
+            cursor.execute("CREATE TEMP TABLE centroid_staging (LIKE postal_code_centroids);")
+            count = copy_lines(con, "centroid_staging", columns, lines, batch)
+            cursor.execute("""
+                INSERT INTO postal_code_centroids SELECT * FROM centroid_staging ON CONFLICT DO NOTHING;
+                DROP TABLE centroid_staging;
+            """)
+        else:
+            count = copy_lines(con, table, columns, lines, batch)
+        print(f"{table}: {count:,} rows")
+
+    # The generator keeps the foreign keys consistent itself, so skip the per-row checks
+    # for the big tables when allowed (needs superuser) and build their indexes afterwards.
+    big_tables = ("bookings", "payments", "reviews")
+    try:
+        cursor.execute("SET session_replication_role = replica;")
+    except errors.InsufficientPrivilege:
+        con.rollback()
+        print("Not a superuser, foreign keys are checked per row (slower).")
+    indexes = drop_secondary_indexes(cursor, big_tables)
+    con.commit()
+
+    count = copy_lines(con, "bookings", "id, customer_id, business_id, service_id, staff_id, starttime, "
+                                         "endtime, status, notes, created_at", booking_lines(options), batch)
+    print(f"bookings: {count:,} rows")
+    cursor.execute(payments_sql(options))
+    print(f"payments: {cursor.rowcount:,} rows")
+    cursor.execute(reviews_sql(options))
+    print(f"reviews: {cursor.rowcount:,} rows")
+    con.commit()
+
+    cursor.execute("SET session_replication_role = DEFAULT;")
+    for definition in indexes:
+        cursor.execute(definition)
+    for table in ("categories", "users", "businesses", "services", "staffmembers", "bookings"):
+        set_sequence(cursor, table)
+    # Ids may repeat those of an earlier dataset, so invalidate all catalog ETags at once
+    cursor.execute(f"UPDATE entity_versions SET version = {NEW_VERSION_SQL} WHERE entity = 'epoch';")
+    con.commit()
+    con.autocommit = True
+    cursor.execute("ANALYZE;")
+    cursor.close()
+    con.close()
+    print(f"Done in {time.perf_counter() - started:.0f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(generate(parse_args(sys.argv[1:])))
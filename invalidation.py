@@ -0,0 +1,117 @@
+"""
+Keeps the in-process caches of every worker in step with writes made by other workers.
+db.notify_change() sends a NOTIFY in each write's transaction, so it is delivered when
+the write commits; every worker runs one listener thread that turns those messages
+into cache invalidations.
+If the listener loses its connection it may have missed messages, so every cache is
+flushed when it reconnects.
+"""
+
+import json
+import logging
+import select
+import threading
+
+import psycopg2
+
+import db
+from db_setup import get_connection
+
+logger = logging.getLogger(__name__)
+
+TABLE_ENTITIES = {table: entity for entity, table in db.ENTITY_TABLES.items()}
+RECONNECT_DELAY_SECONDS = 1
+MAX_RECONNECT_DELAY_SECONDS = 30
+
+# Callbacks taking (table, id, business_id), or (None, None, None) for "flush everything"
+_subscribers = []
+_stop = threading.Event()
+_thread = None
+
+
+def subscribe(callback):
+    """
+    Registers a callback for every change, local or from another worker.
+    """
+    _subscribers.append(callback)
+
+
+def _invalidate_entity_cache(table, entity_id, business_id):
+    if table is None:
+        db.entity_cache.clear()
+    elif table in TABLE_ENTITIES:
+        db.invalidate_entity(TABLE_ENTITIES[table], entity_id)
+
+
+subscribe(_invalidate_entity_cache)
+
+
+def dispatch(table, entity_id=None, business_id=None):
+    """
+    Passes one change to every subscriber. A failing subscriber doesn't stop the others.
+    """
+    for callback in _subscribers:
+        try:
+            callback(table, entity_id, business_id)
+        except Exception:
+            logger.exception("Cache invalidation callback failed")
+
+
+def flush_all():
+    dispatch(None)
+
+
+def _handle(payload: str):
+    try:
+        change = json.loads(payload)
+        dispatch(change["table"], change.get("id"), change.get("business_id"))
+    except (ValueError, KeyError, TypeError):
+        # We can't tell what changed, so assume everything did
+        logger.warning("Malformed change notification %r, flushing caches", payload)
+        flush_all()
+
+
+def _listen():
+    delay = RECONNECT_DELAY_SECONDS
+    while not _stop.is_set():
+        con = None
+        try:
+            con = get_connection()
+            con.autocommit = True
+            with con.cursor() as cursor:
+                cursor.execute(f"LISTEN {db.CHANGES_CHANNEL};")
+            # Anything may have changed while nobody was listening
+            flush_all()
+            delay = RECONNECT_DELAY_SECONDS
+            while not _stop.is_set():
+                if select.select([con], [], [], 1) == ([], [], []):
+                    continue
+                con.poll()
+                while con.notifies:
+                    _handle(con.notifies.pop(0).payload)
+        except psycopg2.Error:
+            logger.warning("Change listener lost its connection, retrying in %ss", delay)
+            flush_all()
+            _stop.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+        finally:
+            if con is not None:
+                con.close()
+
+
+def start_listener():
+    """
+    Starts the listener thread for this worker. Safe to call more than once.
+    """
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_listen, name="cache-invalidation", daemon=True)
+    _thread.start()
+
+
+def stop_listener():
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
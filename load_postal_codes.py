@@ -0,0 +1,58 @@
+import sys
+
+from db import NEW_VERSION_SQL
+from db_setup import get_connection
+
+
+def load_postal_codes(path: str):
+    """
+    Loads postal code centroids from a CSV file with the header
+    postal_code,latitude,longitude into postal_code_centroids,
+    then re-locates every business from its postal code.
+    Postal codes are stored without spaces, so "111 34" and "11134" match.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    cursor.execute("""
+    CREATE TEMP TABLE postal_code_staging (
+        postal_code TEXT,
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION
+    ) ON COMMIT DROP;
+    """)
+    with open(path, encoding="utf-8") as file:
+        cursor.copy_expert(
+            "COPY postal_code_staging FROM STDIN WITH (FORMAT csv, HEADER true);",
+            file,
+        )
+
+    cursor.execute("""
+    INSERT INTO postal_code_centroids (postal_code, latitude, longitude)
+    SELECT DISTINCT ON (REPLACE(postal_code, ' ', ''))
+        REPLACE(postal_code, ' ', ''), latitude, longitude
+    FROM postal_code_staging
+    WHERE postal_code IS NOT NULL
+    ON CONFLICT (postal_code)
+    DO UPDATE SET latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude;
+    """)
+    loaded = cursor.rowcount
+
+    # Touch postal_code so the businesses_locate trigger picks up the new centroids
+    cursor.execute("UPDATE businesses SET postal_code = postal_code;")
+    located = cursor.rowcount
+
+    # Every business may have moved, so invalidate all catalog ETags at once
+    cursor.execute(f"UPDATE entity_versions SET version = {NEW_VERSION_SQL} WHERE entity = 'epoch';")
+
+    connection.commit()
+    cursor.close()
+    connection.close()
+    print(f"Loaded {loaded} postal codes, re-located {located} businesses.")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python load_postal_codes.py <postal_codes.csv>")
+        sys.exit(1)
+    load_postal_codes(sys.argv[1])
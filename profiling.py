@@ -0,0 +1,277 @@
+"""
+Opt-in profiling of requests with cProfile, for finding out where one slow route
+spends its time on a staging or production instance. Two ways, configured in .env:
+
+PROFILE_TOKEN=<secret>
+    A request with the header "X-Profile: <secret>" (or ?profile=<secret>) runs under
+    cProfile. The response gets an X-Profile-Id header; GET /profiles/<id> with the
+    same header returns the top functions as text, and ?format=prof the pstats file
+    for snakeviz, flameprof (flame graphs) or pstats.
+
+PROFILE_SAMPLE_EVERY=<n>
+    Every n-th request of each sync route is profiled and added to that route's
+    running total, saved as sampled-<pid>-<route>.prof, so the profile shows where
+    typical requests of the route spend their time. Totals are kept in memory and
+    written when /profiles is read, and otherwise at most once a minute.
+    Async routes (e.g. image uploads) are not sampled: they share the event loop
+    thread with every other request, so a profile of one would contain them all.
+    Profile those on demand.
+
+Profiles are stored in PROFILE_DIR (default "profiles"), one set per worker process.
+With neither setting nothing is installed, so requests pay nothing. With them, an
+unprofiled request pays one header check and one context variable lookup.
+
+cProfile only sees the thread it was started in, so sync routes (run in the thread
+pool) are profiled in their own thread and merged with the profile of the event loop
+thread (middleware, serialization). The event loop part also contains whatever other
+requests did at the same time, so profile on a quiet instance when possible.
+"""
+
+import contextvars
+import cProfile
+import hmac
+import inspect
+import io
+import itertools
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+from fastapi.routing import APIRoute
+
+load_dotenv(override=True)
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN") or None
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY") or 0)
+PROFILE_DIR = os.getenv("PROFILE_DIR") or "profiles"
+
+# Ids handed out in X-Profile-Id and the names of sampled profiles; nothing else is served
+_PROFILE_NAME = re.compile(r"^[\w.-]+\.prof$")
+
+
+class RequestProfile:
+    """
+    The cProfile runs belonging to one on-demand profiled request.
+    """
+
+    def __init__(self):
+        self.name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}.prof"
+        self.profiles = []
+
+    def save(self, label: str):
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stats.dump_stats(os.path.join(PROFILE_DIR, self.name))
+        with open(os.path.join(PROFILE_DIR, self.name.removesuffix(".prof") + ".txt"), "w") as file:
+            file.write(label + "\n")
+
+
+# The on-demand profile of the current request; thread pool calls see it as well
+_current = contextvars.ContextVar("request_profile", default=None)
+
+# Only one on-demand profile at a time per worker: two profilers in one thread would
+# replace each other
+_on_demand_lock = threading.Lock()
+
+# route path -> pstats.Stats of its sampled requests, and how many there were
+_sampled = {}
+_sampled_counts = {}
+_sampled_lock = threading.Lock()
+# routes with samples not yet written to PROFILE_DIR, and when they last were
+_unsaved = set()
+_last_save = time.monotonic()
+SAVE_SAMPLES_EVERY_SECONDS = 60
+
+
+def authorized(scope) -> bool:
+    """
+    Whether the request carries the profiling token, in X-Profile or ?profile=.
+    """
+    if PROFILE_TOKEN is None:
+        return False
+    token = next((value for name, value in scope["headers"] if name == b"x-profile"), None)
+    if token is None and b"profile=" in scope.get("query_string", b""):
+        for part in scope["query_string"].split(b"&"):
+            name, _, value = part.partition(b"=")
+            if name == b"profile":
+                token = value
+    return token is not None and hmac.compare_digest(token, PROFILE_TOKEN.encode())
+
+
+class ProfilingMiddleware:
+    """
+    Runs requests carrying the token under cProfile. Added by install(), outermost.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not authorized(scope) or not _on_demand_lock.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: another profiler (a sampled request in the thread pool) is running
+            _on_demand_lock.release()
+            return await self.app(scope, receive, send)
+        request_profile = RequestProfile()
+        token = _current.set(request_profile)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"x-profile-id", request_profile.name.encode())
+                ]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.disable()
+            request_profile.profiles.append(profile)
+            _current.reset(token)
+            _on_demand_lock.release()
+            request_profile.save(f"{scope['method']} {scope['path']}")
+
+
+def _profiled_call(profiles: list, function, args, kwargs):
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ profiles all threads from one profiler, which is already running
+        return function(*args, **kwargs)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profile.disable()
+        profiles.append(profile)
+
+
+def _save_samples():
+    """
+    Writes the sampled totals that changed since the last save. Call with _sampled_lock held.
+    """
+    global _last_save
+    for route_path in _unsaved:
+        slug = re.sub(r"[^\w-]+", "_", route_path).strip("_") or "root"
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"sampled-{os.getpid()}-{slug}"
+        _sampled[route_path].dump_stats(os.path.join(PROFILE_DIR, name + ".prof"))
+        with open(os.path.join(PROFILE_DIR, name + ".txt"), "w") as file:
+            file.write(f"{_sampled_counts[route_path]} sampled requests of {route_path}\n")
+    _unsaved.clear()
+    _last_save = time.monotonic()
+
+
+def _add_sample(route_path: str, profile: cProfile.Profile):
+    with _sampled_lock:
+        stats = _sampled.get(route_path)
+        if stats is None:
+            stats = _sampled[route_path] = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+        _sampled_counts[route_path] = _sampled_counts.get(route_path, 0) + 1
+        _unsaved.add(route_path)
+        # so the totals of workers that never serve /profiles reach the disk as well
+        if time.monotonic() - _last_save >= SAVE_SAMPLES_EVERY_SECONDS:
+            _save_samples()
+
+
+def _wrap_endpoint(route_path: str, function):
+    """
+    Wraps a sync endpoint so it is profiled in the thread pool thread it runs in:
+    for an on-demand profiled request, and every PROFILE_SAMPLE_EVERY-th call.
+    """
+    counter = itertools.count(1)
+
+    def endpoint(*args, **kwargs):
+        request_profile = _current.get()
+        if request_profile is not None:
+            return _profiled_call(request_profile.profiles, function, args, kwargs)
+        if PROFILE_SAMPLE_EVERY and next(counter) % PROFILE_SAMPLE_EVERY == 0:
+            profiles = []
+            try:
+                return _profiled_call(profiles, function, args, kwargs)
+            finally:
+                if profiles:
+                    _add_sample(route_path, profiles[0])
+        return function(*args, **kwargs)
+
+    endpoint.__wrapped__ = function
+    return endpoint
+
+
+def install(app):
+    """
+    Sets up profiling for the app if PROFILE_TOKEN or PROFILE_SAMPLE_EVERY is set.
+    Call it after every route has been added.
+    """
+    if PROFILE_TOKEN is None and not PROFILE_SAMPLE_EVERY:
+        return
+    for route in app.routes:
+        # async routes run in the event loop thread, which the middleware already profiles
+        if isinstance(route, APIRoute) and not inspect.iscoroutinefunction(route.dependant.call):
+            # the request handler looks up dependant.call on every request
+            route.dependant.call = _wrap_endpoint(route.path, route.dependant.call)
+    if PROFILE_TOKEN is not None:
+        app.add_middleware(ProfilingMiddleware)
+
+
+def list_profiles():
+    """
+    The stored profiles of every worker, newest first, and this worker's sample counts.
+    """
+    with _sampled_lock:
+        _save_samples()
+    files = []
+    if os.path.isdir(PROFILE_DIR):
+        for name in os.listdir(PROFILE_DIR):
+            if _PROFILE_NAME.match(name):
+                path = os.path.join(PROFILE_DIR, name)
+                label_path = path.removesuffix(".prof") + ".txt"
+                label = None
+                if os.path.exists(label_path):
+                    with open(label_path) as file:
+                        label = file.read().strip()
+                files.append({
+                    "id": name,
+                    "request": label,
+                    "bytes": os.path.getsize(path),
+                    "modified": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(os.path.getmtime(path))),
+                })
+    files.sort(key=lambda entry: entry["modified"], reverse=True)
+    with _sampled_lock:
+        sampled = dict(_sampled_counts)
+    return {"sample_every": PROFILE_SAMPLE_EVERY, "sampled_requests": sampled, "profiles": files}
+
+
+def profile_path(name: str):
+    """
+    Path of a stored profile, or None if there is no profile with that id.
+    """
+    if not _PROFILE_NAME.match(name):
+        return None
+    if name.startswith("sampled-"):
+        with _sampled_lock:
+            _save_samples()
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def summary(path: str, limit: int = 60):
+    """
+    The functions with the most cumulative time, as pstats prints them.
+    """
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,196 @@
+"""
+Per-request accounting of where the time went: SQL statements and the time spent
+in them, time spent opening connections and time spent rendering JSON.
+The numbers are sent back in a Server-Timing header and written to an access log line.
+
+Statements are counted at the cursor, not per db.py function, so a function that
+runs one query per row (an N+1) shows up as a high query count right away.
+Outside a request (scripts, background threads) nothing is recorded.
+"""
+
+import contextvars
+import json
+import logging
+import time
+
+import psycopg2.extensions
+from fastapi.responses import JSONResponse
+
+# One JSON object per line on stderr, unless the deployment configures app.access itself
+access_logger = logging.getLogger("app.access")
+if not access_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    access_logger.addHandler(_handler)
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+
+
+class RequestTimings:
+    __slots__ = ("queries", "db_seconds", "connect_seconds", "serialize_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.connect_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+
+# Sync routes run in a thread pool, which copies the context, so they share this object
+current = contextvars.ContextVar("request_timings", default=None)
+
+
+def record_connect(seconds: float):
+    timings = current.get()
+    if timings is not None:
+        timings.connect_seconds += seconds
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(factory):
+    """
+    A subclass of the given cursor class that counts and times its statements.
+    """
+    timed = _timed_cursor_classes.get(factory)
+    if timed is not None:
+        return timed
+
+    class TimedCursor(factory):
+        def execute(self, query, vars=None):
+            timings = current.get()
+            if timings is None:
+                return super().execute(query, vars)
+            start = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                timings.queries += 1
+                timings.db_seconds += time.perf_counter() - start
+
+        def executemany(self, query, vars_list):
+            timings = current.get()
+            if timings is None:
+                return super().executemany(query, vars_list)
+            start = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                timings.queries += 1
+                timings.db_seconds += time.perf_counter() - start
+
+        def copy_expert(self, sql, file, size=8192):
+            timings = current.get()
+            if timings is None:
+                return super().copy_expert(sql, file, size)
+            start = time.perf_counter()
+            try:
+                return super().copy_expert(sql, file, size)
+            finally:
+                timings.queries += 1
+                timings.db_seconds += time.perf_counter() - start
+
+    TimedCursor.__name__ = f"Timed{factory.__name__}"
+    _timed_cursor_classes[factory] = TimedCursor
+    return TimedCursor
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """
+    Connection class for get_connection: every cursor it hands out is timed,
+    whatever cursor_factory the caller asked for.
+    """
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _timed_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+class TimedJSONResponse(JSONResponse):
+    """
+    The app's default response class; times turning the route's result into JSON bytes.
+    """
+
+    def render(self, content) -> bytes:
+        start = time.perf_counter()
+        try:
+            return super().render(content)
+        finally:
+            timings = current.get()
+            if timings is not None:
+                timings.serialize_seconds += time.perf_counter() - start
+
+
+def query_budget(max_queries: int):
+    """
+    Declares how many SQL statements one request to a route may run, with cold caches.
+    Put it directly above the route function (under @app.get); check_query_budgets.py
+    runs every route against a seeded database and fails when a budget is exceeded.
+    """
+    def decorator(route):
+        route.query_budget = max_queries
+        return route
+    return decorator
+
+
+def _server_timing(timings: RequestTimings, total_seconds: float):
+    return ", ".join([
+        f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.queries} queries"',
+        f"connect;dur={timings.connect_seconds * 1000:.1f}",
+        f"serialize;dur={timings.serialize_seconds * 1000:.1f}",
+        f"total;dur={total_seconds * 1000:.1f}",
+    ])
+
+
+class ServerTimingMiddleware:
+    """
+    Starts the accounting for each request, adds the Server-Timing header when the
+    response starts and writes one JSON access log line when it has been sent.
+    Streamed responses keep querying after the headers are sent, so for those
+    only the log line has the final numbers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings = RequestTimings()
+        token = current.set(timings)
+        start = time.perf_counter()
+        status = 500
+        sent_bytes = 0
+
+        async def send_with_timing(message):
+            nonlocal status, sent_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = _server_timing(timings, time.perf_counter() - start)
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"server-timing", header.encode("latin-1"))
+                ]}
+            elif message["type"] == "http.response.body":
+                sent_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current.reset(token)
+            total_seconds = time.perf_counter() - start
+            route = scope.get("route")
+            access_logger.info(json.dumps({
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route.path if route is not None and hasattr(route, "path") else scope.get("route_template"),
+                "status": status,
+                "bytes": sent_bytes,
+                "duration_ms": round(total_seconds * 1000, 2),
+                "queries": timings.queries,
+                "db_ms": round(timings.db_seconds * 1000, 2),
+                "connect_ms": round(timings.connect_seconds * 1000, 2),
+                "serialize_ms": round(timings.serialize_seconds * 1000, 2),
+            }))
@@ -0,0 +1,346 @@
+"""
+Whole-response cache for public GET routes, as ASGI middleware.
+
+Every cached route has a ttl (seconds the response is fresh) and a stale window
+(seconds after that it may still be served). A stale hit is answered immediately
+while one background request refreshes the entry, so once an entry is warm the
+route itself is never on a caller's critical path. Misses for the same key are
+coalesced, so a cold entry is computed once however many callers are waiting.
+
+Writes announced through invalidation.py mark the entries of the routes that
+depend on the changed table as stale; they are refreshed on their next hit.
+All entries share one byte budget and the least recently used ones go first.
+
+Bodies above MIN_COMPRESS_BYTES are compressed once when they are stored, with gzip
+and with brotli/zstd when those packages are installed, and every hit picks the
+best encoding the client accepts. Compressed copies count against the budget.
+"""
+
+import asyncio
+import gzip
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+import singleflight
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Request headers that would change what the route itself returns;
+# the cache always fetches the full response and answers these on its own.
+_CONDITIONAL_HEADERS = {b"if-none-match", b"if-modified-since"}
+# Response headers set per response by the middleware
+_OWN_HEADERS = {b"cache-control", b"age", b"x-cache", b"content-length", b"vary"}
+
+# Small bodies fit in a packet or two anyway, compressing them only costs CPU
+MIN_COMPRESS_BYTES = 1024
+
+# Compressing happens once per stored version, so higher levels than usual pay off.
+# Preferred first when the client accepts several equally.
+COMPRESSORS = {}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=9)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = lambda body: zstandard.ZstdCompressor(level=12).compress(body)
+COMPRESSORS["gzip"] = lambda body: gzip.compress(body, compresslevel=9, mtime=0)
+
+logger = logging.getLogger(__name__)
+
+
+def _compile(path_template: str):
+    """
+    "/businesses/{business_id}/services" -> a regex matching /businesses/<anything>/services
+    """
+    parts = re.split(r"(\{[^/]+\})", path_template)
+    pattern = "".join("[^/]+" if part.startswith("{") else re.escape(part) for part in parts)
+    return re.compile(f"^{pattern}$")
+
+
+class ResponseCache:
+    """
+    The stored responses and their per-route settings.
+    routes maps a path template like "/businesses/{business_id}/services" to
+    {"ttl": ..., "stale": ..., "params": (...), "tables": (...)}:
+    params are the query parameters that may vary (requests with any other
+    parameter bypass the cache) and tables are the tables whose changes make
+    the route's entries stale.
+    """
+
+    def __init__(self, routes: dict, max_bytes: int = 64 * 1024 * 1024):
+        self.routes = [(_compile(template), template, config) for template, config in routes.items()]
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()  # invalidations arrive on the listener thread
+        # Bumped by mark_stale, so a fetch that raced with a write is stored as stale
+        self.generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def match(self, scope):
+        """
+        Returns (route config, cache key) for a cacheable request, or None.
+        """
+        for pattern, template, config in self.routes:
+            if pattern.match(scope["path"]):
+                scope["route_template"] = template  # for metrics of requests answered here
+                query = parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+                if any(name not in config["params"] for name, _ in query):
+                    return None
+                return config, (scope["path"], urlencode(sorted(query)))
+        return None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if entry["size"] > self.max_entry_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old["size"]
+            self._entries[key] = entry
+            self._size += entry["size"]
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted["size"]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._size = 0
+
+    def mark_stale(self, table, entity_id=None, business_id=None):
+        """
+        invalidation.py callback: entries of routes that read the changed table stay
+        servable, but the next hit starts a refresh. table None marks everything.
+        """
+        stale_paths = [
+            pattern for pattern, _, config in self.routes if table is None or table in config["tables"]
+        ]
+        if not stale_paths:
+            return
+        with self._lock:
+            self.generation += 1
+            for (path, _), entry in self._entries.items():
+                if any(pattern.match(path) for pattern in stale_paths):
+                    entry["fresh_until"] = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class ResponseCacheMiddleware:
+    """
+    Serves GET requests for the routes of a ResponseCache from it.
+    Add it before CORSMiddleware, so CORS headers are added per request and never cached.
+    """
+
+    def __init__(self, app, cache: ResponseCache):
+        self.app = app
+        self.cache = cache
+        self._refreshing = set()
+        self._tasks = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+        match = self.cache.match(scope)
+        if match is None:
+            return await self.app(scope, receive, send)
+        config, key = match
+
+        now = time.monotonic()
+        entry = self.cache.get(key)
+        if entry is not None and now < entry["fresh_until"]:
+            self.cache.hits += 1
+            return await self._send(scope, send, entry, config, "HIT")
+        if entry is not None and now < entry["stale_until"]:
+            self.cache.stale_hits += 1
+            self._refresh_in_background(key, scope, config)
+            return await self._send(scope, send, entry, config, "STALE")
+
+        self.cache.misses += 1
+        entry = await singleflight.do_async(("response", key), lambda: self._fetch(key, scope, config))
+        await self._send(scope, send, entry, config, "MISS")
+
+    async def _fetch(self, key, scope, config):
+        """
+        Runs the route with a clean copy of the request and stores a 200 response.
+        """
+        generation = self.cache.generation
+        clean_scope = dict(scope)
+        clean_scope["headers"] = [
+            (name, value) for name, value in scope["headers"] if name not in _CONDITIONAL_HEADERS
+        ]
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Nobody disconnects from an internal request; wait until the response is done
+            await asyncio.Event().wait()
+
+        start = {}
+        body = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                body.append(message.get("body", b""))
+
+        await self.app(clean_scope, receive, send)
+        now = time.monotonic()
+        entry = {
+            "status": start["status"],
+            "headers": [
+                (name, value) for name, value in start.get("headers", []) if name.lower() not in _OWN_HEADERS
+            ],
+            "body": b"".join(body),
+            "stored_at": now,
+            "fresh_until": now + config["ttl"],
+            "stale_until": now + config["ttl"] + config["stale"],
+        }
+        entry["encoded"] = {}
+        already_encoded = any(name.lower() == b"content-encoding" for name, _ in entry["headers"])
+        if entry["status"] == 200 and len(entry["body"]) >= MIN_COMPRESS_BYTES and not already_encoded:
+            # off the event loop, big payloads take a few milliseconds per encoding
+            entry["encoded"] = await asyncio.to_thread(_compress, entry["body"])
+        entry["size"] = (
+            len(entry["body"])
+            + sum(len(body) for body in entry["encoded"].values())
+            + sum(len(name) + len(value) for name, value in entry["headers"])
+        )
+        if generation != self.cache.generation:
+            entry["fresh_until"] = 0
+        if entry["status"] == 200:
+            self.cache.put(key, entry)
+        return entry
+
+    def _refresh_in_background(self, key, scope, config):
+        # Only touched from the event loop, so no lock needed
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def refresh():
+            try:
+                await self._fetch(key, scope, config)
+            except Exception:
+                logger.exception("Background refresh of %s failed", key[0])
+            finally:
+                self._refreshing.discard(key)
+
+        # keep a reference, the event loop only holds tasks weakly
+        task = asyncio.ensure_future(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, scope, send, entry, config, state: str):
+        now = time.monotonic()
+        max_age = max(0, int(entry["fresh_until"] - now))
+        headers = list(entry["headers"])
+        body = entry["body"]
+        encoding = _choose_encoding(scope, entry["encoded"])
+        if encoding:
+            body = entry["encoded"][encoding]
+            # each encoding is its own representation, so it gets its own strong ETag
+            headers = [
+                (name, _encoded_etag(value, encoding) if name.lower() == b"etag" else value)
+                for name, value in headers
+            ]
+            headers.append((b"content-encoding", encoding.encode()))
+        headers += [
+            (b"cache-control", f"public, max-age={max_age}, stale-while-revalidate={config['stale']}".encode()),
+            (b"vary", b"Accept-Encoding"),
+            (b"age", str(int(now - entry["stored_at"])).encode()),
+            (b"x-cache", state.encode()),
+        ]
+        status = entry["status"]
+        if status == 200 and _etag_matches(scope, headers):
+            status, body = 304, b""
+            headers = [
+                (name, value) for name, value in headers
+                if name.lower() not in (b"content-type", b"content-encoding")
+            ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+def _compress(body: bytes):
+    return {encoding: compress(body) for encoding, compress in COMPRESSORS.items()}
+
+
+def _encoded_etag(etag: bytes, encoding: str):
+    # "123-456" -> "123-456-gzip", keeping a W/ prefix if there is one
+    return etag[:-1] + b"-" + encoding.encode() + b'"' if etag.endswith(b'"') else etag
+
+
+def _choose_encoding(scope, encoded: dict):
+    """
+    Picks the stored encoding with the highest q-value in Accept-Encoding,
+    or None for the uncompressed body.
+    """
+    if not encoded:
+        return None
+    header = next((value for name, value in scope["headers"] if name == b"accept-encoding"), b"")
+    accepted = {}
+    for part in header.decode("latin-1").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in encoded:  # in COMPRESSORS order, so ties go to the better codec
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _etag_matches(scope, headers):
+    etag = next((value for name, value in headers if name.lower() == b"etag"), None)
+    if_none_match = next((value for name, value in scope["headers"] if name == b"if-none-match"), None)
+    if etag is None or if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix(b"W/") for tag in if_none_match.split(b",")]
+    return b"*" in tags or etag in tags
@@ -9,6 +9,37 @@ from typing import List, Optional
 from pydantic import BaseModel, Field
 
 
+# SQL that renders a column the way Pydantic serializes the matching Python type.
+# Postgres' own JSON output drops trailing zeros from fractional seconds ("...:00.12"),
+# Pydantic always writes six digits ("...:00.120000") and none for whole seconds.
+_JSON_COLUMN_SQL = {
+    Decimal: "{}::text",
+    datetime: "to_char({0}, CASE WHEN {0} = date_trunc('second', {0})"
+              " THEN 'YYYY-MM-DD\"T\"HH24:MI:SS' ELSE 'YYYY-MM-DD\"T\"HH24:MI:SS.US' END)",
+    time: "to_char({0}::interval, CASE WHEN {0}::interval = date_trunc('second', {0}::interval)"
+          " THEN 'HH24:MI:SS' ELSE 'HH24:MI:SS.US' END)",
+}
+
+
+def json_fields(model):
+    """
+    Maps every field of a response model to the SQL expression (a template for the
+    column, or None for the column as is) that makes Postgres render it the same way
+    FastAPI would serialize the model, for db.fetch_json_array.
+    Pydantic writes Decimal as a JSON string, so Decimal fields are cast to text.
+    """
+    fields = {}
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        for python_type, sql in _JSON_COLUMN_SQL.items():
+            if annotation in (python_type, Optional[python_type]):
+                fields[name] = sql
+                break
+        else:
+            fields[name] = None
+    return fields
+
+
 #-----------------#
 #-----BUSINESS----#
 #-----------------#
@@ -50,12 +81,20 @@ class BusinessOut(BusinessBase):
     """
     id: int
     owner_id: int
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
     created_at: datetime
 
 class BusinessDetail(BusinessOut):
     owner_name: str
     main_category_name: Optional[str] = None
 
+class BusinessNearbyOut(BusinessDetail):
+    """
+    A business returned by the proximity search, with its distance from the search point.
+    """
+    distance_km: float
+
 
 #-----------------#
 #-------USERS-----#
@@ -262,6 +301,82 @@ class ServiceDetail(ServiceBase):
     business_name:str
     categories: List[CategoryOut] = []
     
+class ServiceFilterOut(ServiceBase):
+    """
+    A service returned by the faceted filter, with its business name and city.
+    """
+    id: int
+    business_id: int
+    business_name: str
+    city: Optional[str] = None
+
+
+class CategoryFacet(BaseModel):
+    id: int
+    name: str
+    count: int
+
+
+class CityFacet(BaseModel):
+    city: Optional[str] = None
+    count: int
+
+
+class ActiveFacet(BaseModel):
+    is_active: Optional[bool] = None
+    count: int
+
+
+class RangeFacet(BaseModel):
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+
+class ServiceFacets(BaseModel):
+    """
+    Facet counts for the service filter. Each facet ignores its own filter.
+    """
+    categories: list[CategoryFacet]
+    cities: list[CityFacet]
+    is_active: list[ActiveFacet]
+    price: RangeFacet
+    duration: RangeFacet
+
+
+class ServiceFilterResponse(BaseModel):
+    """
+    A page of filtered services together with the facet counts.
+    """
+    total: int
+    limit: int
+    offset: int
+    results: list[ServiceFilterOut]
+    facets: ServiceFacets
+
+class StaffServicePair(BaseModel):
+    staff_id: int
+    service_id: int
+
+
+class ServiceCategoryPair(BaseModel):
+    service_id: int
+    category_id: int
+
+
+class StaffServiceBatch(BaseModel):
+    """
+    Many staff-service assignments, added or removed in one request.
+    """
+    pairs: list[StaffServicePair]
+
+
+class ServiceCategoryBatch(BaseModel):
+    """
+    Many service-category links, added or removed in one request.
+    """
+    pairs: list[ServiceCategoryPair]
+
+
 #-----------------#
 #-----BOOKINGS----#
 #-----------------#
@@ -393,3 +508,39 @@ class AvailableSlotsOut(BaseModel):
     service_duration: int
     available_slots: list[str]
 
+
+class SearchResultOut(BaseModel):
+    """
+    One full-text search hit, either a business or a service.
+    """
+    type: str
+    id: int
+    business_id: int
+    name: str
+    description: Optional[str] = None
+    business_name: str
+    city: Optional[str] = None
+    rank: float
+
+
+class SearchResponse(BaseModel):
+    """
+    A ranked page of search hits plus the total number of hits.
+    """
+    query: str
+    total: int
+    limit: int
+    offset: int
+    results: list[SearchResultOut]
+
+
+class AutocompleteSuggestion(BaseModel):
+    """
+    One autocomplete suggestion for the search box.
+    type is business, service or category.
+    """
+    type: str
+    id: int
+    name: str
+    similarity: float
+    popularity: int
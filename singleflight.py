@@ -0,0 +1,100 @@
+"""
+Request coalescing for expensive reads: while one computation for a key is running,
+identical calls wait for it and share its result (or its exception) instead of
+running the same query again. Nothing is kept once the computation has finished,
+so this never serves anything older than the slowest concurrent caller would see.
+
+Sync routes run in FastAPI's thread pool and are coalesced with threads,
+async routes are coalesced with tasks on the worker's event loop.
+"""
+
+import asyncio
+import functools
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+_tasks = {}
+
+# Shared results vs. total calls, for seeing whether coalescing pays off
+stats = {"calls": 0, "shared": 0}
+
+
+def do(key, compute):
+    """
+    Runs compute() once per key at a time; concurrent callers with the same key
+    block until it finishes and get the same result. The key must be hashable.
+    """
+    with _calls_lock:
+        stats["calls"] += 1
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+        else:
+            call.waiters += 1
+            stats["shared"] += 1
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = compute()
+        return call.result
+    except Exception as error:
+        call.error = error
+        raise
+    finally:
+        with _calls_lock:
+            del _calls[key]
+        call.done.set()
+
+
+async def do_async(key, compute):
+    """
+    The async version of do(): compute is a zero-argument coroutine function.
+    A waiter that is cancelled (client went away) doesn't cancel the shared task.
+    """
+    stats["calls"] += 1
+    task = _tasks.get(key)
+    if task is None:
+        task = asyncio.ensure_future(compute())
+        _tasks[key] = task
+        task.add_done_callback(lambda _: _tasks.pop(key, None))
+    else:
+        stats["shared"] += 1
+    return await asyncio.shield(task)
+
+
+def coalesce(route):
+    """
+    Per-route opt-in: @coalesce under @app.get(...) shares one computation between
+    concurrent requests with the same query parameters.
+    Only for routes whose parameters are plain values (no Request, Response or body)
+    and whose result doesn't depend on who asks.
+    """
+    def key(kwargs):
+        return (route.__module__, route.__qualname__, tuple(sorted(kwargs.items())))
+
+    if asyncio.iscoroutinefunction(route):
+        @functools.wraps(route)
+        async def async_wrapper(**kwargs):
+            return await do_async(key(kwargs), lambda: route(**kwargs))
+        return async_wrapper
+
+    @functools.wraps(route)
+    def wrapper(**kwargs):
+        return do(key(kwargs), lambda: route(**kwargs))
+    return wrapper
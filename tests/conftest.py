@@ -0,0 +1,49 @@
+"""
+The tests run against the database from .env, seeded with insert_data.py or
+generate_data.py, and are skipped when it can't be reached.
+Anything a test writes, it removes again.
+"""
+
+import os
+import sys
+
+import psycopg2
+import pytest
+
+# The app's modules live in the repository root, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_setup import get_connection  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def con():
+    try:
+        connection = get_connection()
+    except psycopg2.OperationalError as error:
+        pytest.skip(f"No database: {error}")
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(scope="session")
+def client(con):
+    from fastapi.testclient import TestClient
+
+    import app
+
+    # Not used as a context manager, so startup events (the invalidation listener) don't run
+    return TestClient(app.app)
+
+
+def fetch_one(con, query: str, params=()):
+    """
+    Returns the first row of a query, or skips the test if there is none.
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+    if row is None:
+        pytest.skip("The database has no rows for this test; seed it first")
+    return row
@@ -0,0 +1,28 @@
+from conftest import fetch_one
+
+
+def test_deleting_a_business_changes_its_services_etags(client, con):
+    (owner_id,) = fetch_one(con, "SELECT id FROM users ORDER BY id LIMIT 1;")
+    response = client.post("/businesses/", json={"owner_id": owner_id, "name": "ETag Test Salong"})
+    assert response.status_code == 201
+    business_id = response.json()["business_id"]
+    try:
+        response = client.post("/services/", json={
+            "business_id": business_id,
+            "name": "ETag Test Klippning",
+            "duration_minutes": 30,
+            "price": 300,
+        })
+        assert response.status_code == 201
+        service_id = response.json()["id"]
+
+        response = client.get(f"/services/{service_id}")
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert client.get(f"/services/{service_id}", headers={"If-None-Match": etag}).status_code == 304
+
+        assert client.delete(f"/businesses/{business_id}").status_code == 204
+        response = client.get(f"/services/{service_id}", headers={"If-None-Match": etag})
+        assert response.status_code == 404
+    finally:
+        client.delete(f"/businesses/{business_id}")
@@ -0,0 +1,76 @@
+"""
+The list routes let Postgres render their JSON (db.fetch_json_array) instead of going
+through the response model, so these tests check that the result is exactly what
+FastAPI would have produced from the same rows with the model.
+"""
+
+import json
+from decimal import Decimal
+from typing import Optional
+
+import pytest
+from pydantic import TypeAdapter
+
+import db
+from schemas import BookingOut, BusinessDetail, PaymentOut, ReviewOut, json_fields
+
+# (route, model, rows through the model, JSON from Postgres, streamed JSON rows)
+FAST_PATHS = [
+    ("/businesses/", BusinessDetail, db.get_all_businesses, db.get_all_businesses_json, db.stream_all_businesses),
+    ("/bookings", BookingOut, db.get_bookings, db.get_bookings_json, db.stream_bookings),
+    ("/payments", PaymentOut, db.get_all_payments, db.get_all_payments_json, db.stream_all_payments),
+    ("/reviews", ReviewOut, db.get_all_reviews, db.get_all_reviews_json, db.stream_all_reviews),
+]
+IDS = [route for route, *_ in FAST_PATHS]
+
+
+def model_output(con, model, get_rows):
+    """
+    What the route returned before the fast path: the rows validated and dumped by the model.
+    """
+    rows = get_rows(con)
+    if not rows:
+        pytest.skip(f"The database has no rows for {model.__name__}; seed it first")
+    adapter = TypeAdapter(list[model])
+    return adapter.dump_python(adapter.validate_python(rows), mode="json")
+
+
+def assert_matches_model(model, expected, items):
+    assert len(items) == len(expected)
+    decimal_fields = [
+        name for name, field in model.model_fields.items()
+        if field.annotation in (Decimal, Optional[Decimal])
+    ]
+    for item in items:
+        assert set(item) == set(model.model_fields)
+        model.model_validate(item)
+        # Pydantic writes Decimal as a string, "350.00", never as a JSON number
+        for name in decimal_fields:
+            assert item[name] is None or isinstance(item[name], str)
+    # same values in the same format, datetimes included; compared by id since only the routes sort
+    assert sorted(items, key=lambda item: item["id"]) == sorted(expected, key=lambda item: item["id"])
+
+
+@pytest.mark.parametrize("route, model, get_rows, get_json, stream", FAST_PATHS, ids=IDS)
+def test_json_array_matches_model(con, route, model, get_rows, get_json, stream):
+    expected = model_output(con, model, get_rows)
+    assert_matches_model(model, expected, json.loads(get_json(con, json_fields(model))))
+
+
+@pytest.mark.parametrize("route, model, get_rows, get_json, stream", FAST_PATHS, ids=IDS)
+def test_streamed_rows_match_model(con, route, model, get_rows, get_json, stream):
+    expected = model_output(con, model, get_rows)
+    items = [json.loads(row) for chunk in stream(con, json_fields(model)) for row in chunk]
+    assert_matches_model(model, expected, items)
+
+
+@pytest.mark.parametrize("route, model, get_rows, get_json, stream", FAST_PATHS, ids=IDS)
+def test_routes_match_model(con, client, route, model, get_rows, get_json, stream):
+    expected = model_output(con, model, get_rows)
+    for params in ({}, {"stream": "json"}):
+        response = client.get(route, params=params)
+        assert response.status_code == 200
+        assert_matches_model(model, expected, response.json())
+    response = client.get(route, params={"stream": "ndjson"})
+    assert response.status_code == 200
+    assert_matches_model(model, expected, [json.loads(line) for line in response.text.splitlines() if line])
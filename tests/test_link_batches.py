@@ -0,0 +1,72 @@
+from conftest import fetch_one
+
+
+def service_version(con, service_id: int):
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(
+                "SELECT version FROM entity_versions WHERE entity = 'service' AND entity_id = %s;",
+                (service_id,),
+            )
+            row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def test_service_category_batch_add_and_remove(client, con):
+    service_id, category_id = fetch_one(con, """
+        SELECT services.id, categories.id
+        FROM services
+        CROSS JOIN categories
+        WHERE NOT EXISTS (
+            SELECT 1 FROM service_categories
+            WHERE service_categories.service_id = services.id
+                AND service_categories.category_id = categories.id
+        )
+        ORDER BY services.id, categories.id
+        LIMIT 1;
+    """)
+    pair = {"service_id": service_id, "category_id": category_id}
+    version = service_version(con, service_id)
+
+    response = client.post("/service-categories/batch", json={"pairs": [pair]})
+    assert response.status_code == 200
+    assert response.json() == {"added": [pair], "already_existed": []}
+    assert service_version(con, service_id) > version
+    version = service_version(con, service_id)
+
+    response = client.post("/service-categories/batch", json={"pairs": [pair]})
+    assert response.status_code == 200
+    assert response.json() == {"added": [], "already_existed": [pair]}
+
+    response = client.request("DELETE", "/service-categories/batch", json={"pairs": [pair]})
+    assert response.status_code == 200
+    assert response.json() == {"removed": [pair], "not_found": []}
+    assert service_version(con, service_id) > version
+
+    response = client.request("DELETE", "/service-categories/batch", json={"pairs": [pair]})
+    assert response.status_code == 200
+    assert response.json() == {"removed": [], "not_found": [pair]}
+
+
+def test_staff_service_batch_add_and_remove(client, con):
+    staff_id, service_id = fetch_one(con, """
+        SELECT staffmembers.id, services.id
+        FROM staffmembers
+        JOIN services ON services.business_id = staffmembers.business_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM staff_service
+            WHERE staff_service.staff_id = staffmembers.id
+                AND staff_service.service_id = services.id
+        )
+        ORDER BY staffmembers.id, services.id
+        LIMIT 1;
+    """)
+    pair = {"staff_id": staff_id, "service_id": service_id}
+
+    response = client.post("/staff-services/batch", json={"pairs": [pair]})
+    assert response.status_code == 200
+    assert response.json() == {"added": [pair], "already_existed": []}
+
+    response = client.request("DELETE", "/staff-services/batch", json={"pairs": [pair]})
+    assert response.status_code == 200
+    assert response.json() == {"removed": [pair], "not_found": []}
@@ -0,0 +1,19 @@
+"""
+Fails when a GET route runs more statements than its @query_budget or when its
+statement count grows with the number of rows it returns (an N+1).
+check_query_budgets.py prints the same check as a report.
+"""
+
+import pytest
+
+import check_query_budgets
+
+ROUTES = check_query_budgets.checked_routes()
+
+
+@pytest.mark.parametrize("route", ROUTES, ids=[route.path for route in ROUTES])
+def test_route_stays_within_query_budget(client, con, route):
+    problems, summary = check_query_budgets.check_route(client, con, route)
+    if problems == ["no sample data in the database"]:
+        pytest.skip("The database has no rows for this route; seed it first")
+    assert problems == [], summary